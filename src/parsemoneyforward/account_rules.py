@@ -0,0 +1,260 @@
+"""口座の分類ルール
+
+金融機関名とカテゴリから口座の役割（資産・負債・貯金・非表示）、給料日の残高の取得元、
+LINEの証券口座欄に表示するかどうかを決める。ルールはACCOUNT_RULES_PATHのJSONファイルに書き、
+ファイルがなければ従来の設定（三井住友銀行・三井住友カード・証券、固定費の環境変数）を使う。
+
+ルールの文字列はAho-Corasick法のオートマトンにまとめるため、口座名1件の分類は
+ルールの数によらず口座名の長さに比例する時間で済む。
+"""
+import json
+import os
+from collections import deque
+
+from accounts import AccountBook, normalize_name
+
+ACCOUNT_RULES_PATH = os.environ.get("ACCOUNT_RULES_PATH", "account-rules.json")
+
+# 役割 → Notionの「資産/負債」の選択肢
+ROLE_LABELS = {
+    "asset": "資産",
+    "liability": "負債",
+    "savings": "貯金",
+    "hidden": "非表示",
+}
+PAYDAY_SOURCES = ("bank", "card")
+
+DEFAULT_RULES = {
+    "accounts": [
+        {"category": "銀行", "institution": "三井住友銀行", "role": "asset", "payday": "bank"},
+        {"category": "カード", "institution": "三井住友カード", "role": "liability", "payday": "card"},
+        {"category": "証券", "role": "asset", "report": True},
+    ],
+    "entries": [
+        {"name": "お自炊", "icon": "🍳", "role": "liability", "amount_env": "FOOD_EXPENSE"},
+        {"name": "固定費", "icon": "🚰", "role": "liability", "amount_env": "FIXED_COST"},
+        {"name": "家賃", "icon": "🏠", "role": "liability", "amount_env": "HOUSE_RENT"},
+        {"name": "楽天銀行", "icon": "🎇", "role": "asset", "amount_env": "RAKUTEN_BANK"},
+        {"name": "お家銀行", "icon": "🧰", "role": "asset", "amount_env": "HOUSE_BANK"},
+    ],
+}
+
+
+class AhoCorasick:
+    """複数の文字列を1回の走査で探すオートマトン"""
+
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns (iterable of tuple): (文字列, 値)。同じ文字列に複数の値を登録できる。
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [set()]
+        for pattern, value in patterns:
+            self._insert(pattern, value)
+        self._build()
+
+    def _insert(self, pattern, value):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append(set())
+            state = next_state
+        self._outputs[state].add(value)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._outputs[next_state] |= self._outputs[self._fail[next_state]]
+
+    def search(self, text):
+        """textに含まれる文字列の値をすべて返す"""
+        found = set(self._outputs[0])
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            found |= self._outputs[state]
+        return found
+
+
+class AccountRule:
+    __slots__ = ("index", "category", "institution", "role", "payday", "report")
+
+    def __init__(self, index, role, category=None, institution=None, payday=None, report=False):
+        if role not in ROLE_LABELS:
+            raise ValueError(f"未対応の役割です: {role}")
+        if payday is not None and payday not in PAYDAY_SOURCES:
+            raise ValueError(f"未対応の給料日の取得元です: {payday}")
+        self.index = index
+        self.category = normalize_name(category) if category else None
+        self.institution = normalize_name(institution) if institution else None
+        self.role = role
+        self.payday = payday
+        self.report = report
+
+    @property
+    def label(self):
+        return ROLE_LABELS[self.role]
+
+    def __repr__(self):
+        return (
+            f"AccountRule(category={self.category!r}, institution={self.institution!r},"
+            f" role={self.role!r}, payday={self.payday!r}, report={self.report!r})"
+        )
+
+
+class AccountRules:
+    """口座の分類ルールと、給料日に作成する固定の行
+
+    口座は上から順に、カテゴリと金融機関名の両方（指定したもののみ）を含む最初のルールに分類する。
+    """
+
+    def __init__(self, config):
+        self.rules = [
+            AccountRule(
+                index,
+                rule["role"],
+                category=rule.get("category"),
+                institution=rule.get("institution"),
+                payday=rule.get("payday"),
+                report=rule.get("report", False),
+            )
+            for index, rule in enumerate(config.get("accounts", []))
+        ]
+        self.entries = config.get("entries", [])
+        for entry in self.entries:
+            if entry.get("role", "asset") not in ROLE_LABELS:
+                raise ValueError(f"未対応の役割です: {entry['role']}")
+
+        self._category_matcher = AhoCorasick(
+            (rule.category, rule.index) for rule in self.rules if rule.category
+        )
+        self._institution_matcher = AhoCorasick(
+            (rule.institution, rule.index) for rule in self.rules if rule.institution
+        )
+        # カテゴリも金融機関名も指定しないルール（すべての口座に当てはまる）
+        self._unconditional = {rule.index for rule in self.rules if not rule.category and not rule.institution}
+        self._cache = {}
+
+    @classmethod
+    def load(cls, path=None):
+        """ルールファイルを読み込む（ファイルがなければ従来の設定を使う）"""
+        path = path or ACCOUNT_RULES_PATH
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls(DEFAULT_RULES)
+
+    def classify(self, category, bank_name):
+        """口座に当てはまるルールを返す
+
+        Returns:
+            AccountRule: 当てはまったルール。どのルールにも当てはまらない場合はNone。
+        """
+        key = (category, bank_name)
+        if key in self._cache:
+            return self._cache[key]
+
+        category_hits = self._category_matcher.search(normalize_name(category))
+        institution_hits = self._institution_matcher.search(normalize_name(bank_name))
+        matched = None
+        # どちらかの文字列が見つかったルールだけを、ファイルでの順に確認する
+        for index in sorted(category_hits | institution_hits | self._unconditional):
+            rule = self.rules[index]
+            if rule.category and index not in category_hits:
+                continue
+            if rule.institution and index not in institution_hits:
+                continue
+            matched = rule
+            break
+        self._cache[key] = matched
+        return matched
+
+    def accounts(self, all_amount, predicate):
+        """ルールがpredicateを満たす口座を返す"""
+        for record in all_amount.records():
+            rule = self.classify(record.category, record.bank_name)
+            if rule is not None and predicate(rule):
+                yield record
+
+    def role(self, record):
+        """口座の役割（どのルールにも当てはまらない場合はNone）"""
+        rule = self.classify(record.category, record.bank_name)
+        return rule.role if rule is not None else None
+
+    def visible(self, all_amount):
+        """非表示（hidden）の口座を除いた口座の集合を返す"""
+        book = AccountBook()
+        for category in all_amount:
+            book.add_category(category)
+        for record in all_amount.records():
+            if self.role(record) != "hidden":
+                book.add(
+                    record.category, record.bank_name, record.number, record.balance,
+                    record.detail_url, record.updated_at,
+                )
+        return book
+
+    def role_totals(self, all_amount):
+        """役割ごとの口座の金額の合計（非表示と、どのルールにも当てはまらない口座は含めない）
+
+        Returns:
+            dict: 役割 → 合計
+        """
+        totals = {role: 0 for role in ROLE_LABELS if role != "hidden"}
+        for record in all_amount.records():
+            role = self.role(record)
+            if role in totals:
+                totals[role] += record.number
+        return totals
+
+    def payday_label(self, source, default):
+        """給料日の残高の取得元のルールの役割（Notionの「資産/負債」の選択肢）"""
+        rule = next((rule for rule in self.rules if rule.payday == source), None)
+        return rule.label if rule is not None else default
+
+    def payday_source(self, all_amount, source):
+        """給料日の残高の取得元の口座を返す
+
+        Args:
+            all_amount (AccountBook): 口座の値
+            source (str): "bank" または "card"
+
+        Returns:
+            AccountRecord: 一致した口座。見つからない場合はNone。
+        """
+        return next(self.accounts(all_amount, lambda rule: rule.payday == source), None)
+
+    def report_accounts(self, all_amount):
+        """LINEの証券口座欄に表示する口座を返す（非表示の口座は除く）"""
+        return list(self.accounts(all_amount, lambda rule: rule.report and rule.role != "hidden"))
+
+    def entry_pages(self):
+        """給料日に作成する固定の行（ページのデータ）を返す"""
+        pages = []
+        for entry in self.entries:
+            amount = entry["amount"] if "amount" in entry else int(os.environ[entry["amount_env"]])
+            pages.append({
+                "icon_emoji": entry.get("icon"),
+                "name": entry["name"],
+                "amount": amount,
+                "categories": [ROLE_LABELS[entry.get("role", "asset")]],
+                "note": entry.get("note", ""),
+            })
+        return pages
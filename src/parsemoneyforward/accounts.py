@@ -0,0 +1,143 @@
+"""口座の値をカテゴリと金融機関名で索引付けして保持する"""
+import unicodedata
+from collections.abc import Mapping
+
+ACCOUNT_FIELDS = ("bank_name", "number", "balance")
+
+
+def normalize_name(name):
+    """金融機関名を比較用に正規化する（全角英数の半角化、空白の除去）
+
+    Args:
+        name (str): 金融機関名
+
+    Returns:
+        str: 正規化した名前
+    """
+    return "".join(unicodedata.normalize("NFKC", name).split())
+
+
+class AccountRecord:
+    """1口座の値
+
+    従来の辞書（{"bank_name", "number", "balance"}）と同じキーで参照できる。
+    detail_urlは口座の詳細ページのURL、updated_atはトップページの取得日時（datetime）で、
+    辞書としては参照しない。
+    """
+
+    __slots__ = ("category", "bank_name", "number", "balance", "detail_url", "updated_at")
+
+    def __init__(self, category, bank_name, number, balance, detail_url=None, updated_at=None):
+        self.category = category
+        self.bank_name = bank_name
+        self.number = number
+        self.balance = balance
+        self.detail_url = detail_url
+        self.updated_at = updated_at
+
+    def __getitem__(self, key):
+        if key not in ACCOUNT_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in ACCOUNT_FIELDS:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return ACCOUNT_FIELDS
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in ACCOUNT_FIELDS}
+
+    def __eq__(self, other):
+        if isinstance(other, AccountRecord):
+            return self.category == other.category and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"AccountRecord({self.category!r}, {self.bank_name!r}, {self.number!r}, {self.balance!r})"
+
+
+class AccountBook(Mapping):
+    """カテゴリ → 口座のリストとして振る舞う口座の集合
+
+    `all_amount["銀行"]`のような従来の辞書としての参照に加えて、
+    カテゴリと正規化した金融機関名による索引で口座を検索できる。
+    """
+
+    __slots__ = ("_categories", "_index")
+
+    def __init__(self):
+        self._categories = {}
+        # (カテゴリ, 正規化した名前) → AccountRecord
+        self._index = {}
+
+    def add_category(self, category):
+        """口座のないカテゴリを追加する"""
+        self._categories.setdefault(category, [])
+
+    def add(self, category, bank_name, number, balance, detail_url=None, updated_at=None):
+        """口座を追加する
+
+        Returns:
+            AccountRecord: 追加した口座
+        """
+        record = AccountRecord(category, bank_name, number, balance, detail_url, updated_at)
+        self._categories.setdefault(category, []).append(record)
+        self._index.setdefault((category, normalize_name(bank_name)), record)
+        return record
+
+    def __getitem__(self, category):
+        return self._categories[category]
+
+    def __iter__(self):
+        return iter(self._categories)
+
+    def __len__(self):
+        return len(self._categories)
+
+    def find(self, category, bank_name, default=None):
+        """カテゴリ内で金融機関名に一致する口座を返す
+
+        完全一致（正規化後）は索引から取得する。見つからない場合は部分一致で探し、
+        結果を索引に追加して次回以降の検索を定数時間にする。
+
+        Args:
+            category (str): カテゴリ（"銀行"や"カード"など）
+            bank_name (str): 金融機関名（口座名の一部でもよい）
+            default: 見つからない場合に返す値
+
+        Returns:
+            AccountRecord: 一致した口座。見つからない場合はdefault。
+        """
+        key = (category, normalize_name(bank_name))
+        record = self._index.get(key)
+        if record is not None:
+            return record
+
+        query = key[1]
+        for candidate in self._categories.get(category, []):
+            if query in normalize_name(candidate.bank_name):
+                self._index[key] = candidate
+                return candidate
+
+        return default
+
+    def records(self):
+        """すべての口座をカテゴリ順に返す"""
+        for records in self._categories.values():
+            yield from records
+
+    def as_dict(self):
+        """従来の形式（dict[str, list[dict]]）に変換する"""
+        return {
+            category: [record.to_dict() for record in records]
+            for category, records in self._categories.items()
+        }
+
+    def __repr__(self):
+        return f"AccountBook({self.as_dict()!r})"
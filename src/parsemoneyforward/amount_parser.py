@@ -0,0 +1,149 @@
+"""マネーフォワードの画面に表示される金額文字列を整数に変換する
+
+対応する表記:
+    - 任意の桁数の桁区切り（1,234,567円）
+    - 全角数字・全角カンマ（１，２３４円）
+    - マイナス記号の各種表記（-、−、－、▲、△）
+    - 円記号（¥、￥）と「円」
+
+実行方法（ベンチマーク）:
+    rye run python src/parsemoneyforward/amount_parser.py
+"""
+import re
+import time
+
+# 全角・記号のゆれを半角に寄せる変換表
+_NORMALIZE_TABLE = str.maketrans(
+    {
+        **{chr(ord("０") + i): str(i) for i in range(10)},
+        "，": ",",
+        "．": ".",
+        "￥": "¥",
+        "−": "-",  # U+2212 MINUS SIGN
+        "－": "-",  # U+FF0D FULLWIDTH HYPHEN-MINUS
+        "‐": "-",  # U+2010 HYPHEN
+        "‑": "-",  # U+2011 NON-BREAKING HYPHEN
+        "–": "-",  # U+2013 EN DASH
+        "▲": "-",
+        "△": "-",
+        "　": " ",
+    }
+)
+
+# 数字部分だけを探し、符号は直前の文字列から判定する（先頭の省略可能な記号から
+# 照合を始めるよりも探索が速い）
+_DIGITS_PATTERN = re.compile(r"\d+(?:,\d+)*", re.ASCII)
+
+# 符号と数字の間に置かれうる文字（-¥1,000 / ¥-1,000 / - 1,000円）
+_PREFIX_FILLER = " \t\r\n¥"
+
+
+def _normalize(text):
+    # ASCIIのみの文字列は変換表を通す必要がない
+    return text if text.isascii() else text.translate(_NORMALIZE_TABLE)
+
+
+def _to_int(text, default):
+    if not text:
+        return default
+
+    text = _normalize(text)
+    match = _DIGITS_PATTERN.search(text)
+    if match is None:
+        return default
+
+    value = int(match.group().replace(",", ""))
+    prefix = text[: match.start()].rstrip(_PREFIX_FILLER)
+    if prefix.endswith("-"):
+        return -value
+    return value
+
+
+def parse_amount(text, default=0):
+    """文字列から最初の金額を取り出して整数で返す
+
+    小数部は切り捨てる。
+
+    Args:
+        text (str): 金額を含む文字列（例: "▲１，２３４円"）
+        default: 金額が見つからない場合に返す値
+
+    Returns:
+        int: 金額。見つからない場合はdefault。
+    """
+    return _to_int(text, default)
+
+
+# 文字列を連結して一度に正規化する際の区切り（変換表の対象外の文字）
+_BATCH_SEPARATOR = "\x00"
+
+
+def parse_amounts(texts, default=0):
+    """複数の文字列をまとめて金額に変換する
+
+    全角文字を含む場合は、すべての文字列を連結して変換表を1回だけ通し、
+    1件ごとの正規化と関数呼び出しを省く。
+
+    Args:
+        texts (iterable of str): 金額を含む文字列（Noneや空文字はdefault）
+        default: 金額が見つからない場合に返す値
+
+    Returns:
+        list of int: 各文字列の金額
+    """
+    texts = [text or "" for text in texts]
+    joined = _BATCH_SEPARATOR.join(texts)
+    if not joined.isascii():
+        normalized = joined.translate(_NORMALIZE_TABLE).split(_BATCH_SEPARATOR)
+        # 区切りの文字を含む文字列があれば連結できないため、1件ずつ正規化する
+        texts = normalized if len(normalized) == len(texts) else [_normalize(text) for text in texts]
+
+    search = _DIGITS_PATTERN.search
+    amounts = []
+    append = amounts.append
+    for text in texts:
+        match = search(text)
+        if match is None:
+            append(default)
+            continue
+        value = int(match.group().replace(",", ""))
+        if text[: match.start()].rstrip(_PREFIX_FILLER).endswith("-"):
+            value = -value
+        append(value)
+    return amounts
+
+
+def benchmark(count=200_000):
+    """代表的な表記を変換し、1件あたりの処理時間を表示する"""
+    samples = [
+        "1,234,567円",
+        "-12,345円",
+        "▲１，２３４円",
+        "¥-9",
+        "\n    残高: 3円\n",
+        "−１２３，４５６，７８９円",
+        "取得日時(10/18 08:00)",
+        "",
+    ]
+    texts = samples * (count // len(samples))
+
+    start = time.perf_counter()
+    parse_amounts(texts)
+    elapsed = time.perf_counter() - start
+    print(
+        f"parse_amounts: {len(texts):,}件 {elapsed:.3f}秒"
+        f" ({elapsed / len(texts) * 1e9:.0f} ns/件)"
+    )
+
+    start = time.perf_counter()
+    for text in texts:
+        parse_amount(text)
+    elapsed = time.perf_counter() - start
+    print(
+        f"parse_amount:  {len(texts):,}件 {elapsed:.3f}秒"
+        f" ({elapsed / len(texts) * 1e9:.0f} ns/件)"
+    )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,320 @@
+"""口座と支出の履歴をNumPy配列に読み込み、集計をまとめて計算する
+
+実行方法:
+    rye run python src/parsemoneyforward/analytics.py [世帯名]
+"""
+import datetime
+import sys
+
+import numpy as np
+
+import history
+from payday import paydays_between
+
+
+class AccountHistory:
+    """日付 × 口座の2次元配列で持つ口座の履歴
+
+    Attributes:
+        dates (np.ndarray): 記録日（datetime64[D]、昇順）
+        categories (np.ndarray): 各口座のカテゴリ
+        names (np.ndarray): 各口座の名前
+        numbers (np.ndarray): 使用高 (日付数, 口座数)。記録がない日はNaN。
+    """
+
+    __slots__ = ("dates", "categories", "names", "numbers")
+
+    def __init__(self, dates, categories, names, numbers):
+        self.dates = dates
+        self.categories = categories
+        self.names = names
+        self.numbers = numbers
+
+
+class ExpenseHistory:
+    """日付ごとの今月の支出（月初からの累計）の履歴"""
+
+    __slots__ = ("dates", "month_expense")
+
+    def __init__(self, dates, month_expense):
+        self.dates = dates
+        self.month_expense = month_expense
+
+
+def load_account_history(household=None, db_path=None):
+    """口座の履歴を1回のクエリで読み込み、日付 × 口座の配列に展開する
+
+    Args:
+        household (str, optional): 世帯名。デフォルトはhistory.HOUSEHOLD。
+        db_path (str, optional): DBファイルのパス
+
+    Returns:
+        AccountHistory: 口座の履歴
+    """
+    conn = history.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT taken_on, category, bank_name, number FROM account_snapshots"
+            " WHERE household = ?",
+            (household or history.HOUSEHOLD,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    if not rows:
+        return AccountHistory(
+            np.array([], dtype="datetime64[D]"),
+            np.array([], dtype=object),
+            np.array([], dtype=object),
+            np.empty((0, 0)),
+        )
+
+    taken_on, categories, names, numbers = zip(*rows)
+    dates, date_index = np.unique(
+        np.array(taken_on, dtype="datetime64[D]"), return_inverse=True
+    )
+    account_keys = np.array(
+        [f"{category}\x1f{name}" for category, name in zip(categories, names)]
+    )
+    accounts, account_index = np.unique(account_keys, return_inverse=True)
+
+    values = np.full((len(dates), len(accounts)), np.nan)
+    values[date_index, account_index] = np.array(numbers, dtype=float)
+
+    split = np.char.partition(accounts, "\x1f")
+    return AccountHistory(dates, split[:, 0], split[:, 2], values)
+
+
+def load_expense_history(household=None, db_path=None):
+    """今月の支出の履歴を読み込む
+
+    Args:
+        household (str, optional): 世帯名。デフォルトはhistory.HOUSEHOLD。
+        db_path (str, optional): DBファイルのパス
+
+    Returns:
+        ExpenseHistory: 支出の履歴
+    """
+    conn = history.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT taken_on, month_expense FROM expense_snapshots"
+            " WHERE household = ? ORDER BY taken_on",
+            (household or history.HOUSEHOLD,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    if not rows:
+        return ExpenseHistory(np.array([], dtype="datetime64[D]"), np.array([]))
+
+    taken_on, month_expense = zip(*rows)
+    return ExpenseHistory(
+        np.array(taken_on, dtype="datetime64[D]"),
+        np.array(month_expense, dtype=float),
+    )
+
+
+def forward_fill(values):
+    """NaNを直前の値で埋める（列ごと）
+
+    Args:
+        values (np.ndarray): (日付数, 口座数)の配列
+
+    Returns:
+        np.ndarray: NaNを埋めた配列。先頭のNaNはそのまま残る。
+    """
+    if values.size == 0:
+        return values.copy()
+    rows = np.arange(values.shape[0])[:, None]
+    last_valid = np.where(np.isnan(values), 0, rows)
+    np.maximum.accumulate(last_valid, axis=0, out=last_valid)
+    return values[last_valid, np.arange(values.shape[1])]
+
+
+def month_end_values(account_history):
+    """各月の最終記録日時点の値を返す
+
+    Returns:
+        tuple: (月の配列 datetime64[M], (月数, 口座数)の配列)
+    """
+    filled = forward_fill(account_history.numbers)
+    months = account_history.dates.astype("datetime64[M]")
+    # 月ごとの最後の行を取得するため、逆順にしてunique
+    unique_months, reversed_index = np.unique(months[::-1], return_index=True)
+    last_rows = len(months) - 1 - reversed_index
+    return unique_months, filled[last_rows]
+
+
+def month_over_month(account_history):
+    """月末値の前月比の差分を返す
+
+    Returns:
+        tuple: (月の配列（2か月目以降）, (月数-1, 口座数)の差分配列)
+    """
+    months, values = month_end_values(account_history)
+    return months[1:], np.diff(values, axis=0)
+
+
+def rolling_mean(values, window):
+    """行方向（日付方向）の移動平均。NaNは除外して平均する
+
+    Args:
+        values (np.ndarray): 1次元または(日付数, 口座数)の配列
+        window (int): 窓幅（行数、1以上）
+
+    Returns:
+        np.ndarray: valuesと同じ形の配列。窓内に値がない場合はNaN。
+
+    Raises:
+        ValueError: windowが1未満の場合
+    """
+    if window < 1:
+        raise ValueError(f"移動平均の窓幅は1以上にしてください: {window}")
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    padding = [(1, 0)] + [(0, 0)] * (values.ndim - 1)
+    sums = np.pad(np.cumsum(np.where(valid, values, 0.0), axis=0), padding)
+    counts = np.pad(np.cumsum(valid, axis=0), padding)
+    window_sums = sums[window:] - sums[:-window]
+    window_counts = counts[window:] - counts[:-window]
+    head_sums = sums[1:window]
+    head_counts = counts[1:window]
+    total_sums = np.concatenate([head_sums, window_sums])[: len(values)]
+    total_counts = np.concatenate([head_counts, window_counts])[: len(values)]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total_counts > 0, total_sums / total_counts, np.nan)
+
+
+def category_totals(account_history):
+    """日付ごとのカテゴリ別合計を返す
+
+    Returns:
+        tuple: (カテゴリの配列, (日付数, カテゴリ数)の配列)
+    """
+    categories, category_index = np.unique(
+        account_history.categories, return_inverse=True
+    )
+    filled = np.nan_to_num(forward_fill(account_history.numbers))
+    one_hot = np.zeros((len(category_index), len(categories)))
+    one_hot[np.arange(len(category_index)), category_index] = 1.0
+    return categories, filled @ one_hot
+
+
+def daily_expense(expense_history):
+    """月初からの累計支出を日ごとの支出に変換する
+
+    Returns:
+        np.ndarray: 日ごとの支出（前回の記録日からの増分）
+    """
+    values = expense_history.month_expense
+    if values.size == 0:
+        return values.copy()
+    months = expense_history.dates.astype("datetime64[M]")
+    previous = np.concatenate([[0.0], values[:-1]])
+    new_month = np.concatenate([[True], months[1:] != months[:-1]])
+    return values - np.where(new_month, 0.0, previous)
+
+
+def payday_cycle_burn_rate(expense_history):
+    """給料日サイクルごとの1日あたりの支出（バーンレート）を返す
+
+    Returns:
+        dict: cycle_start（各サイクルの給料日）、total（サイクル内の支出合計）、
+            days（記録のある経過日数）、per_day（1日あたりの支出）、
+            projected（次の給料日までの見込み支出）
+    """
+    dates = expense_history.dates
+    if dates.size == 0:
+        return {
+            "cycle_start": np.array([], dtype="datetime64[D]"),
+            "total": np.array([]),
+            "days": np.array([]),
+            "per_day": np.array([]),
+            "projected": np.array([]),
+        }
+
+    paydays = np.array(
+        paydays_between(dates[0].item(), dates[-1].item()), dtype="datetime64[D]"
+    )
+    cycle_index = np.searchsorted(paydays, dates, side="right") - 1
+    cycle_count = len(paydays) - 1
+
+    totals = np.bincount(cycle_index, weights=daily_expense(expense_history),
+                         minlength=cycle_count)[:cycle_count]
+    # サイクル内の最初と最後の記録日（記録がないサイクルはNaT）
+    first_date = np.full(cycle_count, np.iinfo(np.int64).max)
+    last_date = np.full(cycle_count, np.iinfo(np.int64).min)
+    np.minimum.at(first_date, cycle_index, dates.view("int64"))
+    np.maximum.at(last_date, cycle_index, dates.view("int64"))
+    cycle_start = paydays[:-1]
+    cycle_length = (paydays[1:] - cycle_start).astype(float)
+    # 記録開始が給料日より後のサイクルは、記録のある期間だけで日数を数える
+    observed_from = np.maximum(first_date, cycle_start.view("int64"))
+    days = np.where(
+        last_date >= observed_from, last_date - observed_from + 1, 0
+    ).astype(float)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        per_day = np.where(days > 0, totals / days, np.nan)
+
+    return {
+        "cycle_start": cycle_start,
+        "total": totals,
+        "days": days,
+        "per_day": per_day,
+        "projected": per_day * cycle_length,
+    }
+
+
+def build_report(household=None, db_path=None, window=7):
+    """対話的なレポート用に集計結果をまとめて返す"""
+    account_history = load_account_history(household, db_path)
+    expense_history = load_expense_history(household, db_path)
+
+    months, deltas = month_over_month(account_history)
+    categories, totals = category_totals(account_history)
+    burn = payday_cycle_burn_rate(expense_history)
+
+    return {
+        "months": months,
+        "month_over_month": deltas,
+        "accounts": account_history.names,
+        "categories": categories,
+        "category_totals": totals,
+        "category_rolling_mean": rolling_mean(totals, window),
+        "burn_rate": burn,
+    }
+
+
+def print_report(report):
+    if len(report["categories"]):
+        print("カテゴリ別合計（最新）:")
+        for category, total in zip(report["categories"], report["category_totals"][-1]):
+            print(f"  {category}: {int(total):,}円")
+
+    if len(report["months"]):
+        print("前月比（最新月）:")
+        for name, delta in zip(report["accounts"], report["month_over_month"][-1]):
+            if not np.isnan(delta):
+                print(f"  {name}: {int(delta):+,}円")
+
+    burn = report["burn_rate"]
+    if len(burn["cycle_start"]):
+        print("給料日サイクルごとの支出:")
+        for start, total, per_day, projected in zip(
+            burn["cycle_start"], burn["total"], burn["per_day"], burn["projected"]
+        ):
+            if np.isnan(per_day):
+                continue
+            print(
+                f"  {start}〜: 合計 {int(total):,}円 / 1日あたり {int(per_day):,}円"
+                f" / 見込み {int(projected):,}円"
+            )
+
+
+if __name__ == "__main__":
+    households = sys.argv[1:] or history.list_households() or [history.HOUSEHOLD]
+    for household in households:
+        print(f"=== {household} ({datetime.date.today()}) ===")
+        print_report(build_report(household))
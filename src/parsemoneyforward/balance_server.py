@@ -0,0 +1,201 @@
+"""キャッシュ済みの残高を返すローカル読み取り専用HTTP API
+
+ダッシュボードやホームオートメーションからブラウザを起動せずに残高を参照するためのサーバー。
+キャッシュの有効期限が切れている場合は、同時に来たリクエストを1回のスクレイピングにまとめる。
+スクレイピングは口座の値と今月の支出を読むだけで、マネーフォワードの口座の更新は行わない。
+取得に失敗した場合はBALANCE_ERROR_TTL秒のあいだ再取得せず、最後に取得できた値を返す。
+
+実行方法:
+    rye run python src/parsemoneyforward/balance_server.py
+"""
+import datetime
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import main as mf
+
+BALANCE_API_HOST = os.environ.get("BALANCE_API_HOST", "127.0.0.1")
+BALANCE_API_PORT = int(os.environ.get("BALANCE_API_PORT", "8787"))
+BALANCE_CACHE_TTL = int(os.environ.get("BALANCE_CACHE_TTL", "600"))
+# 取得に失敗した後、再取得しない時間（秒）
+BALANCE_ERROR_TTL = int(os.environ.get("BALANCE_ERROR_TTL", "60"))
+
+
+class SingleFlightCache:
+    """TTL付きのキャッシュ。期限切れ時の再取得は同時に1回だけ実行する
+
+    再取得に失敗した場合は、error_ttl秒のあいだ再取得せずに最後に取得できた値とエラーを返す。
+    """
+
+    def __init__(self, loader, ttl, error_ttl=0):
+        self.loader = loader
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self._state_lock = threading.Lock()
+        self._flight_lock = threading.Lock()
+        self._value = None
+        self._fetched_at = None
+        self._error = None
+        self._failed_at = None
+        self._generation = 0
+
+    def _snapshot(self):
+        with self._state_lock:
+            return self._value, self._fetched_at, self._error, self._generation
+
+    def _recently_failed(self):
+        with self._state_lock:
+            failed_at = self._failed_at
+        return failed_at is not None and time.monotonic() - failed_at < self.error_ttl
+
+    def _age(self, fetched_at):
+        return None if fetched_at is None else time.monotonic() - fetched_at
+
+    def _is_fresh(self, fetched_at):
+        return fetched_at is not None and time.monotonic() - fetched_at < self.ttl
+
+    def get(self):
+        """キャッシュの値を返す。期限切れなら再取得する
+
+        Returns:
+            tuple: (値, 取得からの経過秒数, 直近の再取得で発生したエラー)
+        """
+        value, fetched_at, error, generation = self._snapshot()
+        if self._is_fresh(fetched_at):
+            return value, time.monotonic() - fetched_at, None
+        # 直前に失敗した場合は、リクエストのたびにブラウザを起動しない
+        if self._recently_failed():
+            return value, self._age(fetched_at), error
+
+        with self._flight_lock:
+            value, fetched_at, error, current_generation = self._snapshot()
+            # 待機中に他のリクエストが再取得を終えていればその結果を使う
+            if current_generation != generation:
+                return value, self._age(fetched_at), error
+
+            try:
+                new_value = self.loader()
+            except Exception as e:
+                print(f"残高の再取得に失敗しました: {e}")
+                with self._state_lock:
+                    self._error = str(e)
+                    self._failed_at = time.monotonic()
+                    self._generation += 1
+                return value, self._age(fetched_at), str(e)
+
+            with self._state_lock:
+                self._value = new_value
+                self._fetched_at = time.monotonic()
+                self._error = None
+                self._failed_at = None
+                self._generation += 1
+            return new_value, 0.0, None
+
+
+def load_snapshot():
+    """MoneyForwardとNotionから最新の残高を取得する
+
+    Returns:
+        dict: 口座の値、今月の支出、月初の残高、計算結果
+    """
+    email = os.environ["EMAIL"]
+    password = os.environ["PASSWORD"]
+    notion_token = os.environ["NOTION_KEY"]
+    parent_page_id = os.environ["NOTION_PAGE_ID"]
+
+    # 口座の更新（リロードボタンの押下）は行わず、表示されている値を読むだけにする
+    mf.driver = mf.create_webdriver()
+    try:
+        mf.ensure_logged_in(email, password)
+        all_amount = mf.get_all_amount()
+        current_month_expense = mf.get_current_month_expense()
+    finally:
+        mf.driver.quit()
+        mf.driver = None
+
+    # APIは読み取り専用のため、給料日でもNotionのデータベースは作成しない
+    create_monthly_balance_page = mf.CreateMonthlyBalancePage(
+        notion_token, parent_page_id
+    )
+    current_month_balance = create_monthly_balance_page.read_current_month_balance()
+
+    account_rules = mf.AccountRules.load()
+    balance, stock = mf.calculate_balance(
+        all_amount, current_month_balance, current_month_expense, account_rules=account_rules
+    )
+
+    return {
+        "all_amount": account_rules.visible(all_amount).as_dict(),
+        "current_month_expense": current_month_expense,
+        "current_month_balance": current_month_balance,
+        "balance": balance,
+        "stock": stock,
+        "fetched_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+balance_cache = SingleFlightCache(load_snapshot, BALANCE_CACHE_TTL, BALANCE_ERROR_TTL)
+
+
+class BalanceRequestHandler(BaseHTTPRequestHandler):
+    routes = {
+        "/balance": None,
+        "/accounts": "all_amount",
+        "/expense": "current_month_expense",
+    }
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+
+        if path == "/healthz":
+            self._send_json(200, {"status": "ok"})
+            return
+
+        if path not in self.routes:
+            self._send_json(404, {"error": "not found"})
+            return
+
+        snapshot, age, error = balance_cache.get()
+        if snapshot is None:
+            self._send_json(503, {"error": error or "残高を取得できませんでした"})
+            return
+
+        key = self.routes[path]
+        body = dict(snapshot) if key is None else {key: snapshot[key]}
+        body["fetched_at"] = snapshot["fetched_at"]
+        body["age_seconds"] = round(age, 1) if age is not None else None
+        body["stale"] = error is not None
+        if error:
+            body["error"] = error
+        self._send_json(200, body)
+
+    def _method_not_allowed(self):
+        self._send_json(405, {"error": "read-only API"})
+
+    do_POST = do_PUT = do_PATCH = do_DELETE = _method_not_allowed
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def serve():
+    server = ThreadingHTTPServer((BALANCE_API_HOST, BALANCE_API_PORT), BalanceRequestHandler)
+    print(f"残高APIを起動しました: http://{BALANCE_API_HOST}:{BALANCE_API_PORT}/balance")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
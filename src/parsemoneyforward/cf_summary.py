@@ -0,0 +1,219 @@
+"""収支内訳（/cf/summary）の表を月 × 項目の構造に変換し、締まった月をキャッシュする
+
+見出しに月が並ぶ表をすべて読む。合計の表（#monthly-total）では行の見出しが「収入」「支出」「収支」を
+含む行を合計とし、見出しのない行（1行だけある場合）は支出の合計とみなす。
+それ以外の表では見出しが「収入合計」「支出合計」「収支」と一致する行だけを合計とし、
+残りの行（「特別な支出」なども）はカテゴリとして扱う。
+今月より前の月は締まっているため、一度キャッシュしたら上書きしない（今月以降の月は毎回置き換える）。
+"""
+import datetime
+import os
+import re
+
+from bs4 import BeautifulSoup
+
+from amount_parser import parse_amount
+from month_registry import month_key
+from state_files import atomic_write_json, read_json
+
+SUMMARY_CACHE_PATH = os.environ.get("SUMMARY_CACHE_PATH", "summary-cache.json")
+
+_YEAR_MONTH_PATTERN = re.compile(r"(\d{4})\s*[/年\-]\s*(\d{1,2})")
+_MONTH_PATTERN = re.compile(r"(\d{1,2})\s*月")
+
+INCOME_LABEL = "収入"
+EXPENSE_LABEL = "支出"
+NET_LABEL = "収支"
+# 合計の表以外で合計とみなす行の見出し
+TOTAL_LABELS = {"収入合計": "income", "支出合計": "expense", NET_LABEL: "net"}
+
+
+class MonthSummary:
+    """1か月分の収支"""
+
+    __slots__ = ("month", "income", "expense", "categories")
+
+    def __init__(self, month, income=None, expense=None, categories=None):
+        self.month = month
+        self.income = income
+        self.expense = expense
+        self.categories = categories if categories is not None else {}
+
+    @property
+    def net(self):
+        if self.income is None or self.expense is None:
+            return None
+        return self.income + self.expense
+
+    def to_dict(self):
+        return {
+            "month": self.month,
+            "income": self.income,
+            "expense": self.expense,
+            "categories": self.categories,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["month"], data.get("income"), data.get("expense"), dict(data.get("categories", {})))
+
+    def __eq__(self, other):
+        if isinstance(other, MonthSummary):
+            return self.to_dict() == other.to_dict()
+        return NotImplemented
+
+    def __repr__(self):
+        return f"MonthSummary({self.month!r}, income={self.income!r}, expense={self.expense!r}, categories={self.categories!r})"
+
+
+def _latest_year(month, today):
+    """年のない最新の列の年（今日の月か、給料日で区切る場合の翌月までを最新とみなす）"""
+    if (month - today.month) % 12 == 1:
+        return today.year + 1 if month == 1 else today.year
+    return today.year if month <= today.month else today.year - 1
+
+
+def parse_month_headers(headers, today=None):
+    """列見出しを月（"YYYY-MM"）に変換する
+
+    年のない見出し（"10月"）は、最後の月が今日の月以前（給料日で区切る場合は翌月まで）になるように
+    右から順に年を決める。
+
+    Returns:
+        list: 列ごとの月。月でない列はNone。
+    """
+    today = today or datetime.date.today()
+    parsed = []
+    for header in headers:
+        text = "".join(header.split())
+        match = _YEAR_MONTH_PATTERN.search(text)
+        if match:
+            parsed.append((int(match.group(1)), int(match.group(2))))
+            continue
+        match = _MONTH_PATTERN.search(text)
+        parsed.append((None, int(match.group(1))) if match else None)
+
+    keys = [None] * len(parsed)
+    year = None
+    previous_month = None
+    for index in range(len(parsed) - 1, -1, -1):
+        if parsed[index] is None:
+            continue
+        column_year, month = parsed[index]
+        if not 1 <= month <= 12:
+            continue
+        if column_year is None:
+            if year is None:
+                year = _latest_year(month, today)
+            elif previous_month is not None and month > previous_month:
+                year -= 1
+            column_year = year
+        year, previous_month = column_year, month
+        keys[index] = month_key(column_year, month)
+    return keys
+
+
+def _row_kind(label, in_totals):
+    if not in_totals:
+        return TOTAL_LABELS.get(label, "category")
+    if NET_LABEL in label:
+        return "net"
+    if INCOME_LABEL in label:
+        return "income"
+    if EXPENSE_LABEL in label:
+        return "expense"
+    return "category"
+
+
+def parse_summary(html, today=None):
+    """収支内訳のページから月ごとの収支を取り出す
+
+    Returns:
+        dict: 月（"YYYY-MM"、古い順） → MonthSummary
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    summaries = {}
+    for table in soup.find_all("table"):
+        header_row = table.find("tr")
+        if header_row is None:
+            continue
+        months = parse_month_headers([cell.get_text() for cell in header_row.find_all(["th", "td"])], today)
+        if not any(months):
+            continue
+        in_totals = table.find_parent("section", id="monthly-total") is not None
+
+        for row in header_row.find_all_next("tr"):
+            if row.find_parent("table") is not table:
+                break
+            cells = row.find_all(["th", "td"])
+            if not cells or len(cells) > len(months):
+                continue
+            # 見出しの列がない行は金額の列を右に揃える
+            columns = months[len(months) - len(cells):]
+            label = cells[0].get_text(strip=True) if columns[0] is None else ""
+            kind = _row_kind(label, in_totals) if label else ("expense" if in_totals else None)
+            if kind is None or kind == "net":
+                continue
+
+            for cell, key in zip(cells, columns):
+                if key is None or not _has_amount(cell):
+                    continue
+                summary = summaries.setdefault(key, MonthSummary(key))
+                amount = parse_amount(cell.get_text())
+                if kind == "category":
+                    summary.categories[label] = amount
+                else:
+                    setattr(summary, kind, amount)
+    return dict(sorted(summaries.items()))
+
+
+def _has_amount(cell):
+    return any(char.isdigit() for char in cell.get_text())
+
+
+class SummaryCache:
+    """月 → 収支のキャッシュ（締まった月は上書きしない）"""
+
+    def __init__(self, path=None):
+        self.path = path or SUMMARY_CACHE_PATH
+        self.months = {}
+        # 締まった後の値を記録した月 → 記録した日
+        self.closed = {}
+
+    def load(self):
+        data = read_json(self.path, {})
+        self.months = {key: MonthSummary.from_dict(value) for key, value in data.get("months", {}).items()}
+        closed = data.get("closed", {})
+        # 以前の形式（月のリスト）は進行中の月も締まった月として記録していたため、使わずに記録し直す
+        self.closed = dict(closed) if isinstance(closed, dict) else {}
+        return self
+
+    def save(self):
+        atomic_write_json(self.path, {
+            "closed": dict(sorted(self.closed.items())),
+            "months": {key: summary.to_dict() for key, summary in sorted(self.months.items())},
+        })
+
+    def update(self, summaries, today=None):
+        """ページから取り出した収支を反映する
+
+        今月以降の月は毎回置き換え、今月より前の月は締まった後の値をまだ記録していない場合だけ置き換える。
+
+        Args:
+            summaries (dict): 月 → MonthSummary
+            today (datetime.date, optional): 今日の日付
+
+        Returns:
+            MonthSummary: 今月の収支（ページに今月がなければ最新の月の収支）。ページに月がなければNone。
+        """
+        if not summaries:
+            return None
+        today = today or datetime.date.today()
+        current_month = month_key(today.year, today.month)
+        for key, summary in summaries.items():
+            if key in self.closed:
+                continue
+            self.months[key] = summary
+            if key < current_month:
+                self.closed[key] = today.isoformat()
+        return self.months[current_month if current_month in summaries else max(summaries)]
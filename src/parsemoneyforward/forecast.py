@@ -0,0 +1,152 @@
+"""支出の履歴から次の給料日時点の残高を予測する
+
+過去の1日ごとの支出を復元抽出して次の給料日までの支出の経路を多数生成し（モンテカルロ法）、
+給料日の残高から引いた値のパーセンタイルを求める。経路はすべて1つの配列でまとめて計算する。
+
+実行方法:
+    rye run python src/parsemoneyforward/forecast.py 残高 [世帯名 ...]
+"""
+import argparse
+import datetime
+import os
+
+import numpy as np
+
+import history
+from analytics import daily_expense, load_expense_history
+from payday import next_payday
+
+FORECAST_PATHS = int(os.environ.get("FORECAST_PATHS", "10000"))
+# 直近何日分の支出から抽出するか
+FORECAST_LOOKBACK_DAYS = int(os.environ.get("FORECAST_LOOKBACK_DAYS", "180"))
+# 支出の記録がこの日数より少ない場合は予測しない
+FORECAST_MIN_DAYS = int(os.environ.get("FORECAST_MIN_DAYS", "14"))
+FORECAST_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class Forecast:
+    """次の給料日時点の残高の予測
+
+    Attributes:
+        start_balance (int): 給料日の残高
+        payday (datetime.date): 予測する給料日
+        days (int): 給料日までの日数
+        percentiles (dict): パーセンタイル → 残高
+        daily_percentiles (np.ndarray): (パーセンタイル数, 日数)の日ごとの残高
+        shortfall_probability (float): 残高がマイナスになる確率
+    """
+
+    __slots__ = ("start_balance", "payday", "days", "percentiles", "daily_percentiles",
+                 "shortfall_probability")
+
+    def __init__(self, start_balance, payday, days, percentiles, daily_percentiles,
+                 shortfall_probability):
+        self.start_balance = start_balance
+        self.payday = payday
+        self.days = days
+        self.percentiles = percentiles
+        self.daily_percentiles = daily_percentiles
+        self.shortfall_probability = shortfall_probability
+
+    def summary(self):
+        """LINEに送る文字列"""
+        low, high = self.percentiles[FORECAST_PERCENTILES[0]], self.percentiles[FORECAST_PERCENTILES[-1]]
+        return (
+            f"{self.payday:%m/%d}（{self.days}日後）の残高\n"
+            f"中央値: {self.percentiles[50]:,}円\n"
+            f"{FORECAST_PERCENTILES[-1] - FORECAST_PERCENTILES[0]}%の範囲: {low:,}円〜{high:,}円\n"
+            f"マイナスになる確率: {self.shortfall_probability:.0%}"
+        )
+
+
+def calendar_daily_expense(expense_history, lookback_days=None):
+    """記録日ごとの支出の増分を暦日ごとの支出に展開する
+
+    記録のない日をまたいだ増分は、その間の日数で等分する。月の最初の記録は月初からの累計のため、
+    月初からの日数で等分する。
+
+    Returns:
+        np.ndarray: 直近lookback_days日分の1日ごとの支出（マイナスが支出）
+    """
+    dates = expense_history.dates
+    if dates.size == 0:
+        return np.array([])
+
+    increments = daily_expense(expense_history)
+    months = dates.astype("datetime64[M]")
+    new_month = np.concatenate([[True], months[1:] != months[:-1]])
+    previous = np.concatenate([dates[:1], dates[:-1]])
+    # 月の最初の記録は月初の前日から、それ以外は前回の記録日からの日数
+    since = np.where(new_month, months.astype("datetime64[D]") - 1, previous)
+    gaps = np.maximum((dates - since).astype(int), 1)
+
+    per_day = np.repeat(increments / gaps, gaps)
+    lookback_days = FORECAST_LOOKBACK_DAYS if lookback_days is None else lookback_days
+    return per_day[-lookback_days:]
+
+
+def simulate(start_balance, daily, days, paths=None, rng=None):
+    """支出の経路を生成し、日ごとの残高を返す
+
+    Args:
+        start_balance (float): 開始時の残高
+        daily (np.ndarray): 抽出元の1日ごとの支出
+        days (int): 日数
+        paths (int, optional): 経路の数
+        rng (np.random.Generator, optional): 乱数生成器
+
+    Returns:
+        np.ndarray: (経路数, 日数)の残高
+    """
+    rng = rng or np.random.default_rng()
+    paths = paths or FORECAST_PATHS
+    samples = daily[rng.integers(0, len(daily), size=(paths, days))]
+    return start_balance + np.cumsum(samples, axis=1)
+
+
+def forecast_end_balance(start_balance, household=None, db_path=None, today=None, paths=None,
+                         rng=None):
+    """支出の履歴から次の給料日時点の残高を予測する
+
+    Args:
+        start_balance (int): 給料日の残高（月初の残高）
+        household (str, optional): 世帯名。デフォルトはhistory.HOUSEHOLD。
+        db_path (str, optional): 履歴DBのパス
+        today (datetime.date, optional): 予測を始める日
+        paths (int, optional): 経路の数
+        rng (np.random.Generator, optional): 乱数生成器
+
+    Returns:
+        Forecast: 予測。支出の記録が少ない場合はNone。
+    """
+    today = today or datetime.date.today()
+    daily = calendar_daily_expense(load_expense_history(household, db_path))
+    if len(daily) < FORECAST_MIN_DAYS:
+        return None
+
+    payday = next_payday(today)
+    days = (payday - today).days
+    balances = simulate(start_balance, daily, days, paths, rng)
+
+    daily_percentiles = np.percentile(balances, FORECAST_PERCENTILES, axis=0)
+    end = daily_percentiles[:, -1]
+    return Forecast(
+        start_balance=start_balance,
+        payday=payday,
+        days=days,
+        percentiles={q: int(round(value)) for q, value in zip(FORECAST_PERCENTILES, end)},
+        daily_percentiles=daily_percentiles,
+        shortfall_probability=float(np.mean(balances[:, -1] < 0)),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="次の給料日時点の残高の予測")
+    parser.add_argument("balance", type=int, help="給料日の残高（円）")
+    parser.add_argument("households", nargs="*", help="世帯名（省略時は履歴のある全世帯）")
+    args = parser.parse_args()
+
+    for household in args.households or history.list_households() or [history.HOUSEHOLD]:
+        print(f"=== {household} ===")
+        result = forecast_end_balance(args.balance, household)
+        print(result.summary() if result else "支出の記録が少ないため予測できません")
@@ -0,0 +1,135 @@
+"""口座ごとの最終更新日時を記録し、更新が必要な口座だけを選ぶ
+
+トップページの「取得日時(MM/DD HH:MM)」と、ローカルに記録した前回の更新時刻のうち
+新しい方を最終更新日時とする。カテゴリごとの有効期間（REFRESH_WINDOWS）より古い口座だけを更新する。
+"""
+import os
+import re
+from datetime import datetime, timedelta
+
+from bs4 import BeautifulSoup
+
+from state_files import atomic_write_json, read_json
+
+REFRESH_STATE_PATH = os.environ.get("REFRESH_STATE_PATH", "refresh-state.json")
+# カテゴリ名に含まれる文字列=有効期間（時間）。例: "銀行=6,証券=1"
+REFRESH_WINDOWS = os.environ.get("REFRESH_WINDOWS", "銀行=6,証券=1")
+# REFRESH_WINDOWSに当てはまらないカテゴリの有効期間（時間）。0なら毎回更新する
+REFRESH_DEFAULT_WINDOW = float(os.environ.get("REFRESH_DEFAULT_WINDOW", "0"))
+
+_UPDATED_AT_PATTERN = re.compile(r"(\d{1,2})/(\d{1,2})\s*(\d{1,2}):(\d{2})")
+
+
+def parse_windows(spec=None):
+    """有効期間の設定を解析する
+
+    Returns:
+        dict: カテゴリ名に含まれる文字列 → timedelta
+    """
+    windows = {}
+    for item in (REFRESH_WINDOWS if spec is None else spec).split(","):
+        if "=" not in item:
+            continue
+        keyword, hours = item.split("=", 1)
+        windows[keyword.strip()] = timedelta(hours=float(hours))
+    return windows
+
+
+def window_for(category, windows=None, default=None):
+    """カテゴリの有効期間を返す"""
+    windows = parse_windows() if windows is None else windows
+    for keyword, window in windows.items():
+        if keyword and keyword in category:
+            return window
+    return timedelta(hours=REFRESH_DEFAULT_WINDOW if default is None else default)
+
+
+def parse_updated_at(text, now=None):
+    """「取得日時(10/18 09:30)」から日時を取り出す（年は現在から推定する）"""
+    match = _UPDATED_AT_PATTERN.search(text or "")
+    if not match:
+        return None
+    now = now or datetime.now()
+    month, day, hour, minute = (int(value) for value in match.groups())
+    try:
+        updated_at = datetime(now.year, month, day, hour, minute)
+    except ValueError:
+        return None
+    # 年をまたいだ直後は前年の日時として扱う
+    if updated_at > now + timedelta(days=1):
+        updated_at = updated_at.replace(year=now.year - 1)
+    return updated_at
+
+
+def parse_accounts(html, now=None):
+    """トップページの口座一覧から、更新リンクと取得日時を取り出す
+
+    Returns:
+        list of dict: category, name, refresh_url, updated_at
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    section = soup.find("section", id="registered-accounts")
+    if section is None:
+        return []
+
+    accounts = []
+    category = ""
+    for li in section.find_all("li", class_=["heading-category-name", "account"]):
+        if "heading-category-name" in li["class"]:
+            category = li.text.strip()
+            continue
+        link = li.find("a", href=re.compile("/aggregation_queue"))
+        name_link = li.find("a")
+        date = li.find(class_="date")
+        accounts.append({
+            "category": category,
+            "name": name_link.text.strip() if name_link else "",
+            "refresh_url": link.get("href") if link else None,
+            "updated_at": parse_updated_at(date.text, now) if date else None,
+        })
+    return accounts
+
+
+class RefreshState:
+    """口座ごとに前回更新を依頼した時刻を記録する"""
+
+    def __init__(self, path=None):
+        self.path = path or REFRESH_STATE_PATH
+        self.refreshed_at = {}
+
+    def load(self):
+        self.refreshed_at = read_json(self.path, {})
+        return self
+
+    def save(self):
+        atomic_write_json(self.path, self.refreshed_at, indent=2)
+
+    def mark_refreshed(self, refresh_url, when=None):
+        self.refreshed_at[refresh_url] = (when or datetime.now()).isoformat(timespec="seconds")
+
+    def last_refreshed(self, account):
+        """取得日時と前回の更新依頼のうち新しい方を返す"""
+        candidates = [account["updated_at"]] if account["updated_at"] else []
+        recorded = self.refreshed_at.get(account["refresh_url"])
+        if recorded:
+            candidates.append(datetime.fromisoformat(recorded))
+        return max(candidates) if candidates else None
+
+    def select_stale(self, accounts, now=None, windows=None):
+        """有効期間を過ぎた口座の更新リンクを返す
+
+        Returns:
+            tuple: (更新するリンクのset, 更新しない口座のlist)
+        """
+        now = now or datetime.now()
+        windows = parse_windows() if windows is None else windows
+        stale, fresh = set(), []
+        for account in accounts:
+            if not account["refresh_url"]:
+                continue
+            last = self.last_refreshed(account)
+            if last is None or now - last >= window_for(account["category"], windows):
+                stale.add(account["refresh_url"])
+            else:
+                fresh.append(account)
+        return stale, fresh
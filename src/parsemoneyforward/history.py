@@ -0,0 +1,87 @@
+"""口座の値と今月の支出の履歴をSQLiteに保存する"""
+import datetime
+import os
+import sqlite3
+
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", "history.db")
+HOUSEHOLD = os.environ.get("HOUSEHOLD", "default")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS account_snapshots (
+    household TEXT NOT NULL,
+    taken_on TEXT NOT NULL,
+    category TEXT NOT NULL,
+    bank_name TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    balance INTEGER NOT NULL,
+    PRIMARY KEY (household, taken_on, category, bank_name)
+);
+CREATE TABLE IF NOT EXISTS expense_snapshots (
+    household TEXT NOT NULL,
+    taken_on TEXT NOT NULL,
+    month_expense INTEGER NOT NULL,
+    PRIMARY KEY (household, taken_on)
+);
+"""
+
+
+def connect(db_path=None):
+    """履歴DBに接続し、テーブルがなければ作成する
+
+    Args:
+        db_path (str, optional): DBファイルのパス。デフォルトはHISTORY_DB_PATH。
+
+    Returns:
+        sqlite3.Connection: DB接続
+    """
+    conn = sqlite3.connect(db_path or HISTORY_DB_PATH)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record_snapshot(all_amount, current_month_expense, household=None,
+                    taken_on=None, db_path=None):
+    """その日の口座の値と今月の支出を保存する（同日の再実行は上書き）
+
+    Args:
+        all_amount (dict): get_all_amountの戻り値
+        current_month_expense (int): 今月の支出
+        household (str, optional): 世帯名。デフォルトはHOUSEHOLD。
+        taken_on (datetime.date, optional): 記録日。デフォルトは今日。
+        db_path (str, optional): DBファイルのパス
+    """
+    household = household or HOUSEHOLD
+    taken_on = (taken_on or datetime.date.today()).isoformat()
+
+    rows = [
+        (household, taken_on, category, item["bank_name"],
+         item["number"] or 0, item["balance"] or 0)
+        for category, items in all_amount.items()
+        for item in items
+    ]
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO account_snapshots VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO expense_snapshots VALUES (?, ?, ?)",
+                (household, taken_on, current_month_expense),
+            )
+    finally:
+        conn.close()
+
+
+def list_households(db_path=None):
+    """履歴が保存されている世帯名の一覧を返す"""
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT DISTINCT household FROM account_snapshots ORDER BY household"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in rows]
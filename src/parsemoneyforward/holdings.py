@@ -0,0 +1,228 @@
+"""証券口座の詳細ページから保有銘柄を取得する
+
+詳細ページは口座ごとに独立しているため、ログイン中のクッキーを引き継いだrequests.Sessionで
+並行して取得する。解析結果はトップページの取得日時とともにキャッシュし、取得日時が変わっていない口座は
+詳細ページを取得しない。取得した場合もページ内容のハッシュ値が同じなら再解析しない。
+ログインページに戻された応答や保有銘柄の表がないページはキャッシュしない。
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from bs4 import BeautifulSoup
+
+from amount_parser import parse_amount
+from state_files import atomic_write_json, read_json
+
+HOLDINGS_CACHE_PATH = os.environ.get("HOLDINGS_CACHE_PATH", "holdings-cache.json")
+HOLDINGS_CONCURRENCY = int(os.environ.get("HOLDINGS_CONCURRENCY", "4"))
+
+# 表の見出し → Holdingの属性（先に一致したものを使う）
+COLUMN_KEYWORDS = (
+    ("銘柄コード", "code"),
+    ("コード", "code"),
+    ("銘柄名", "name"),
+    ("保有数", "quantity"),
+    ("評価損益率", None),
+    ("評価損益", "profit_loss"),
+    ("評価額", "valuation"),
+)
+HOLDING_FIELDS = ("code", "name", "quantity", "valuation", "profit_loss")
+# ログインページのパス（main.is_logged_inと同じ判定）
+LOGIN_PATHS = ("/sign_in", "/email_otp")
+
+
+class Holding:
+    """保有銘柄1件"""
+
+    __slots__ = HOLDING_FIELDS
+
+    def __init__(self, code, name, quantity, valuation, profit_loss):
+        self.code = code
+        self.name = name
+        self.quantity = quantity
+        self.valuation = valuation
+        self.profit_loss = profit_loss
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in HOLDING_FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{field: data.get(field) for field in HOLDING_FIELDS})
+
+    def __eq__(self, other):
+        if isinstance(other, Holding):
+            return self.to_dict() == other.to_dict()
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Holding({self.code!r}, {self.name!r}, {self.quantity!r}, {self.valuation!r}, {self.profit_loss!r})"
+
+
+def _column_fields(headers):
+    fields = []
+    for header in headers:
+        text = "".join(header.split())
+        for keyword, field in COLUMN_KEYWORDS:
+            if keyword in text:
+                fields.append(field)
+                break
+        else:
+            fields.append(None)
+    return fields
+
+
+def _parse_quantity(text):
+    """保有数を取り出す（投資信託の口数などの小数にも対応する）"""
+    digits = "".join(char for char in text if char.isdigit() or char == ".")
+    if not digits:
+        return None
+    value = float(digits)
+    return int(value) if value.is_integer() else value
+
+
+def parse_holdings(html):
+    """詳細ページの表から保有銘柄を取り出す
+
+    銘柄名と評価額の列がある表（株式・投資信託など）をすべて対象にする。
+
+    Returns:
+        list of Holding: 保有銘柄。対象の表がない場合はNone。
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    holdings = None
+    for table in soup.find_all("table"):
+        header_row = table.find("tr")
+        if header_row is None:
+            continue
+        fields = _column_fields(cell.get_text() for cell in header_row.find_all(["th", "td"]))
+        if "name" not in fields or "valuation" not in fields:
+            continue
+        holdings = holdings or []
+
+        for row in header_row.find_all_next("tr"):
+            if row.find_parent("table") is not table:
+                break
+            cells = row.find_all("td")
+            if len(cells) < len(fields):
+                continue
+            values = {field: cell.get_text(strip=True) for field, cell in zip(fields, cells) if field}
+            if not values.get("name"):
+                continue
+            holdings.append(Holding(
+                code=values.get("code") or None,
+                name=values["name"],
+                quantity=_parse_quantity(values.get("quantity", "")),
+                valuation=parse_amount(values.get("valuation", "")),
+                profit_loss=parse_amount(values["profit_loss"]) if "profit_loss" in values else None,
+            ))
+    return holdings
+
+
+def is_login_page(url):
+    """ログインページに戻された応答かどうか"""
+    return any(path in (url or "") for path in LOGIN_PATHS)
+
+
+class HoldingsCache:
+    """詳細ページのURL → 取得日時、ページ内容のハッシュ値と解析結果"""
+
+    def __init__(self, path=None):
+        self.path = path or HOLDINGS_CACHE_PATH
+        self.entries = {}
+        self.hits = 0
+
+    def load(self):
+        self.entries = read_json(self.path, {})
+        return self
+
+    def save(self):
+        atomic_write_json(self.path, self.entries, indent=None)
+
+    def lookup(self, url, updated_at):
+        """取得日時が前回と同じならキャッシュした解析結果を返す（詳細ページを取得しなくてよい）
+
+        Returns:
+            list of Holding: 保有銘柄。取得日時が不明または変わっている場合はNone。
+        """
+        entry = self.entries.get(url)
+        if updated_at is None or not entry or entry.get("updated_at") != updated_at.isoformat():
+            return None
+        self.hits += 1
+        return [Holding.from_dict(data) for data in entry["holdings"]]
+
+    def parse(self, url, html, updated_at=None):
+        """内容が前回と同じならキャッシュを、そうでなければ解析した結果を返す
+
+        保有銘柄の表があるページだけをキャッシュする。
+
+        Returns:
+            list of Holding: 保有銘柄。表がない場合はNone。
+        """
+        digest = hashlib.sha256(html.encode("utf-8")).hexdigest()
+        entry = self.entries.get(url)
+        if entry and entry["hash"] == digest:
+            self.hits += 1
+            holdings = [Holding.from_dict(data) for data in entry["holdings"]]
+        else:
+            holdings = parse_holdings(html)
+            if holdings is None:
+                return None
+        self.entries[url] = {
+            "hash": digest,
+            "updated_at": updated_at.isoformat() if updated_at else None,
+            "holdings": [holding.to_dict() for holding in holdings],
+        }
+        return holdings
+
+
+def fetch_holdings(session, detail_urls, cache=None, max_workers=None, updated_at=None):
+    """詳細ページを並行して取得し、保有銘柄を返す
+
+    Args:
+        session (requests.Session): ログイン中のクッキーを持つセッション
+        detail_urls (list of str): 詳細ページのURL
+        cache (HoldingsCache, optional): 解析結果のキャッシュ
+        max_workers (int, optional): 同時に取得するページの数
+        updated_at (dict, optional): URL → トップページの取得日時。前回と同じURLは取得しない。
+
+    Returns:
+        dict: URL → 保有銘柄のlist。取得に失敗したURLは含めない。
+    """
+    cache = cache or HoldingsCache().load()
+    updated_at = updated_at or {}
+
+    def fetch(url):
+        response = session.get(url, timeout=30)
+        response.raise_for_status()
+        if is_login_page(response.url):
+            raise RuntimeError(f"ログインページに戻されました ({response.url})")
+        return response.text
+
+    results = {}
+    stale_urls = []
+    for url in detail_urls:
+        holdings = cache.lookup(url, updated_at.get(url))
+        if holdings is None:
+            stale_urls.append(url)
+        else:
+            results[url] = holdings
+    if not stale_urls:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers or HOLDINGS_CONCURRENCY) as executor:
+        futures = {url: executor.submit(fetch, url) for url in stale_urls}
+        for url, future in futures.items():
+            try:
+                html = future.result()
+            except Exception as e:
+                print(f"詳細ページの取得に失敗しました ({url}): {e}")
+                continue
+            holdings = cache.parse(url, html, updated_at.get(url))
+            if holdings is None:
+                print(f"詳細ページに保有銘柄の表がありません ({url})")
+                holdings = []
+            results[url] = holdings
+    cache.save()
+    return results
@@ -0,0 +1,99 @@
+"""待機箇所ごとの所要時間を記録してタイムアウトを決め、再試行の間隔を決める
+
+待機箇所（"login.password_input"など）ごとに直近の所要時間をLATENCY_MODEL_PATHに保存する。
+十分な記録がある箇所は、直近の分布（p99）に安全係数をかけた値を上下限の範囲でタイムアウトにする。
+記録が少ない箇所は従来の固定値を使う。
+再試行の間隔は所要時間の記録（失敗を検出するまでの時間）ではなく、連続した失敗の回数から決める。
+"""
+import os
+import threading
+
+import numpy as np
+
+from state_files import atomic_write_json, file_lock, read_json
+
+LATENCY_MODEL_PATH = os.environ.get("LATENCY_MODEL_PATH", "latency-model.json")
+# 待機箇所ごとに保持する直近の記録の数
+LATENCY_WINDOW = int(os.environ.get("LATENCY_WINDOW", "200"))
+# この数より記録が少ない箇所は固定値を使う
+LATENCY_MIN_SAMPLES = int(os.environ.get("LATENCY_MIN_SAMPLES", "10"))
+LATENCY_SAFETY_FACTOR = float(os.environ.get("LATENCY_SAFETY_FACTOR", "1.5"))
+# 再試行の前に待つ時間の上限（秒）
+RETRY_BACKOFF_MAX = float(os.environ.get("RETRY_BACKOFF_MAX", "60"))
+
+
+def backoff(failures, base, maximum=None):
+    """再試行の前に待つ時間（秒）を返す
+
+    連続した失敗の回数に応じてbase, base×2, base×4, ...と延ばし、上限で打ち切る。
+
+    Args:
+        failures (int): 連続した失敗の回数（1以上）
+        base (float): 1回目の失敗の後に待つ時間
+        maximum (float, optional): 上限。省略時はRETRY_BACKOFF_MAX。
+    """
+    maximum = RETRY_BACKOFF_MAX if maximum is None else maximum
+    return min(base * 2 ** max(failures - 1, 0), maximum)
+
+
+class LatencyModel:
+    def __init__(self, path=None, window=None):
+        self.path = path or LATENCY_MODEL_PATH
+        self.window = window or LATENCY_WINDOW
+        self._lock = threading.Lock()
+        self._samples = None
+        # この実行で記録した分（保存時に他のプロセスの記録と合わせる）
+        self._new_samples = {}
+
+    def _load(self):
+        if self._samples is None:
+            self._samples = read_json(self.path, {})
+        return self._samples
+
+    def record(self, site, seconds):
+        """所要時間を記録する（タイムアウトした場合はタイムアウトまでの時間を記録する）"""
+        with self._lock:
+            samples = self._load().setdefault(site, [])
+            samples.append(round(seconds, 3))
+            del samples[:-self.window]
+            self._new_samples.setdefault(site, []).append(round(seconds, 3))
+
+    def percentile(self, site, q):
+        """直近の記録のパーセンタイル（記録が少ない場合はNone）"""
+        with self._lock:
+            samples = self._load().get(site, [])
+            if len(samples) < LATENCY_MIN_SAMPLES:
+                return None
+            return float(np.percentile(samples, q))
+
+    def timeout(self, site, default, minimum=None, maximum=None):
+        """待機箇所のタイムアウト（秒）を返す
+
+        Args:
+            site (str): 待機箇所の名前
+            default (float): 記録が少ない場合のタイムアウト（従来の固定値）
+            minimum (float, optional): 下限。省略時はdefaultの1/3。
+            maximum (float, optional): 上限。省略時はdefaultの3倍。
+        """
+        p99 = self.percentile(site, 99)
+        if p99 is None:
+            return default
+        minimum = default / 3 if minimum is None else minimum
+        maximum = default * 3 if maximum is None else maximum
+        return min(max(p99 * LATENCY_SAFETY_FACTOR, minimum), maximum)
+
+    def save(self):
+        """この実行の記録を保存する（同時に実行された他のプロセスの記録は残す）"""
+        with self._lock:
+            if not self._new_samples:
+                return
+            with file_lock(f"{self.path}.lock", timeout=30):
+                stored = read_json(self.path, {})
+                for site, samples in self._new_samples.items():
+                    stored[site] = (stored.get(site, []) + samples)[-self.window:]
+                atomic_write_json(self.path, stored, indent=None)
+            self._samples = stored
+            self._new_samples = {}
+
+
+model = LatencyModel()
@@ -0,0 +1,153 @@
+"""LINE Messaging APIへの送信をまとめて行う
+
+1回のリクエストで最大5件のメッセージを送り、複数の宛先にはマルチキャストで送信する。
+一時的なエラー（429、5xx、通信エラー）はバックオフしながら再送する。
+"""
+import time
+import uuid
+
+import requests
+
+import metrics
+
+LINE_PUSH_URL = "https://api.line.me/v2/bot/message/push"
+LINE_MULTICAST_URL = "https://api.line.me/v2/bot/message/multicast"
+
+# LINE Messaging APIの上限
+MAX_MESSAGES_PER_REQUEST = 5
+MAX_MULTICAST_RECIPIENTS = 500
+MAX_TEXT_LENGTH = 5000
+
+TRUNCATED_MARKER = "\n...(省略)...\n"
+
+
+class LineDeliveryError(Exception):
+    """再送しても送信できなかった場合の例外"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def truncate_text(text, limit=MAX_TEXT_LENGTH):
+    """上限を超える文字列を先頭と末尾を残して切り詰める
+
+    トレースバックは末尾（例外の発生箇所）が重要なため、末尾を多めに残す。
+
+    Args:
+        text (str): 送信する文字列
+        limit (int): 最大文字数
+
+    Returns:
+        str: 上限以内の文字列
+    """
+    if len(text) <= limit:
+        return text
+    available = limit - len(TRUNCATED_MARKER)
+    head = available // 4
+    tail = available - head
+    return text[:head] + TRUNCATED_MARKER + text[-tail:]
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class LineMessenger:
+    def __init__(self, access_token, max_retries=3, backoff=1.0, timeout=10):
+        """
+        Args:
+            access_token (str): チャネルアクセストークン
+            max_retries (int): 一時的なエラー時の最大再送回数
+            backoff (float): 再送間隔の基準（秒）。再送のたびに2倍にする。
+            timeout (float): 1リクエストのタイムアウト（秒）
+        """
+        self.access_token = access_token
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def send(self, recipients, texts, retry_key=None):
+        """テキストメッセージを送信する
+
+        Args:
+            recipients (list of str): 宛先のユーザーID
+            texts (list of str): 送信する文字列
+            retry_key (str, optional): 冪等キー。同じキーでの再送はLINE側で重複が除かれる。
+
+        Returns:
+            list of dict: 各リクエストのレスポンス
+
+        Raises:
+            LineDeliveryError: 再送しても送信できなかった場合
+        """
+        recipients = [recipient for recipient in recipients if recipient]
+        if not recipients:
+            raise LineDeliveryError("宛先が指定されていません")
+
+        messages = [{"type": "text", "text": truncate_text(text)} for text in texts if text]
+        requests_to_send = []
+        for message_chunk in _chunks(messages, MAX_MESSAGES_PER_REQUEST):
+            if len(recipients) == 1:
+                requests_to_send.append(
+                    (LINE_PUSH_URL, {"to": recipients[0], "messages": message_chunk})
+                )
+                continue
+            for recipient_chunk in _chunks(recipients, MAX_MULTICAST_RECIPIENTS):
+                requests_to_send.append(
+                    (LINE_MULTICAST_URL, {"to": recipient_chunk, "messages": message_chunk})
+                )
+
+        responses = []
+        for index, (url, payload) in enumerate(requests_to_send):
+            # リクエストごとに冪等キーから一意なUUIDを導出する
+            request_retry_key = (
+                str(uuid.uuid5(uuid.NAMESPACE_URL, f"{retry_key}:{index}")) if retry_key else None
+            )
+            responses.append(self._post(url, payload, request_retry_key))
+        return responses
+
+    def _post(self, url, payload, retry_key=None):
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.access_token}",
+            # 再送時も同じキーを送り、LINE側で二重送信を防ぐ
+            "X-Line-Retry-Key": retry_key or str(uuid.uuid4()),
+        }
+
+        for attempt in range(self.max_retries + 1):
+            wait = self.backoff * (2 ** attempt)
+            started = time.perf_counter()
+            try:
+                response = requests.post(url, headers=headers, json=payload, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                metrics.observe_http("line", "POST", "error", time.perf_counter() - started)
+                if attempt == self.max_retries:
+                    raise LineDeliveryError(f"LINEへの送信に失敗しました: {e}")
+                print(f"LINEへの送信に失敗しました。{wait:.0f}秒後に再送します: {e}")
+                time.sleep(wait)
+                continue
+            metrics.observe_http("line", "POST", response.status_code, time.perf_counter() - started)
+
+            # 同じリトライキーで既に受け付け済み
+            if response.status_code == 409:
+                return {}
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == self.max_retries:
+                    raise LineDeliveryError(
+                        f"LINEへの送信に失敗しました。ステータスコード: {response.status_code}",
+                        response.status_code,
+                    )
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    wait = max(wait, int(retry_after))
+                print(f"LINEへの送信が一時的に失敗しました ({response.status_code})。{wait:.0f}秒後に再送します")
+                time.sleep(wait)
+                continue
+            if response.status_code != 200:
+                raise LineDeliveryError(
+                    f"LINEへの送信に失敗しました。ステータスコード: {response.status_code}\n{response.text}",
+                    response.status_code,
+                )
+            return response.json() if response.content else {}
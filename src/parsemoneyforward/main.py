@@ -3,21 +3,22 @@ import hashlib
 import json
 import os
 import pickle
-import re
+import signal
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
+from urllib.parse import urljoin, urlparse
 
-import jpholiday
 import pyotp
 import requests
 from bs4 import BeautifulSoup
 from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
-from logrelay.line_relay import LineRelay
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chromium.remote_connection import ChromiumRemoteConnection
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import (
     NoSuchElementException,
@@ -26,9 +27,32 @@ from selenium.common.exceptions import (
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
+import forecast
+import history
+import latency
+import metrics
+import outbox
+import transactions
+from account_rules import AccountRules
+from accounts import AccountBook
+from amount_parser import parse_amount, parse_amounts
+from cf_summary import SummaryCache, parse_summary
+from freshness import RefreshState, parse_accounts, parse_updated_at
+from holdings import fetch_holdings
+from line_delivery import LineDeliveryError, LineMessenger
+from memory import RssSampler, is_supported as proc_supported, process_tree_pids
+from month_registry import MonthRegistry, cycle_month_key, title_month_key
+from payday import get_payday
+from state_files import atomic_write_bytes, atomic_write_json, file_lock
+from task_graph import TaskGraph
+from watchdog import Watchdog, WatchdogTimeout
+
 load_dotenv(verbose=True)
 
 COOKIE_FILE = "cookies.pkl"
+# 同時に実行されたプロセスのうち、1つだけがログインするためのロック
+LOGIN_LOCK_FILE = os.environ.get("LOGIN_LOCK_FILE", "login.lock")
+LOGIN_LOCK_TIMEOUT = float(os.environ.get("LOGIN_LOCK_TIMEOUT", "600"))
 SCREENSHOT_FILE = "reload_screenshot.png"
 DEBUG_OUTPUT_DIR = os.environ.get(
     "DEBUG_OUTPUT_DIR", os.path.join("tmp", "debug")
@@ -38,15 +62,54 @@ CHROMEDRIVER_PATH = os.environ.get(
 )
 global driver
 driver = None
-
-# LogRelayの初期化
-line_relay = LineRelay(
-    os.getenv("LINE_ACCESS_LOG_RELAY_TOKEN"),
-    os.getenv("USER_ID"),
+# ログインの再試行やブラウザの作り直しでも使い回すchromedriverのサービス
+_chrome_service = None
+
+# 接続先（負荷試験用のスタブサーバーなどに切り替える場合に指定する）
+MF_BASE_URL = os.environ.get("MF_BASE_URL", "https://moneyforward.com").rstrip("/")
+MF_ID_BASE_URL = os.environ.get("MF_ID_BASE_URL", "https://id.moneyforward.com").rstrip("/")
+MF_HOST = urlparse(MF_BASE_URL).hostname
+MF_LINK_XPATH = f"//a[contains(@href, '{MF_HOST}')]"
+
+DEFAULT_LOGIN_URL = f"{MF_BASE_URL}/users/sign_in"
+
+# Notion APIがレート制限（429）を返した場合の再送回数
+NOTION_MAX_RETRIES = int(os.environ.get("NOTION_MAX_RETRIES", "3"))
+# Notion APIへのリクエストのタイムアウト（秒）
+NOTION_TIMEOUT = float(os.environ.get("NOTION_TIMEOUT", "30"))
+# ページ読み込み（driver.get）のタイムアウト（秒）
+PAGE_LOAD_TIMEOUT = float(os.environ.get("PAGE_LOAD_TIMEOUT", "60"))
+
+# 更新リンクの押し方（http: 直接リクエストを送る / selenium: ブラウザでクリックする）
+RELOAD_MODE = os.environ.get("RELOAD_MODE", "http")
+RELOAD_CONCURRENCY = int(os.environ.get("RELOAD_CONCURRENCY", "4"))
+
+# ブラウザの起動方法（standard: 通常 / lean: メモリ使用量を抑える）
+BROWSER_MODE = os.environ.get("BROWSER_MODE", "standard")
+LEAN_WINDOW_SIZE = os.environ.get("LEAN_WINDOW_SIZE", "1280,900")
+
+# leanモードで追加するオプション
+LEAN_CHROME_ARGUMENTS = (
+    # レンダラーとサイト分離のプロセス数を抑える
+    "--renderer-process-limit=1",
+    "--disable-site-isolation-trials",
+    "--disable-features=site-per-process,IsolateOrigins,Translate,MediaRouter,OptimizationHints",
+    # 使わない機能を止める
+    "--disable-extensions",
+    "--disable-gpu",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--mute-audio",
+    "--no-first-run",
+    # キャッシュとJavaScriptのヒープの上限
+    "--disk-cache-size=33554432",
+    "--media-cache-size=1",
+    "--aggressive-cache-discard",
+    "--js-flags=--max-old-space-size=256",
 )
 
-DEFAULT_LOGIN_URL = "https://moneyforward.com/users/sign_in"
-
 
 def build_chrome_options():
     """Chromeのオプションを構築する（シンプル版）"""
@@ -67,8 +130,14 @@ def build_chrome_options():
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
 
-    # ウィンドウの初期サイズを最大化
-    chrome_options.add_argument("--start-maximized")
+    if BROWSER_MODE == "lean":
+        # 画面の大きさを固定し、プロセス数とキャッシュを抑える
+        chrome_options.add_argument(f"--window-size={LEAN_WINDOW_SIZE}")
+        for argument in LEAN_CHROME_ARGUMENTS:
+            chrome_options.add_argument(argument)
+    else:
+        # ウィンドウの初期サイズを最大化
+        chrome_options.add_argument("--start-maximized")
 
     # ページロードの安定性向上のための追加オプション
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
@@ -77,11 +146,123 @@ def build_chrome_options():
     return chrome_options
 
 
+def get_chrome_service():
+    """chromedriverのサービスを返す（起動済みで応答するものがあれば使い回す）"""
+    global _chrome_service
+    if _chrome_service is None or not _chrome_service.is_connectable():
+        if _chrome_service is not None:
+            _chrome_service.stop()
+        _chrome_service = Service(executable_path=CHROMEDRIVER_PATH)
+        _chrome_service.start()
+    return _chrome_service
+
+
+def stop_chrome_service():
+    """chromedriverのサービスを停止する"""
+    global _chrome_service
+    if _chrome_service is not None:
+        _chrome_service.stop()
+        _chrome_service = None
+
+
+def chrome_service_pid():
+    """起動中のchromedriverのpid（起動していなければNone）"""
+    if _chrome_service is None or _chrome_service.process is None:
+        return None
+    return _chrome_service.process.pid
+
+
+def kill_browser_processes():
+    """応答しないchromedriverとブラウザのプロセスツリーを強制終了する
+
+    Returns:
+        list: 終了させたプロセスのpid
+    """
+    root_pid = chrome_service_pid()
+    if root_pid is None:
+        return []
+    pids = process_tree_pids(root_pid) if proc_supported() else [root_pid]
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    return pids
+
+
 def create_webdriver():
-    """chromedriverのインスタンスを生成する"""
+    """chromedriverのインスタンスを生成する
+
+    webdriver.Chromeはquit()のたびにchromedriverも終了させるため、起動済みのサービスに
+    セッションだけを作成する。
+    """
     options = build_chrome_options()
-    service = Service(executable_path=CHROMEDRIVER_PATH)
-    return webdriver.Chrome(service=service, options=options)
+    service = get_chrome_service()
+    executor = ChromiumRemoteConnection(
+        remote_server_addr=service.service_url,
+        vendor_prefix="goog",
+        browser_name="chrome",
+    )
+    new_driver = webdriver.Remote(command_executor=executor, options=options)
+    # 読み込みが終わらないページでdriver.getが戻らなくならないようにする
+    new_driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    return new_driver
+
+
+def execute_cdp(driver, cmd, params=None):
+    """Chrome DevTools Protocolのコマンドを実行する"""
+    return driver.execute("executeCdpCommand", {"cmd": cmd, "params": params or {}})["value"]
+
+
+def _origin(url):
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def reset_browser_session(driver):
+    """ブラウザを終了せずに、ログイン前の状態に戻す
+
+    余分なタブを閉じ、クッキー・ストレージ・キャッシュを消去する。
+    ブラウザが応答しない場合は例外を送出する。
+    """
+    handles = driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+    driver.get("about:blank")
+
+    execute_cdp(driver, "Network.clearBrowserCookies")
+    execute_cdp(driver, "Network.clearBrowserCache")
+    for origin in {_origin(MF_BASE_URL), _origin(MF_ID_BASE_URL)}:
+        execute_cdp(driver, "Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+
+
+def recover_webdriver(current_driver):
+    """ログインの再試行のためにブラウザを初期状態に戻す
+
+    ブラウザが応答する場合はそのまま使い、応答しない場合だけ作り直す。
+
+    Returns:
+        WebDriver: 再試行に使うWebDriver
+    """
+    if current_driver is not None:
+        try:
+            reset_browser_session(current_driver)
+            print("✓ ブラウザの状態をリセットしました")
+            metrics.inc("mf_browser_recoveries_total", {"mode": "reset"})
+            return current_driver
+        except Exception as e:
+            print(f"ブラウザが応答しないため作り直します: {e}")
+            try:
+                current_driver.quit()
+            except Exception as e:
+                print(f"WebDriver終了時のエラー（無視）: {e}")
+
+    new_driver = create_webdriver()
+    print("✓ 新しいWebDriverを作成しました")
+    metrics.inc("mf_browser_recoveries_total", {"mode": "recreate"})
+    return new_driver
 
 
 def attempt_cookie_login():
@@ -95,11 +276,11 @@ def attempt_cookie_login():
         return False
 
     # クッキーをセットするために一度サイトを開く
-    driver.get("https://moneyforward.com")
+    driver.get(MF_BASE_URL)
     add_cookies_to_driver(driver, cookies)
 
     # クッキーを適用するために再度ページにアクセス
-    driver.get("https://moneyforward.com")
+    driver.get(MF_BASE_URL)
     time.sleep(5)  # ページ読み込みとJavaScript実行を待機
 
     print("✓ クッキーをロードしました")
@@ -112,12 +293,30 @@ def ensure_logged_in(email, password):
 
     if cookie_loaded and is_logged_in():
         print("✓ クッキーでログイン成功")
+        metrics.inc("mf_login_total", {"path": "cookie"})
         return
 
     if cookie_loaded:
         print("クッキーが無効です。ログインを実行します。")
 
-    login_selenium(email, password)
+    # ログインは1つのプロセスだけが行う。待っている間に他のプロセスがログインした場合は
+    # そのクッキーを使い、TOTPの二重送信を避ける
+    cookie_mtime = _cookie_file_mtime()
+    with file_lock(LOGIN_LOCK_FILE, timeout=LOGIN_LOCK_TIMEOUT):
+        if _cookie_file_mtime() != cookie_mtime and attempt_cookie_login() and is_logged_in():
+            print("✓ 他のプロセスが保存したクッキーでログイン成功")
+            metrics.inc("mf_login_total", {"path": "shared_cookie"})
+            return
+
+        login_selenium(email, password)
+        metrics.inc("mf_login_total", {"path": "selenium"})
+
+
+def _cookie_file_mtime():
+    try:
+        return os.stat(COOKIE_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
 
 
 def save_cookies(driver, file_path):
@@ -126,8 +325,8 @@ def save_cookies(driver, file_path):
         driver: seleniumドライバー
         file_path: クッキーファイルのパス
     """
-    with open(file_path, "wb") as file:
-        pickle.dump(driver.get_cookies(), file)
+    # 他のプロセスが読み込み中でも壊れたファイルを読まないよう、アトミックに書き込む
+    atomic_write_bytes(file_path, pickle.dumps(driver.get_cookies()))
 
 
 def load_cookies(file_path):
@@ -230,13 +429,13 @@ def is_logged_in():
     """
     Seleniumを使用して、ユーザーがログインしているかを確認します。
 
-    指定されたURL（https://moneyforward.com/accounts）にアクセスし、
+    接続先（MF_BASE_URL）の口座一覧ページ（/accounts）にアクセスし、
     ログインページにリダイレクトされないかを確認します。
 
     Returns:
         bool: ログインしていればTrue、そうでなければFalseを返します。
     """
-    url = "https://moneyforward.com/accounts"
+    url = f"{MF_BASE_URL}/accounts"
     driver.get(url)
     time.sleep(3)  # ページ読み込みを待機
 
@@ -250,7 +449,7 @@ def is_logged_in():
         return False
 
     # /accountsまたはmoneyforward.comドメインにいればログイン成功
-    if "/accounts" in current_url or (current_url.startswith("https://moneyforward.com") and "id.moneyforward.com" not in current_url):
+    if "/accounts" in current_url or (current_url.startswith(MF_BASE_URL) and not current_url.startswith(MF_ID_BASE_URL)):
         print("✓ ログイン成功")
         return True
 
@@ -258,9 +457,36 @@ def is_logged_in():
     return False
 
 
+def wait_until(driver, site, condition, default, minimum=None, maximum=None):
+    """待機箇所ごとの過去の所要時間から決めたタイムアウトで条件を待つ
+
+    所要時間（タイムアウトした場合はタイムアウトまでの時間）を待機箇所の名前で記録する。
+
+    Args:
+        driver: Seleniumドライバー
+        site (str): 待機箇所の名前
+        condition (callable): WebDriverWait.untilに渡す条件
+        default (float): 記録が少ない場合のタイムアウト（秒）
+        minimum (float, optional): タイムアウトの下限（秒）
+        maximum (float, optional): タイムアウトの上限（秒）
+
+    Raises:
+        TimeoutException: タイムアウトまでに条件を満たさなかった場合
+    """
+    timeout = latency.model.timeout(site, default, minimum, maximum)
+    start = time.monotonic()
+    try:
+        value = WebDriverWait(driver, timeout).until(condition)
+    except TimeoutException:
+        latency.model.record(site, timeout)
+        raise
+    latency.model.record(site, time.monotonic() - start)
+    return value
+
+
 def _wait_for_page_load(driver, timeout=60, max_attempts=3):
     """ページの読み込みとJavaScriptレンダリングを待機"""
-    attempt_timeout = max(20, timeout // max_attempts)  # 最小20秒に延長
+    attempt_timeout = max(20, timeout // max_attempts)
     last_exception = None
 
     for attempt in range(1, max_attempts + 1):
@@ -269,19 +495,24 @@ def _wait_for_page_load(driver, timeout=60, max_attempts=3):
             time.sleep(3)
 
             # document.readyStateの確認
-            WebDriverWait(driver, 10).until(
-                lambda d: d.execute_script("return document.readyState") == "complete"
+            wait_until(
+                driver, "login.ready_state",
+                lambda d: d.execute_script("return document.readyState") == "complete",
+                default=10, minimum=3,
             )
             print("document.readyState = complete")
 
             # さらにbodyが存在することを確認
-            WebDriverWait(driver, 5).until(
-                EC.presence_of_element_located((By.TAG_NAME, "body"))
+            wait_until(
+                driver, "login.body", EC.presence_of_element_located((By.TAG_NAME, "body")),
+                default=5, minimum=2,
             )
 
             # メール入力欄を検出
-            email_element = WebDriverWait(driver, attempt_timeout).until(
-                EC.visibility_of_element_located((By.XPATH, "//input[@type='email']"))
+            email_element = wait_until(
+                driver, "login.email_input",
+                EC.visibility_of_element_located((By.XPATH, "//input[@type='email']")),
+                default=attempt_timeout, minimum=5, maximum=timeout,
             )
             body_count = len(driver.find_elements(By.XPATH, "//body//*"))
             print(f"✓ ページ読み込み完了 (要素数: {body_count})")
@@ -304,8 +535,9 @@ def _wait_for_page_load(driver, timeout=60, max_attempts=3):
                 break
 
             print(message + "ログインページを再取得します...")
+            metrics.inc("mf_page_load_retries_total")
             driver.get(DEFAULT_LOGIN_URL)
-            time.sleep(8)  # 待ち時間を延長
+            time.sleep(latency.backoff(attempt, 8))
 
     raise last_exception
 
@@ -329,6 +561,7 @@ def _handle_totp_authentication(driver, max_attempts=3):
 
     for attempt in range(1, max_attempts + 1):
         print(f"\n--- TOTP試行 {attempt}/{max_attempts} ---")
+        metrics.inc("mf_totp_attempts_total")
 
         # TOTP_SECRETからコードを生成
         totp_code, totp_debug = get_totp_code()
@@ -338,24 +571,23 @@ def _handle_totp_authentication(driver, max_attempts=3):
             # TOTP入力欄を探す
             totp_input = None
             try:
-                totp_input = WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "input[inputmode='numeric']"))
+                totp_input = wait_until(
+                    driver, "totp.input",
+                    EC.any_of(
+                        EC.presence_of_element_located((By.CSS_SELECTOR, "input[inputmode='numeric']")),
+                        EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='tel']")),
+                    ),
+                    default=15, minimum=3,
                 )
                 print("✓ TOTP入力欄を検出")
-            except:
-                try:
-                    totp_input = WebDriverWait(driver, 5).until(
-                        EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='tel']"))
-                    )
-                    print("✓ TOTP入力欄を検出 (tel type)")
-                except:
-                    pass
+            except TimeoutException:
+                pass
 
             if not totp_input:
                 print("エラー: TOTP入力欄が見つかりません")
                 if attempt == max_attempts:
                     raise Exception("TOTP入力欄が見つかりませんでした")
-                time.sleep(5)
+                time.sleep(latency.backoff(attempt, 5))
                 continue
 
             # コードを入力
@@ -380,7 +612,7 @@ def _handle_totp_authentication(driver, max_attempts=3):
                 print("エラー: 送信ボタンが見つかりません")
                 if attempt == max_attempts:
                     raise Exception("送信ボタンが見つかりませんでした")
-                time.sleep(5)
+                time.sleep(latency.backoff(attempt, 5))
                 continue
 
             # ボタンをクリック
@@ -391,8 +623,10 @@ def _handle_totp_authentication(driver, max_attempts=3):
             # 認証完了を待つ
             print("認証結果を待機中...")
             try:
-                WebDriverWait(driver, 30).until(
-                    lambda d: not d.current_url.startswith("https://id.moneyforward.com/two_factor_auth")
+                wait_until(
+                    driver, "totp.result",
+                    lambda d: not d.current_url.startswith(f"{MF_ID_BASE_URL}/two_factor_auth"),
+                    default=30, minimum=5,
                 )
                 print("✓ TOTP認証成功")
                 return
@@ -402,7 +636,7 @@ def _handle_totp_authentication(driver, max_attempts=3):
                 )
                 if error_elements and attempt < max_attempts:
                     print("✗ TOTPコードが拒否されました。次のコードで再試行します...")
-                    time.sleep(5)
+                    time.sleep(latency.backoff(attempt, 5))
                     continue
                 raise Exception("TOTP認証を完了できませんでした")
 
@@ -410,7 +644,7 @@ def _handle_totp_authentication(driver, max_attempts=3):
             print(f"エラー: {e}")
             if attempt == max_attempts:
                 raise
-            time.sleep(5)
+            time.sleep(latency.backoff(attempt, 5))
 
 
 def _complete_login_and_save_cookies(driver):
@@ -424,23 +658,23 @@ def _complete_login_and_save_cookies(driver):
     """
     print(f"ログイン完了確認を開始します。現在のURL: {driver.current_url}")
 
-    target_xpath = "//a[contains(@href, 'moneyforward.com')]"
+    target_xpath = MF_LINK_XPATH
 
     def _is_portal_ready(d):
         current = d.current_url or ""
         return (
-            current.startswith("https://moneyforward.com")
+            current.startswith(MF_BASE_URL)
             or len(d.find_elements(By.XPATH, target_xpath)) > 0
         )
 
     try:
-        WebDriverWait(driver, 60).until(_is_portal_ready)
+        wait_until(driver, "login.portal_ready", _is_portal_ready, default=60, minimum=10)
     except TimeoutException:
         print("ログイン後の遷移要素が見つかりませんでした。")
         _dump_debug_page(driver, "login_timeout")
         raise
 
-    if not driver.current_url.startswith("https://moneyforward.com"):
+    if not driver.current_url.startswith(MF_BASE_URL):
         portal_links = driver.find_elements(By.XPATH, target_xpath)
         if not portal_links:
             raise Exception("マネーフォワード本体へのリンクが検出できません")
@@ -455,24 +689,28 @@ def _complete_login_and_save_cookies(driver):
 
         print("マネーフォワード本体へのリンクをクリックします...")
         driver.execute_script("arguments[0].click();", target_link)
-        WebDriverWait(driver, 60).until(
-            lambda d: (d.current_url or "").startswith(
-                "https://moneyforward.com"))
+        wait_until(
+            driver, "login.portal_redirect",
+            lambda d: (d.current_url or "").startswith(MF_BASE_URL),
+            default=60, minimum=10,
+        )
 
     # account_selectorページを処理
     if "/account_selector" in driver.current_url:
         print("アカウント選択ページを検出しました。最初のアカウントを選択します...")
         try:
             # アカウント選択ボタンを探す（複数ある場合は最初のものを選択）
-            account_buttons = driver.find_elements(By.XPATH, "//a[contains(@href, 'moneyforward.com')]")
+            account_buttons = driver.find_elements(By.XPATH, MF_LINK_XPATH)
             if account_buttons:
                 print(f"{len(account_buttons)}個のアカウントが見つかりました。最初のアカウントを選択します...")
                 driver.execute_script("arguments[0].click();", account_buttons[0])
                 time.sleep(3)
                 # アカウント選択後、マネーフォワード本体への遷移を待つ
                 print("アカウント選択後の遷移を待機中...")
-                WebDriverWait(driver, 30).until(
-                    lambda d: "moneyforward.com" in d.current_url and "/account_selector" not in d.current_url
+                wait_until(
+                    driver, "login.account_selector",
+                    lambda d: MF_HOST in d.current_url and "/account_selector" not in d.current_url,
+                    default=30, minimum=5,
                 )
                 print(f"✓ アカウント選択後のURL: {driver.current_url}")
             else:
@@ -483,7 +721,7 @@ def _complete_login_and_save_cookies(driver):
     # まだaccount_selectorにいる、またはログインページにいる場合
     if "/accounts" not in driver.current_url and "ptn=" not in driver.current_url:
         print("マネーフォワード本体へ遷移します...")
-        driver.get("https://moneyforward.com")
+        driver.get(MF_BASE_URL)
         time.sleep(5)
 
     # 最終確認: account_selectorに戻されていないかチェック
@@ -518,29 +756,22 @@ def login_selenium(email, password):
     for attempt in range(1, max_login_attempts + 1):
         print(f"\n=== ログイン試行 {attempt}/{max_login_attempts} ===")
 
-        # 2回目以降の試行では、WebDriverを再作成して完全にリセット
+        # 2回目以降の試行では、クッキーやストレージを消去してログイン前の状態に戻す
         if attempt > 1:
-            print("WebDriverを再作成します（完全リセット）...")
-            if driver:
-                try:
-                    driver.quit()
-                    time.sleep(2)
-                except Exception as e:
-                    print(f"WebDriver終了時のエラー（無視）: {e}")
-            driver = create_webdriver()
-            print("✓ 新しいWebDriverを作成しました")
+            print("ブラウザの状態をリセットします...")
+            driver = recover_webdriver(driver)
 
         print(f"ログインページにアクセスします... ({DEFAULT_LOGIN_URL})")
-        driver.get(DEFAULT_LOGIN_URL)
 
         # ページ読み込みとメール入力欄の検出
         try:
+            driver.get(DEFAULT_LOGIN_URL)
             email_element = _wait_for_page_load(driver)
         except Exception as e:
             print(f"ページ読み込みエラー: {e}")
             if attempt == max_login_attempts:
                 raise
-            print("ページ読み込みに失敗したため、WebDriverを再作成して再試行します...")
+            print("ページ読み込みに失敗したため、ブラウザをリセットして再試行します...")
             continue
 
         try:
@@ -555,9 +786,10 @@ def login_selenium(email, password):
 
             # パスワード入力
             print("パスワードを入力します...")
-            password_element = WebDriverWait(driver, 30).until(
-                EC.presence_of_element_located(
-                    (By.XPATH, "//input[@type='password']"))
+            password_element = wait_until(
+                driver, "login.password_input",
+                EC.presence_of_element_located((By.XPATH, "//input[@type='password']")),
+                default=30, minimum=5,
             )
             password_element.send_keys(password)
 
@@ -589,8 +821,8 @@ def login_selenium(email, password):
             print(f"ログインエラー: {e}")
             if attempt == max_login_attempts:
                 raise
-            print("再試行のためにWebDriverを再作成します...")
-            time.sleep(3)
+            print("再試行のためにブラウザをリセットします...")
+            time.sleep(latency.backoff(attempt, 3, maximum=10))
 
 
 def click_reloads_selenium():
@@ -604,7 +836,7 @@ def click_reloads_selenium():
         Exception: ボタンのクリック中に発生したエラーを表示します。
     """
     # トップページにアクセス
-    toppage_url = "https://moneyforward.com"
+    toppage_url = MF_BASE_URL
     print(f"トップページにアクセスします: {toppage_url}")
     driver.get(toppage_url)
 
@@ -616,7 +848,7 @@ def click_reloads_selenium():
     if "/account_selector" in driver.current_url:
         print("警告: account_selectorページにリダイレクトされました")
         try:
-            account_buttons = driver.find_elements(By.XPATH, "//a[contains(@href, 'moneyforward.com')]")
+            account_buttons = driver.find_elements(By.XPATH, MF_LINK_XPATH)
             if account_buttons:
                 print(f"アカウントを再選択します...")
                 driver.execute_script("arguments[0].click();", account_buttons[0])
@@ -627,9 +859,20 @@ def click_reloads_selenium():
     print(f"現在のURL: {driver.current_url}")
 
     try:
-        WebDriverWait(driver, 30).until(
-            EC.presence_of_element_located((By.ID, "registered-accounts"))
+        wait_until(
+            driver, "top.registered_accounts",
+            EC.presence_of_element_located((By.ID, "registered-accounts")),
+            default=30, minimum=5,
         )
+
+        # 有効期間内に更新された口座は更新しない
+        refresh_state = RefreshState().load()
+        _, fresh_accounts = refresh_state.select_stale(parse_accounts(driver.page_source))
+        fresh_urls = {account["refresh_url"] for account in fresh_accounts}
+        for account in fresh_accounts:
+            print(f"  - {account['name']} は最近更新されたためスキップします")
+        metrics.set_gauge("mf_reload_buttons_skipped", len(fresh_accounts))
+
         selectors = [
             "//a[contains(@href, '/aggregation_queue') and contains(normalize-space(.), '更新')]",
             "//button[contains(normalize-space(.), '更新')]",
@@ -662,7 +905,7 @@ def click_reloads_selenium():
                     if not key_source:
                         key_source = element.get_attribute("outerHTML")[:80]
                     key = f"{tag}:{key_source}"
-                    if key in seen_keys:
+                    if key in seen_keys or info["href_dom"] in fresh_urls:
                         continue
                     seen_keys.add(key)
                     info["key"] = key
@@ -702,6 +945,30 @@ def click_reloads_selenium():
 
         button_infos = collect_button_infos()
         print(f"{len(button_infos)}個の更新ボタンが見つかりました")
+        metrics.set_gauge("mf_reload_buttons_found", len(button_infos))
+        clicked = 0
+
+        # 更新リンクは直接リクエストを送り、失敗したものだけをブラウザでクリックする
+        link_infos = [info for info in button_infos if "/aggregation_queue" in info["href_dom"]]
+        if RELOAD_MODE == "http" and link_infos:
+            try:
+                results = trigger_refreshes_http([info["href_dom"] for info in link_infos])
+            except Exception as e:
+                print(f"更新リクエストを送信できませんでした。ブラウザでクリックします: {e}")
+                results = {}
+            for info in link_infos:
+                accepted, detail = results.get(info["href_dom"], (False, None))
+                if accepted:
+                    print(f"  - 更新リクエストを送信しました ({detail}, key: {info['key']})")
+                    clicked += 1
+                    refresh_state.mark_refreshed(info["href_dom"])
+                elif detail is not None:
+                    print(f"  - 更新リクエストが失敗しました ({detail}, key: {info['key']})")
+            button_infos = [
+                info for info in button_infos
+                if not results.get(info["href_dom"], (False, None))[0]
+            ]
+
         for idx, info in enumerate(button_infos, start=1):
             try:
                 button = locate_button(info)
@@ -717,41 +984,88 @@ def click_reloads_selenium():
                 time.sleep(0.5)
                 driver.execute_script("arguments[0].click();", button)
                 print(f"  - 更新ボタン {idx} をクリックしました (key: {info['key']})")
+                clicked += 1
+                if info["href_dom"]:
+                    refresh_state.mark_refreshed(info["href_dom"])
                 time.sleep(2)
             except Exception as click_error:
                 print(f"  - 更新ボタン {idx} のクリックに失敗しました: {click_error}")
-        if button_infos:
+        metrics.set_gauge("mf_reload_buttons_clicked", clicked)
+        refresh_state.save()
+        if clicked or button_infos:
             print("すべての更新ボタンに対するクリックを試行しました。処理待ちとして5秒待機します。")
             time.sleep(5)
     except Exception as e:
         print(f"更新ボタンのクリック中にエラーが発生しました。\n{e}")
 
 
-def extract_number(text):
-    """正規表現でマイナス記号と数字を抽出
+def build_authenticated_session(driver):
+    """WebDriverのクッキーとUser-Agentを引き継いだrequests.Sessionを作成する"""
+    session = requests.Session()
+    session.headers["User-Agent"] = driver.execute_script("return navigator.userAgent")
+    for cookie in driver.get_cookies():
+        session.cookies.set(
+            cookie["name"],
+            cookie["value"],
+            domain=cookie.get("domain", ""),
+            path=cookie.get("path", "/"),
+        )
+    return session
+
+
+def trigger_refreshes_http(refresh_urls, max_workers=None):
+    """更新リンクのエンドポイントに、ブラウザを介さず並行してリクエストを送る
 
     Args:
-        text (str): 抽出元の文字列
+        refresh_urls (list of str): 更新リンクのhref（"/aggregation_queue/..."）
+        max_workers (int, optional): 同時に送るリクエストの数
 
     Returns:
-        int: マッチした場合はその値をそうでない場合は0を格納する
+        dict: href → (受け付けられたか, ステータスコードまたはエラーの内容)
     """
-    match = re.search(r"-?\d+,?\d+", text)
-    if match:
-        # 抽出した値のカンマを除去して整数に変換
-        return int(match.group().replace(",", ""))
+    soup = BeautifulSoup(driver.page_source, "html.parser")
+    csrf_meta = soup.find("meta", attrs={"name": "csrf-token"})
+    if csrf_meta is None or not csrf_meta.get("content"):
+        raise RuntimeError("CSRFトークンが見つかりません")
+    csrf_token = csrf_meta["content"]
 
-    return 0
+    session = build_authenticated_session(driver)
+    headers = {
+        "X-CSRF-Token": csrf_token,
+        "X-Requested-With": "XMLHttpRequest",
+        "Referer": driver.current_url,
+    }
+
+    def post(refresh_url):
+        started = time.perf_counter()
+        try:
+            response = session.post(
+                urljoin(f"{MF_BASE_URL}/", refresh_url),
+                headers=headers,
+                data={"authenticity_token": csrf_token},
+                allow_redirects=False,
+                timeout=30,
+            )
+        except requests.exceptions.RequestException as e:
+            metrics.observe_http("moneyforward", "POST", "error", time.perf_counter() - started)
+            return False, str(e)
+        metrics.observe_http("moneyforward", "POST", response.status_code, time.perf_counter() - started)
+        # ログインページへのリダイレクトはセッションが引き継げていない
+        redirected_to_login = "sign_in" in response.headers.get("Location", "")
+        return response.status_code < 400 and not redirected_to_login, response.status_code
+
+    with ThreadPoolExecutor(max_workers=max_workers or RELOAD_CONCURRENCY) as executor:
+        return dict(zip(refresh_urls, executor.map(post, refresh_urls)))
 
 
 def get_all_amount():
     """すべての口座の値を取得
 
     Returns:
-        str: 口座の値
+        AccountBook: カテゴリごとの口座の値
     """
     # 現在のURLを確認し、トップページにいない場合のみアクセス
-    toppage_url = "https://moneyforward.com"
+    toppage_url = MF_BASE_URL
     current_url = driver.current_url or ""
 
     if not current_url.startswith(toppage_url) or "/account_selector" in current_url:
@@ -763,7 +1077,7 @@ def get_all_amount():
         if "/account_selector" in driver.current_url:
             print("account_selectorページが表示されました。アカウントを選択します...")
             try:
-                account_buttons = driver.find_elements(By.XPATH, "//a[contains(@href, 'moneyforward.com')]")
+                account_buttons = driver.find_elements(By.XPATH, MF_LINK_XPATH)
                 if account_buttons:
                     driver.execute_script("arguments[0].click();", account_buttons[0])
                     time.sleep(5)
@@ -784,8 +1098,10 @@ def get_all_amount():
 
     # registered-accounts要素が表示されるまで待機
     try:
-        WebDriverWait(driver, 30).until(
-            EC.presence_of_element_located((By.ID, "registered-accounts"))
+        wait_until(
+            driver, "top.registered_accounts",
+            EC.presence_of_element_located((By.ID, "registered-accounts")),
+            default=30, minimum=5,
         )
         print("✓ registered-accounts要素が見つかりました")
     except Exception as e:
@@ -815,41 +1131,75 @@ def get_all_amount():
         print(f"Error: {e}")
     if not li_elements:
         print("No 'li' elements found.")
-    # 出力を格納する辞書
-    all_amount = {}
+    # 出力を格納するカテゴリ別の口座一覧
+    all_amount = AccountBook()
+    # 口座ごとの(カテゴリ, 口座名, 詳細ページのURL, 取得日時)と、使用高・残高の文字列
+    accounts = []
+    amount_texts = []
     # 各liタグを処理
     for li in li_elements:
         if "heading-category-name" in li["class"]:
             heading = li.text.strip()
-            if heading not in all_amount:
-                all_amount[heading] = []
+            all_amount.add_category(heading)
         elif "account" in li["class"]:
-            # 口座名
-            bank_name = li.find("a").text
-            # 使用高
-            amount_ = li.find("ul", class_="amount").find(
-                "li", class_="number")
-            amount = extract_number(amount_.text) if amount_ else 0
-            # 残高
-            balance_ = li.find("ul", class_="amount").find(
-                "li", class_="balance")
-            balance = extract_number(balance_.text) if balance_ else 0
-
-            account_data = {
-                "bank_name": bank_name,
-                "number": amount,
-                "balance": balance,
-            }
-
-            all_amount[heading].append(account_data)
+            # 口座名と詳細ページのURL
+            account_link = li.find("a")
+            bank_name = account_link.text
+            detail_url = (
+                urljoin(f"{MF_BASE_URL}/", account_link["href"]) if account_link.get("href") else None
+            )
+            # 取得日時（詳細ページの内容が変わったかどうかの判定に使う）
+            date = li.find(class_="date")
+            updated_at = parse_updated_at(date.text) if date else None
+            amount_list = li.find("ul", class_="amount")
+            # 使用高と残高（金額への変換は最後にまとめて行う）
+            amount_ = amount_list.find("li", class_="number")
+            balance_ = amount_list.find("li", class_="balance")
+            accounts.append((heading, bank_name, detail_url, updated_at))
+            amount_texts.append(amount_.text if amount_ else "")
+            amount_texts.append(balance_.text if balance_ else "")
+
+    amounts = parse_amounts(amount_texts)
+    for index, (heading, bank_name, detail_url, updated_at) in enumerate(accounts):
+        amount, balance = amounts[2 * index], amounts[2 * index + 1]
+        all_amount.add(heading, bank_name, amount, balance, detail_url, updated_at)
 
     return all_amount
 
 
+def scrape_securities_holdings(session, all_amount, account_rules=None):
+    """証券口座の詳細ページから保有銘柄を取得する
+
+    Args:
+        session (requests.Session): ログイン中のクッキーを持つセッション
+        all_amount (AccountBook): 口座の値
+        account_rules (AccountRules, optional): 口座の分類ルール（省略時はファイルから読み込む）
+
+    Returns:
+        dict: 口座名 → 保有銘柄（Holding）のlist
+    """
+    account_rules = account_rules or AccountRules.load()
+    accounts = [
+        record for record in account_rules.report_accounts(all_amount) if record.detail_url
+    ]
+    holdings_by_url = fetch_holdings(
+        session,
+        [record.detail_url for record in accounts],
+        updated_at={record.detail_url: record.updated_at for record in accounts},
+    )
+    return {
+        record.bank_name: holdings_by_url[record.detail_url]
+        for record in accounts
+        if record.detail_url in holdings_by_url
+    }
+
+
 class CreateMonthlyBalancePage:
-    def __init__(self, notion_token, parent_page_id):
+    def __init__(self, notion_token, parent_page_id, rate_limiter=None):
         self.notion_token = notion_token
         self.parent_page_id = parent_page_id
+        # 複数のスレッドから呼び出す場合に共有するレートリミッター（notion_report.RateLimiter）
+        self.rate_limiter = rate_limiter
         self.headers = {
             "Authorization": f"Bearer {self.notion_token}",
             "Content-Type": "application/json",
@@ -869,15 +1219,8 @@ class CreateMonthlyBalancePage:
         """
         today = datetime.date.today()
 
-        # 当月の25日を取得
-        payday = datetime.date(today.year, today.month, 25)
-
-        # 25日が土日または祝日であれば、直近の平日を取得
-        while payday.weekday() >= 5 or jpholiday.is_holiday(payday):
-            payday -= datetime.timedelta(days=1)
-
         # 今日が給料日かどうか確認
-        return today == payday
+        return today == get_payday(today.year, today.month)
 
     def get_database_id_from_json(self, json_file_path):
         """
@@ -907,27 +1250,37 @@ class CreateMonthlyBalancePage:
             value (str): 新しい値。
 
         """
-        with open(json_file_path, "r") as json_file:
-            json_data = json.load(json_file)
+        try:
+            with open(json_file_path, "r") as json_file:
+                json_data = json.load(json_file)
+        except FileNotFoundError:
+            json_data = {}
 
         json_data[key] = value
 
-        with open(json_file_path, "w") as json_file:
-            json.dump(json_data, json_file, indent=4)
+        # 書き込み中に中断してもファイルが壊れないよう、一時ファイルから置き換える
+        atomic_write_json(json_file_path, json_data)
+
+    def month_registry(self):
+        """月 → 月次データベースのIDの索引を返す"""
+        return MonthRegistry(self.notion_request, self.parent_page_id)
 
     def get_value_from_dict(self, all_amount, key, bank_name, default=None):
         """
         指定された辞書から、特定の銀行やカードの値を取得する関数。
 
         Args:
-            all_amount (dict): 銀行やカードの情報が含まれる辞書。
+            all_amount (AccountBook | dict): 銀行やカードの情報が含まれる辞書。
             key (str): 辞書のキー（"銀行"や"カード"など）。
             bank_name (str): 取得する銀行やカードの名前。
             default: 値が見つからない場合に返すデフォルト値。
 
         Returns:
-            int: 取得した値。
+            AccountRecord | dict: 取得した口座の値。
         """
+        if isinstance(all_amount, AccountBook):
+            return all_amount.find(key, bank_name, default)
+
         return next(
             (item for item in all_amount[key]
              if bank_name in item["bank_name"]),
@@ -941,15 +1294,7 @@ class CreateMonthlyBalancePage:
             list: Notionデータベースの値
         """
         notion_database = []
-        # URLを関数内で定義
-        url = f"https://api.notion.com/v1/databases/{database_id}/query"
-
-        response = requests.post(url, headers=self.headers)
-        if response.status_code != 200:
-            print(
-                f"データベースの取得中にエラーが発生しました。ステータスコード: {response.status_code}"
-            )
-        results = response.json().get("results", [])
+        results = self.query_database_pages(database_id)
 
         for result in results:
             name = result["properties"]["名前"]["title"][0].get(
@@ -959,21 +1304,196 @@ class CreateMonthlyBalancePage:
 
         return notion_database
 
-    def create_database(self):
+    def notion_request(self, method, path, body=None):
+        """Notion APIにリクエストを送る
+
+        Args:
+            method (str): HTTPメソッド
+            path (str): "/v1/..."から始まるパス
+            body (dict, optional): リクエストボディ
+
+        Returns:
+            requests.Response: レスポンス（429の場合はRetry-Afterだけ待って再送する）
         """
-        Notion APIを使用して、新しいデータベースを作成します。
+        for attempt in range(NOTION_MAX_RETRIES + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                response = requests.request(
+                    method,
+                    f"https://api.notion.com{path}",
+                    headers=self.headers,
+                    data=json.dumps(body) if body is not None else None,
+                    timeout=NOTION_TIMEOUT,
+                )
+            except requests.exceptions.RequestException:
+                metrics.observe_http("notion", method, "error", time.perf_counter() - started)
+                raise
+            metrics.observe_http("notion", method, response.status_code, time.perf_counter() - started)
+            if response.status_code != 429 or attempt == NOTION_MAX_RETRIES:
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            wait = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else 2 ** attempt
+            print(f"Notionのレート制限に達しました。{wait:.0f}秒後に再送します")
+            time.sleep(wait)
+
+    def query_database_pages(self, database_id):
+        """データベースのページをすべて取得する（100件ごとのページネーションに対応）
 
         Returns:
-            str: 作成されたデータベースのID。エラーが発生した場合はNoneを返します。
+            list of dict: Notion APIのページオブジェクト
         """
+        pages = []
+        body = {"page_size": 100}
+        while True:
+            response = self.notion_request(
+                "POST", f"/v1/databases/{database_id}/query", body
+            )
+            if response.status_code != 200:
+                print(
+                    f"データベースの取得中にエラーが発生しました。ステータスコード: {response.status_code}"
+                )
+            data = response.json()
+            pages.extend(data.get("results", []))
+            if not data.get("has_more"):
+                return pages
+            body = {"page_size": 100, "start_cursor": data["next_cursor"]}
+
+    def month_database_title(self):
+        """給料日に作成する月次データベースのタイトル（翌月分）を返す"""
         # 現在の日付と月を取得
         current_month = datetime.datetime.now()
         # 1ヶ月加える
         month = (current_month + relativedelta(months=1)).month
+        return f"{month}月度のお金"
+
+    def _is_month_database(self, database, title, key):
+        plain_title = "".join(t.get("plain_text", "") for t in database.get("title", []))
+        parent_id = (database.get("parent") or {}).get("page_id") or ""
+        return (
+            not database.get("archived")
+            and plain_title == title
+            and parent_id.replace("-", "") == self.parent_page_id.replace("-", "")
+            # タイトルには年がないため、前年の同じ月のデータベースと作成日時で区別する
+            and title_month_key(plain_title, database["created_time"]) == key
+        )
+
+    def find_month_database(self, title, known_database_id=None, key=None):
+        """親ページ配下にある指定タイトルのデータベースを探す
+
+        Args:
+            title (str): データベースのタイトル
+            known_database_id (str, optional): JSONに保存されているID。先に確認する。
+            key (str, optional): データベースの月（"YYYY-MM"）。省略した場合は今日使っている月。
+
+        Returns:
+            str: データベースのID。見つからない場合はNone。
+        """
+        key = key or cycle_month_key()
+        if known_database_id:
+            response = self.notion_request("GET", f"/v1/databases/{known_database_id}")
+            if response.status_code == 200 and self._is_month_database(response.json(), title, key):
+                return known_database_id
+
+        body = {
+            "query": title,
+            "filter": {"property": "object", "value": "database"},
+            "page_size": 100,
+        }
+        while True:
+            response = self.notion_request("POST", "/v1/search", body)
+            if response.status_code != 200:
+                print(f"データベースの検索中にエラーが発生しました。ステータスコード: {response.status_code}")
+                return None
+            data = response.json()
+            for database in data.get("results", []):
+                if self._is_month_database(database, title, key):
+                    return database["id"]
+            if not data.get("has_more"):
+                return None
+            body = {**body, "start_cursor": data["next_cursor"]}
+
+    def _page_state(self, page):
+        """比較用にページの値を取り出す"""
+        properties = page["properties"]
+        return {
+            "amount": properties["金額"].get("number"),
+            "categories": sorted(item["name"] for item in properties["資産/負債"]["multi_select"]),
+            "note": "".join(t.get("plain_text", "") for t in properties["備考"]["rich_text"]),
+            "icon_emoji": (page.get("icon") or {}).get("emoji"),
+        }
+
+    def upsert_pages(self, database_id, pages_data):
+        """
+        既存のページと名前で突き合わせ、ないページだけを作成し、値が変わったページだけを更新します。
+
+        Args:
+            database_id (str): ページを作成するデータベースのID。
+            pages_data (list of dict): create_multiple_pagesと同じ形式のページのデータ。
+
+        Returns:
+            dict: 作成・更新・変更なしの件数。
+        """
+        existing = {}
+        for page in self.query_database_pages(database_id):
+            if page.get("archived"):
+                continue
+            title = page["properties"]["名前"]["title"]
+            name = "".join(t.get("plain_text", "") for t in title)
+            existing.setdefault(name, page)
+
+        to_create = []
+        counts = {"created": 0, "updated": 0, "unchanged": 0}
+        for page_data in pages_data:
+            page = existing.get(page_data["name"])
+            if page is None:
+                to_create.append(page_data)
+                continue
 
+            desired = {
+                "amount": int(page_data["amount"]),
+                "categories": sorted(page_data["categories"]),
+                "note": page_data["note"],
+                "icon_emoji": page_data.get("icon_emoji"),
+            }
+            if self._page_state(page) == desired:
+                counts["unchanged"] += 1
+                continue
+
+            body = self.build_page_data(database_id, **page_data)
+            del body["parent"]
+            if outbox.is_enabled():
+                key = "notion-patch:{}:{}".format(
+                    page["id"], outbox.make_idempotency_key("notion", body)
+                )
+                outbox.enqueue_notion_request("PATCH", f"/v1/pages/{page['id']}", body, key)
+            else:
+                response = self.notion_request("PATCH", f"/v1/pages/{page['id']}", body)
+                if response.status_code != 200:
+                    print(
+                        f"ページ '{page_data['name']}' の更新中にエラーが発生しました。ステータスコード: {response.status_code}"
+                    )
+                    print(response.text)
+                    continue
+            counts["updated"] += 1
+
+        counts["created"] = len(self.create_multiple_pages(database_id, to_create))
+        print(
+            f"Notionのページ: 作成 {counts['created']}件 / 更新 {counts['updated']}件 / 変更なし {counts['unchanged']}件"
+        )
+        return counts
+
+    def create_database(self):
+        """
+        Notion APIを使用して、新しいデータベースを作成します。
+
+        Returns:
+            str: 作成されたデータベースのID。エラーが発生した場合はNoneを返します。
+        """
         data = {
             "parent": {"type": "page_id", "page_id": self.parent_page_id},
-            "title": [{"type": "text", "text": {"content": f"{month}月度のお金"}}],
+            "title": [{"type": "text", "text": {"content": self.month_database_title()}}],
             "icon": {"type": "emoji", "emoji": "💵"},
             "properties": {
                 "名前": {"title": {}},
@@ -992,11 +1512,7 @@ class CreateMonthlyBalancePage:
             },
         }
 
-        response = requests.post(
-            "https://api.notion.com/v1/databases",
-            headers=self.headers,
-            data=json.dumps(data),
-        )
+        response = self.notion_request("POST", "/v1/databases", data)
 
         if response.status_code == 200:
             return response.json()["id"]
@@ -1022,6 +1538,26 @@ class CreateMonthlyBalancePage:
         Returns:
             str: 作成されたページのID。エラーが発生した場合はNoneを返します。
         """
+        data = self.build_page_data(database_id, name, amount, categories, note, icon_emoji)
+
+        response = self.notion_request("POST", "/v1/pages", data)
+
+        if response.status_code == 200:
+            return response.json()["id"]
+        else:
+            print(
+                f"ページ '{name}' の作成中にエラーが発生しました。ステータスコード: {response.status_code}"
+            )
+            print(response.text)
+            return None
+
+    def build_page_data(self, database_id, name, amount, categories, note, icon_emoji=None):
+        """
+        ページ作成APIに送るデータを組み立てます。引数はcreate_pageと同じです。
+
+        Returns:
+            dict: リクエストボディ。
+        """
         data = {
             "parent": {"database_id": database_id},
             "properties": {
@@ -1038,21 +1574,7 @@ class CreateMonthlyBalancePage:
         if icon_emoji:
             data["icon"] = {"type": "emoji", "emoji": icon_emoji}
 
-        # Notionの認証トークン
-        response = requests.post(
-            "https://api.notion.com/v1/pages",
-            headers=self.headers,
-            data=json.dumps(data),
-        )
-
-        if response.status_code == 200:
-            return response.json()["id"]
-        else:
-            print(
-                f"ページ '{name}' の作成中にエラーが発生しました。ステータスコード: {response.status_code}"
-            )
-            print(response.text)
-            return None
+        return data
 
     def create_multiple_pages(self, database_id, pages_data):
         """
@@ -1063,8 +1585,18 @@ class CreateMonthlyBalancePage:
             pages_data (list of dict): 各ページに関するデータのリスト。各辞書は、名前、金額、カテゴリ、備考、アイコンなどの情報を含みます。
 
         Returns:
-            list of str: 作成されたページのIDのリスト。
+            list of str: 作成されたページのIDのリスト。アウトボックスを使う場合は冪等キーのリスト。
         """
+        if outbox.is_enabled():
+            queued_pages = []
+            for page_data in pages_data:
+                key = f"notion-page:{database_id}:{page_data['name']}"
+                outbox.enqueue_notion_request(
+                    "POST", "/v1/pages", self.build_page_data(database_id, **page_data), key
+                )
+                queued_pages.append(key)
+            return queued_pages
+
         created_pages = []
         for page_data in pages_data:
             page_id = self.create_page(database_id, **page_data)
@@ -1073,12 +1605,35 @@ class CreateMonthlyBalancePage:
 
         return created_pages
 
-    def main(self, all_amount):
+    def read_current_month_balance(self, json_file_path="month-page-id.json"):
+        """
+        月初の残高ページの金額を合計して返す（Notionへの書き込みは行わない）。
+
+        Args:
+            json_file_path (str): データベースIDを保存しているJSONファイルのパス。
+
+        Returns:
+            int: 月初の残高。データベースIDが見つからない場合は0。
+        """
+        database_id = self.get_database_id_from_json(json_file_path)
+        if database_id is None:
+            # JSONがない場合は月の索引から探す
+            database_id = self.month_registry().resolve(cycle_month_key())
+
+        if database_id is None:
+            print("database_idが見つかりません。残高を0として返します。")
+            return 0
+
+        notion_database = self.get_database(database_id)
+        return sum(item["price"] for item in notion_database)
+
+    def main(self, all_amount, account_rules=None):
         """
         Notion APIを使用して、月次の資産負債を管理するページを作成し、金額の合計を計算して表示します。
 
         Args:
-             all_amount (dict)： 様々な資産と負債の金額を含む辞書。
+             all_amount (AccountBook)： 様々な資産と負債の金額を含む辞書。
+             account_rules (AccountRules, optional): 口座の分類ルール（省略時はファイルから読み込む）
         """
 
         current_month_balance = 0
@@ -1095,124 +1650,78 @@ class CreateMonthlyBalancePage:
         # 給料日ではない日の処理
         if not self.is_payday():
             # database_idを取得して現在の残高を計算
-            database_id = self.get_database_id_from_json(json_file_path)
-
-            if database_id is None:
-                print("database_idが見つかりません。残高を0として返します。")
-                return 0
-
-            notion_database = self.get_database(database_id)
-            current_month_balance = sum(item["price"]
-                                        for item in notion_database)
-
-            return current_month_balance
+            return self.read_current_month_balance(json_file_path)
         # 給料日の処理
         else:
-            # データベースを新規作成し、IDをJSONに書き込む
-            database_id = self.create_database()
-            self.update_json_file(json_file_path, "page_id", database_id)
-
-            # 必要な値を取得
-            bank_balance = self.get_value_from_dict(
-                all_amount, "銀行", "三井住友銀行"
-            ).get("number")
-            card_data = self.get_value_from_dict(
-                all_amount, "カード", "三井住友カード", {}
-            )
+            # 既存の月次データベースがあれば再利用し、なければ新規作成してIDをJSONと月の索引に書き込む
+            # 同時に実行された他のプロセスが同じ月のデータベースを作成しないよう、ロックしたまま行う
+            with file_lock(f"{json_file_path}.lock", timeout=LOGIN_LOCK_TIMEOUT):
+                registry = self.month_registry()
+                key = cycle_month_key()
+                title = self.month_database_title()
+                known_database_id = self.get_database_id_from_json(json_file_path)
+                # 索引（作成日時から年を求めている）で探し、見つからなければJSONのIDとタイトルで探す。
+                # タイトルでの検索もfind_month_databaseで月が一致するものだけを返す
+                database_id = registry.resolve(key) or self.find_month_database(
+                    title, known_database_id, key
+                )
+                if database_id is None:
+                    database_id = self.create_database()
+                else:
+                    print(f"既存の月次データベースを使用します: {database_id}")
+                if database_id != known_database_id:
+                    self.update_json_file(json_file_path, "page_id", database_id)
+                if database_id and database_id != registry.get(key):
+                    registry.register(key, database_id, title)
+
+            # 給料日の残高の取得元の口座と固定の行、「資産/負債」の選択肢は分類ルールで決める
+            account_rules = account_rules or AccountRules.load()
+            bank_data = account_rules.payday_source(all_amount, "bank")
+            if bank_data is None:
+                raise ValueError("給料日の残高の取得元（銀行）の口座が見つかりません")
+            bank_balance = bank_data.get("number")
+            card_data = account_rules.payday_source(all_amount, "card") or {}
             current_credit = card_data.get("number")
             next_credit = (
                 card_data.get("balance", 0) -
                 current_credit if current_credit else None
             )
 
-            # 環境変数から値を取得
-            env_vars = [
-                "HOUSE_BANK",
-                "RAKUTEN_BANK",
-                "HOUSE_RENT",
-                "FIXED_COST",
-                "FOOD_EXPENSE",
-            ]
-            house_bank, rakuten_bank, house_rent, fixed_cost, food_expense = map(
-                int, [os.environ[var] for var in env_vars]
-            )
-
             if database_id:
+                card_label = account_rules.payday_label("card", "負債")
+                bank_label = account_rules.payday_label("bank", "資産")
                 # 複数のページを作成
-                pages_to_create = [
-                    {
-                        "icon_emoji": "🍳",
-                        "name": "お自炊",
-                        "amount": food_expense,
-                        "categories": ["負債"],
-                        "note": "",
-                    },
-                    {
-                        "icon_emoji": "🚰",
-                        "name": "固定費",
-                        "amount": fixed_cost,
-                        "categories": ["負債"],
-                        "note": "",
-                    },
-                    {
-                        "icon_emoji": "🏠",
-                        "name": "家賃",
-                        "amount": house_rent,
-                        "categories": ["負債"],
-                        "note": "",
-                    },
+                pages_to_create = account_rules.entry_pages() + [
                     {
                         "icon_emoji": "💳",
                         "name": "来月の支払い",
                         "amount": next_credit,
-                        "categories": ["負債"],
+                        "categories": [card_label],
                         "note": "",
                     },
                     {
                         "icon_emoji": "💸",
                         "name": "今月の支払い",
                         "amount": current_credit,
-                        "categories": ["負債"],
-                        "note": "",
-                    },
-                    {
-                        "icon_emoji": "🎇",
-                        "name": "楽天銀行",
-                        "amount": rakuten_bank,
-                        "categories": ["資産"],
-                        "note": "",
-                    },
-                    {
-                        "icon_emoji": "🧰",
-                        "name": "お家銀行",
-                        "amount": house_bank,
-                        "categories": ["資産"],
+                        "categories": [card_label],
                         "note": "",
                     },
                     {
                         "icon_emoji": "🏦",
                         "name": "銀行預金",
                         "amount": bank_balance,
-                        "categories": ["資産"],
+                        "categories": [bank_label],
                         "note": "",
                     },
                 ]
 
-                # 複数のページを作成
-                self.create_multiple_pages(database_id, pages_to_create)
+                # ないページだけを作成し、値が変わったページだけを更新
+                self.upsert_pages(database_id, pages_to_create)
 
                 # 金額の残りを計算
-                sum_list = [
-                    bank_balance,
-                    current_credit,
-                    next_credit,
-                    house_bank,
-                    rakuten_bank,
-                    house_rent,
-                    fixed_cost,
-                    food_expense,
-                ]
-                current_month_balance = sum(sum_list)
+                current_month_balance = sum(
+                    page["amount"] for page in pages_to_create if page["amount"] is not None
+                )
 
                 return current_month_balance
 
@@ -1222,12 +1731,13 @@ def get_current_month_expense():
     現在の月の支出額を取得します。
 
     SeleniumとBeautifulSoupを使って、マネーフォワードの支出概要ページから
-    現在の月の支出合計を取得します。
+    現在の月の支出合計を取得します。ページの表全体（月ごとの収入・支出・カテゴリ）は
+    summary-cache.jsonに保存します。
 
     Returns:
         int: 現在の月の支出合計を数値として返します。
     """
-    summary_url = "https://moneyforward.com/cf/summary"
+    summary_url = f"{MF_BASE_URL}/cf/summary"
     print(f"支出サマリページにアクセスします: {summary_url}")
     driver.get(summary_url)
     time.sleep(5)  # ページ読み込み待機
@@ -1236,7 +1746,7 @@ def get_current_month_expense():
     if "/account_selector" in driver.current_url:
         print("account_selectorページが表示されました。アカウントを選択します...")
         try:
-            account_buttons = driver.find_elements(By.XPATH, "//a[contains(@href, 'moneyforward.com')]")
+            account_buttons = driver.find_elements(By.XPATH, MF_LINK_XPATH)
             if account_buttons:
                 driver.execute_script("arguments[0].click();", account_buttons[0])
                 time.sleep(5)
@@ -1250,8 +1760,10 @@ def get_current_month_expense():
 
     # monthly-total要素が表示されるまで待機
     try:
-        WebDriverWait(driver, 30).until(
-            EC.presence_of_element_located((By.ID, "monthly-total"))
+        wait_until(
+            driver, "summary.monthly_total",
+            EC.presence_of_element_located((By.ID, "monthly-total")),
+            default=30, minimum=5,
         )
         print("✓ monthly-total要素が見つかりました")
     except Exception as e:
@@ -1262,7 +1774,18 @@ def get_current_month_expense():
         except:
             pass
 
-    soup = BeautifulSoup(driver.page_source, "html.parser")
+    page_source = driver.page_source
+
+    # 表全体を月 × 項目で取り出し、締まった月はキャッシュに残す
+    summary_cache = SummaryCache().load()
+    current_month = summary_cache.update(parse_summary(page_source))
+    summary_cache.save()
+    if current_month is not None and current_month.expense is not None:
+        print(f"収支内訳: {len(summary_cache.months)}か月分（締まった月 {len(summary_cache.closed)}か月）")
+        return current_month.expense
+
+    # 月の見出しが読み取れない場合は、合計の表の最後のセルを今月の支出とする
+    soup = BeautifulSoup(page_source, "html.parser")
     monthly_total_section = soup.find("section", id="monthly-total")
 
     if not monthly_total_section:
@@ -1277,14 +1800,13 @@ def get_current_month_expense():
         raise Exception("No 'td' elements found in tbody")
 
     current_month_expense_ = td_elements[-1]
-    current_month_expense = extract_number(
-        current_month_expense_.text.replace("\n", "")
-    )
+    current_month_expense = parse_amount(current_month_expense_.text)
 
     return current_month_expense
 
 
-def calculate_balance(all_amount, current_month_balance, current_month_expense):
+def calculate_balance(all_amount, current_month_balance, current_month_expense, holdings=None,
+                      account_rules=None):
     """
     月初の残高と証券口座の情報を基に、バランスシートを計算します。
 
@@ -1292,62 +1814,93 @@ def calculate_balance(all_amount, current_month_balance, current_month_expense):
     合計の残高と証券口座の情報を出力します。
 
     Args:
-        all_amount (dict): 資産や負債に関するデータ。
+        all_amount (AccountBook): 資産や負債に関するデータ。
         current_month_balance (int): 現在の残高。
         current_month_expense (int): 現在の月の支出額。
+        holdings (dict, optional): 口座名 → 保有銘柄のlist。証券口座の下に銘柄ごとに表示します。
+        account_rules (AccountRules, optional): 口座の分類ルール（省略時はファイルから読み込む）
 
     Returns:
         tuple: 計算された残高と証券口座の情報を文字列として返します。
     """
-    stock_list = []
-
-    # マネーフォワードの証券口座
-    for category, items in all_amount.items():
-        for item in items:
-            if category == "証券":
-                stock_list.append(
-                    {"name": item["bank_name"], "price": item["number"]})
+    account_rules = account_rules or AccountRules.load()
+    # マネーフォワードの証券口座（分類ルールで表示するとした口座。非表示の口座は除く）
+    stock_list = [
+        {"name": item["bank_name"], "price": item["number"]}
+        for item in account_rules.report_accounts(all_amount)
+    ]
 
     # 月初の残高 - 現在の支出
     balance_ = current_month_balance + current_month_expense
+    metrics.set_gauge("mf_balance_yen", balance_, {"kind": "lucky_money"})
+    metrics.set_gauge("mf_balance_yen", current_month_balance, {"kind": "current_month_balance"})
+    metrics.set_gauge("mf_balance_yen", current_month_expense, {"kind": "current_month_expense"})
+    for item in stock_list:
+        metrics.set_gauge("mf_stock_yen", item["price"], {"name": item["name"]})
+    for role, total in account_rules.role_totals(all_amount).items():
+        metrics.set_gauge("mf_accounts_yen", total, {"role": role})
     balance = f"{balance_:,}円"
-    stock = "\n".join(
-        [f"{item['name']}: {item['price']:,}円" for item in stock_list])
+    stock_lines = []
+    for item in stock_list:
+        stock_lines.append(f"{item['name']}: {item['price']:,}円")
+        for holding in (holdings or {}).get(item["name"], []):
+            line = f"  ・{holding.name}: {holding.valuation:,}円"
+            if holding.profit_loss is not None:
+                line += f"（損益 {holding.profit_loss:+,}円）"
+            stock_lines.append(line)
+    stock = "\n".join(stock_lines)
 
     return balance, stock
 
 
+def get_line_recipients():
+    """LINEの宛先を返す（USER_IDにカンマ区切りで複数指定できる）"""
+    return [user_id.strip() for user_id in os.environ["USER_ID"].split(",") if user_id.strip()]
+
+
 def send_line_message(context):
-    """LineNotifyでメッセージを送信する
+    """LINE Messaging APIでメッセージを送信する
 
     Args:
         context str: 送信する文字列
     """
-    # APIのURLとトークン
-    LINE_API_URL = "https://api.line.me/v2/bot/message/push"
     load_dotenv(verbose=True)
-    LINE_ACCESS_PARSE_MONEY_FORWORD_TOKEN = os.environ["LINE_ACCESS_PARSE_MONEY_FORWORD_TOKEN"]
-    USER_ID = os.environ["USER_ID"]
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LINE_ACCESS_PARSE_MONEY_FORWORD_TOKEN}",
-    }
-    data = {
-        "to": USER_ID,
-        "messages": [{"type": "text", "text": context}],
-    }
+    # アウトボックスに積み、配送は別プロセスのワーカーに任せる
+    if outbox.is_enabled():
+        outbox.enqueue_line_message([context])
+        return {"queued": True}
+
+    messenger = LineMessenger(os.environ["LINE_ACCESS_PARSE_MONEY_FORWORD_TOKEN"])
 
     # メッセージを送信
     try:
-        response = requests.post(
-            LINE_API_URL, headers=headers, json=data)
-        response.raise_for_status()  # HTTPエラーがある場合は例外を発生
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return messenger.send(get_line_recipients(), [context])
+    except LineDeliveryError as e:
         return {"error": str(e)}
 
 
+def send_error_report(error, error_traceback):
+    """エラーの概要とトレースバックを1回の送信でまとめて通知する
+
+    Args:
+        error (Exception): 発生した例外
+        error_traceback (str): 整形済みのトレースバック
+    """
+    messenger = LineMessenger(os.getenv("LINE_ACCESS_LOG_RELAY_TOKEN"), max_retries=2)
+    try:
+        messenger.send(
+            get_line_recipients(),
+            [
+                "ParseMoneyForwardでエラーが発生しました",
+                f"エラーが発生しました: {str(error)}",
+                f"トレースバック: {error_traceback}",
+            ],
+        )
+    except (LineDeliveryError, KeyError) as e:
+        print(f"エラー通知の送信に失敗しました: {e}")
+
+
 def main():
     load_dotenv(verbose=True)
 
@@ -1359,32 +1912,133 @@ def main():
 
     global driver
     driver = None
+    graph = None
+    rss_sampler = None
+    succeeded = False
+    error_reported = False
+    run_started = time.perf_counter()
 
-    try:
-        driver = create_webdriver()
+    def abort_browser(overrun):
+        pids = kill_browser_processes()
+        if pids:
+            print(f"chromedriverとブラウザのプロセスを終了しました: {len(pids)}個")
 
-        ensure_logged_in(EMAIL, PASSWORD)
+    def report_before_exit(overrun):
+        # メインスレッドがエラーを通知する前に止まった場合は、ここで打ち切った処理を通知する
+        if not error_reported:
+            send_error_report(WatchdogTimeout(watchdog.report()), "（メインスレッドが応答しないため取得できません）")
 
-        print("リロードボタンを押下します")
-        click_reloads_selenium()
+    # 処理ごとと実行全体の制限時間を超えたら、ブラウザを終了させて実行を打ち切る
+    watchdog = Watchdog(on_abort=abort_browser, on_exit=report_before_exit).start()
 
-        all_amount = get_all_amount()
-        print("マネーフォワードの口座:")
-        pprint(all_amount)
+    try:
+        with watchdog.phase("startup"):
+            driver = create_webdriver()
 
         create_monthly_balance_page = CreateMonthlyBalancePage(
             NOTION_TOKEN, PARENT_PAGE_ID
         )
-        current_month_balance = create_monthly_balance_page.main(all_amount)
-        print(f"月初の残高: {current_month_balance}")
+        # 口座の分類ルールは1回だけ読み込み、オートマトンを各処理で共有する
+        account_rules = AccountRules.load()
+
+        def reload_accounts():
+            print("リロードボタンを押下します")
+            click_reloads_selenium()
+
+        def scrape_all_amount():
+            all_amount = get_all_amount()
+            print("マネーフォワードの口座:")
+            pprint(account_rules.visible(all_amount).as_dict())
+            return all_amount
+
+        def fetch_current_month_balance(all_amount):
+            current_month_balance = create_monthly_balance_page.main(all_amount, account_rules)
+            print(f"月初の残高: {current_month_balance}")
+            return current_month_balance
+
+        def scrape_current_month_expense():
+            current_month_expense = get_current_month_expense()
+            print(f"現在の支出: {current_month_expense:,}")
+            return current_month_expense
+
+        def scrape_holdings(session, all_amount):
+            # 保有銘柄は補足情報のため、取得できなくても処理を続ける
+            try:
+                return scrape_securities_holdings(session, all_amount, account_rules)
+            except Exception as e:
+                print(f"保有銘柄の取得に失敗しました: {e}")
+                return {}
 
-        current_month_expense = get_current_month_expense()
-        current_month_expense_formatted = "{:,}".format(current_month_expense)
-        print(f"現在の支出: {current_month_expense_formatted}")
+        def forecast_month_end(current_month_balance):
+            # 給料日だけ、次の給料日時点の残高を支出の履歴から予測する
+            if not create_monthly_balance_page.is_payday():
+                return None
+            try:
+                return forecast.forecast_end_balance(current_month_balance)
+            except Exception as e:
+                print(f"残高の予測に失敗しました: {e}")
+                return None
 
-        balance, stock = calculate_balance(
-            all_amount, current_month_balance, current_month_expense
+        def ingest_transactions(session):
+            # 明細のCSVは補足情報のため、取得できなくても処理を続ける
+            try:
+                for month, count in transactions.download_transactions(session, MF_BASE_URL).items():
+                    print(f"入出金明細を保存しました: {month} {count}件")
+            except Exception as e:
+                print(f"入出金明細の取得に失敗しました: {e}")
+
+        def save_history(all_amount, current_month_expense):
+            # 分析用に口座の値と支出の履歴を保存する
+            try:
+                history.record_snapshot(all_amount, current_month_expense)
+            except Exception as e:
+                print(f"履歴の保存に失敗しました: {e}")
+
+        # ブラウザを使う処理は順番に、Notionへの通信と証券口座の詳細ページの取得は
+        # ブラウザの処理と並行して実行する
+        #   login → reload → all_amount ┬→ expense ───────────────┬→ balance
+        #                               ├→ monthly_balance ────────┤
+        #                               └→ session → holdings ─────┘
+        #   monthly_balance → forecast（給料日のみ）
+        #   session → transactions（TRANSACTIONS_MONTHSを指定した場合のみ）
+        graph = TaskGraph()
+        graph.add("login", lambda: ensure_logged_in(EMAIL, PASSWORD), resource="browser")
+        graph.add("reload", lambda _: reload_accounts(), deps=("login",), resource="browser")
+        graph.add("all_amount", lambda _: scrape_all_amount(), deps=("reload",), resource="browser")
+        graph.add("monthly_balance", fetch_current_month_balance, deps=("all_amount",))
+        graph.add(
+            "expense",
+            lambda _: scrape_current_month_expense(),
+            deps=("all_amount",),
+            resource="browser",
+        )
+        graph.add(
+            "session",
+            lambda _: build_authenticated_session(driver),
+            deps=("all_amount",),
+            resource="browser",
         )
+        graph.add("holdings", scrape_holdings, deps=("session", "all_amount"))
+        graph.add("forecast", forecast_month_end, deps=("monthly_balance",))
+        if transactions.TRANSACTIONS_MONTHS > 0:
+            graph.add("transactions", ingest_transactions, deps=("session",))
+        graph.add("history", save_history, deps=("all_amount", "expense"))
+        graph.add(
+            "balance",
+            lambda *values: calculate_balance(*values, account_rules=account_rules),
+            deps=("all_amount", "monthly_balance", "expense", "holdings"),
+        )
+
+        watchdog.watch(graph.running_since)
+        rss_sampler = RssSampler(chrome_service_pid, graph.running_tasks).start()
+        results = graph.run()
+        print(
+            "処理時間: "
+            + ", ".join(f"{name} {seconds:.1f}秒" for name, seconds in graph.durations.items())
+        )
+
+        balance, stock = results["balance"]
+        current_month_expense_formatted = "{:,}".format(results["expense"])
         print(f"ラッキーマネー: {balance}\n証券口座:\n{stock}")
 
         context = (
@@ -1392,17 +2046,60 @@ def main():
             f"[現在の支出]\n{current_month_expense_formatted}\n\n"
             f"[証券口座]\n{stock}"
         )
-        print("LineNotifyに純資産の値を送信します")
-        send_line_message(context)
+        if results["forecast"] is not None:
+            print(f"残高の予測:\n{results['forecast'].summary()}")
+            context += f"\n\n[給料日までの見込み]\n{results['forecast'].summary()}"
+        print("LINEに純資産の値を送信します")
+        with watchdog.phase("notify"):
+            send_line_message(context)
+        succeeded = True
     except Exception as e:
+        if watchdog.overrun is not None and not isinstance(e, WatchdogTimeout):
+            # ブラウザを終了させたことで発生した例外より、打ち切った理由を通知する
+            e = WatchdogTimeout(f"{watchdog.report()}: {e}")
+        error_traceback = traceback.format_exc()
         print(f"エラーが発生しました: {str(e)}")
-        print(f"トレースバック: {traceback.format_exc()}")
-        line_relay.send_message("ParseMoneyForwardでエラーが発生しました")
-        line_relay.send_message(f"エラーが発生しました: {str(e)}")
-        line_relay.send_message(f"トレースバック: {traceback.format_exc()}")
+        print(f"トレースバック: {error_traceback}")
+        error_reported = True
+        send_error_report(e, error_traceback)
     finally:
+        # 後片付けの途中では例外を送らない（終わらない場合は猶予の後にプロセスを終了する）
+        watchdog.interruptible = False
+        if watchdog.overrun is not None:
+            metrics.inc("mf_watchdog_aborts_total", {"phase": watchdog.overrun["phase"]})
+        if rss_sampler is not None:
+            rss_sampler.stop()
+            print(f"ブラウザのメモリ使用量（RSSの最大値）:\n{rss_sampler.report()}")
+            for name, rss in rss_sampler.peaks.items():
+                metrics.set_gauge("mf_browser_rss_peak_bytes", rss, {"phase": name})
+            metrics.set_gauge("mf_browser_rss_peak_bytes", rss_sampler.peak, {"phase": "total"})
         if driver:
-            driver.quit()
+            try:
+                driver.quit()
+            except Exception as e:
+                # 打ち切りでchromedriverを終了させた場合など
+                print(f"ブラウザの終了に失敗しました: {e}")
+        stop_chrome_service()
+        if outbox.is_enabled():
+            outbox.spawn_worker()
+
+        if graph is not None:
+            for name, seconds in graph.durations.items():
+                metrics.observe("mf_phase_duration_seconds", seconds, {"phase": name})
+        metrics.set_gauge("mf_run_duration_seconds", round(time.perf_counter() - run_started, 3))
+        metrics.set_gauge("mf_run_success", int(succeeded))
+        try:
+            latency.model.save()
+        except (OSError, TimeoutError) as e:
+            print(f"待機時間の記録の保存に失敗しました: {e}")
+        try:
+            metrics.write_textfile()
+        except (OSError, TimeoutError) as e:
+            print(f"メトリクスの書き出しに失敗しました: {e}")
+        watchdog.stop()
+        if watchdog.overrun is not None:
+            # 応答しないタスクのスレッドが終わるのを待たずに終了する
+            watchdog.exit()
 
 
 if __name__ == "__main__":
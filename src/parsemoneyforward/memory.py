@@ -0,0 +1,123 @@
+"""chromedriverとブラウザのプロセスツリーのメモリ使用量（RSS）を計測する
+
+実行中に一定間隔で/procを読み、chromedriverとその子孫プロセス（ブラウザ本体・レンダラーなど）の
+RSSの合計を求める。その時点で実行中の処理ごとに最大値を記録する。
+RSSの合計はプロセス間で共有しているページを重複して数えるため、実際の使用量より大きめになる。
+"""
+import os
+import threading
+
+RSS_SAMPLE_INTERVAL = float(os.environ.get("RSS_SAMPLE_INTERVAL", "0.5"))
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _parent_pids():
+    """pid → 親のpid"""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # プロセス名に空白や括弧が含まれる場合があるため、最後の")"より後ろを分割する
+        fields = stat[stat.rfind(")") + 2:].split()
+        parents[int(entry)] = int(fields[1])
+    return parents
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def process_tree_pids(root_pid):
+    """root_pidとその子孫プロセスのpid"""
+    children = {}
+    for pid, parent in _parent_pids().items():
+        children.setdefault(parent, []).append(pid)
+
+    pids = []
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, ()))
+    return pids
+
+
+def process_tree_rss(root_pid):
+    """root_pidとその子孫プロセスのRSSの合計（バイト）"""
+    return sum(_rss_bytes(pid) for pid in process_tree_pids(root_pid))
+
+
+def is_supported():
+    return os.path.isdir("/proc")
+
+
+class RssSampler:
+    """プロセスツリーのRSSを一定間隔で計測し、処理ごとの最大値を記録する"""
+
+    def __init__(self, root_pid, active_phases=None, interval=None):
+        """
+        Args:
+            root_pid (callable): 計測するプロセスツリーの根のpidを返す関数（なければNone）
+            active_phases (callable, optional): その時点で実行中の処理の名前を返す関数
+            interval (float, optional): 計測間隔（秒）
+        """
+        self.root_pid = root_pid
+        self.active_phases = active_phases or (lambda: ())
+        self.interval = RSS_SAMPLE_INTERVAL if interval is None else interval
+        self.peaks = {}
+        self.peak = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        pid = self.root_pid()
+        if pid is None:
+            return 0
+        rss = process_tree_rss(pid)
+        with self._lock:
+            self.peak = max(self.peak, rss)
+            for phase in list(self.active_phases()):
+                self.peaks[phase] = max(self.peaks.get(phase, 0), rss)
+        return rss
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"メモリ使用量の計測に失敗しました: {e}")
+                return
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self.interval <= 0 or not is_supported():
+            return self
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def report(self):
+        """処理ごとの最大値を表示用の行にする"""
+        with self._lock:
+            peaks = dict(self.peaks)
+            peak = self.peak
+        lines = [f"  {phase}: {rss / 2**20:,.0f} MiB" for phase, rss in peaks.items()]
+        lines.append(f"  最大: {peak / 2**20:,.0f} MiB")
+        return "\n".join(lines)
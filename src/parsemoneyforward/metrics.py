@@ -0,0 +1,230 @@
+"""実行ごとのメトリクスをPrometheusのテキスト形式で書き出す
+
+node exporterのtextfile collectorが読み込めるよう、METRICS_TEXTFILEに指定したファイルへ
+実行の最後にアトミックに書き出す。ゲージはその実行1回分の値、カウンターとヒストグラムは
+METRICS_STATE_PATH（省略時はMETRICS_TEXTFILEの隣のJSON）に保存した前回までの値に足した累計で、
+rate()やincrease()で実行をまたいだ増加を求められる。
+"""
+import os
+import tempfile
+import threading
+import time
+
+from state_files import atomic_write_json, file_lock, read_json
+
+METRICS_TEXTFILE = os.environ.get("METRICS_TEXTFILE")
+METRICS_STATE_PATH = os.environ.get("METRICS_STATE_PATH")
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# メトリクス名 → (種類, 説明, ヒストグラムのバケット)
+METRICS = {
+    "mf_phase_duration_seconds": ("histogram", "各処理の所要時間", DEFAULT_BUCKETS),
+    "mf_run_duration_seconds": ("gauge", "実行全体の所要時間", None),
+    "mf_run_success": ("gauge", "実行が成功した場合は1", None),
+    "mf_last_run_timestamp_seconds": ("gauge", "最後に実行した時刻", None),
+    "mf_login_total": ("counter", "ログイン方法（cookie / shared_cookie / selenium）ごとのログイン回数", None),
+    "mf_totp_attempts_total": ("counter", "TOTPコードの入力回数", None),
+    "mf_page_load_retries_total": ("counter", "ログインページの再読み込み回数", None),
+    "mf_browser_recoveries_total": ("counter", "ログインの再試行でブラウザをリセット / 作り直した回数", None),
+    "mf_reload_buttons_found": ("gauge", "見つかった更新ボタンの数", None),
+    "mf_reload_buttons_clicked": ("gauge", "クリックした更新ボタンの数", None),
+    "mf_reload_buttons_skipped": ("gauge", "最近更新されたためスキップした口座の数", None),
+    "mf_http_request_duration_seconds": ("histogram", "外部APIへのリクエストの所要時間", DEFAULT_BUCKETS),
+    "mf_http_requests_total": ("counter", "外部APIへのリクエスト数", None),
+    "mf_balance_yen": ("gauge", "計算した残高・支出（円）", None),
+    "mf_stock_yen": ("gauge", "証券口座の評価額（円）", None),
+    "mf_accounts_yen": ("gauge", "分類ルールの役割（asset / liability / savings）ごとの口座の合計（円）", None),
+    "mf_browser_rss_peak_bytes": ("gauge", "処理ごとのchromedriverとブラウザのRSSの合計の最大値（バイト）", None),
+    "mf_watchdog_aborts_total": ("counter", "制限時間を超えて打ち切った処理（runは実行全体）ごとの回数", None),
+}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+    @staticmethod
+    def _key(name, labels):
+        if name not in METRICS:
+            raise KeyError(f"未定義のメトリクスです: {name}")
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name, value, labels=None):
+        key = self._key(name, labels)
+        buckets = METRICS[name][2]
+        with self._lock:
+            counts, total = self._histograms.get(key, ([0] * len(buckets), 0.0))
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._histograms[key] = (counts, total + value)
+            self._values[key] = self._values.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: (list(counts), total) for key, (counts, total) in self._histograms.items()}
+        return values, histograms
+
+    def accumulate(self, state):
+        """前回までの累計（state）にこの実行のカウンターとヒストグラムを足す
+
+        Args:
+            state (dict): write_textfileが保存した前回までの累計
+
+        Returns:
+            tuple: (累計を含めた値, 累計を含めたヒストグラム, 保存する累計)
+        """
+        values, histograms = self.snapshot()
+        previous_values, previous_histograms = _load_state(state)
+        for key, value in previous_values.items():
+            if key[0] in METRICS and METRICS[key[0]][0] == "counter":
+                values[key] = values.get(key, 0) + value
+        for key, (counts, total) in previous_histograms.items():
+            buckets = METRICS.get(key[0], (None, None, None))[2]
+            # バケットを変えた場合は前回までの値を使わない
+            if buckets is None or len(counts) != len(buckets):
+                continue
+            current_counts, current_total = histograms.get(key, ([0] * len(buckets), 0.0))
+            histograms[key] = ([a + b for a, b in zip(current_counts, counts)], current_total + total)
+            values[key] = values.get(key, 0) + previous_values.get(key, 0)
+        return values, histograms, _dump_state(values, histograms)
+
+    def render(self, values=None, histograms=None):
+        """Prometheusのテキスト形式に変換する"""
+        if values is None:
+            values, histograms = self.snapshot()
+
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            samples = sorted(key for key in values if key[0] == name)
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key in samples:
+                labels = key[1]
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(values[key])}")
+                    continue
+                counts, total = histograms[key]
+                for bound, count in zip(buckets, counts):
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {count}"
+                    )
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {values[key]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {values[key]}")
+        return "\n".join(lines) + "\n"
+
+
+def _cumulative(name):
+    return name in METRICS and METRICS[name][0] in ("counter", "histogram")
+
+
+def _dump_state(values, histograms):
+    return {
+        "values": [[name, [list(pair) for pair in labels], value]
+                   for (name, labels), value in values.items() if _cumulative(name)],
+        "histograms": [[name, [list(pair) for pair in labels], counts, total]
+                       for (name, labels), (counts, total) in histograms.items()],
+    }
+
+
+def _load_state(state):
+    values = {
+        (name, tuple(tuple(pair) for pair in labels)): value
+        for name, labels, value in state.get("values", [])
+    }
+    histograms = {
+        (name, tuple(tuple(pair) for pair in labels)): (counts, total)
+        for name, labels, counts, total in state.get("histograms", [])
+    }
+    return values, histograms
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+registry = Registry()
+inc = registry.inc
+set_gauge = registry.set
+observe = registry.observe
+
+
+def observe_http(service, method, status, seconds):
+    """外部APIへのリクエスト1回分を記録する
+
+    Args:
+        service (str): "notion" や "line" など
+        method (str): HTTPメソッド
+        status: ステータスコード。通信エラーの場合は"error"。
+        seconds (float): 所要時間（秒）
+    """
+    labels = {"service": service, "method": method.upper(), "status": str(status)}
+    observe("mf_http_request_duration_seconds", seconds, labels)
+    inc("mf_http_requests_total", labels)
+
+
+def write_textfile(path=None, state_path=None):
+    """メトリクスをファイルにアトミックに書き出す（パス未指定なら何もしない）
+
+    カウンターとヒストグラムは累計をstate_pathに保存し、累計の値を書き出す。
+    """
+    path = path or METRICS_TEXTFILE
+    if not path:
+        return
+    state_path = state_path or METRICS_STATE_PATH or f"{path}.state.json"
+    set_gauge("mf_last_run_timestamp_seconds", int(time.time()))
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # 同時に実行された他のプロセスの累計を上書きしないよう、読み込みから書き出しまでロックする
+    with file_lock(f"{state_path}.lock", timeout=30):
+        values, histograms, state = registry.accumulate(read_json(state_path, {}))
+        atomic_write_json(state_path, state, indent=None)
+        _write_atomic(path, directory, registry.render(values, histograms))
+    print(f"メトリクスを書き出しました: {path}")
+
+
+def _write_atomic(path, directory, text):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-", suffix=".prom.tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
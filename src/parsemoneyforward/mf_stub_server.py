@@ -0,0 +1,478 @@
+"""負荷試験・遅延試験用のマネーフォワードのスタブサーバー
+
+ログイン（メールアドレス → パスワード → TOTP → アカウント選択）、トップページの口座一覧と更新リンク、
+支出サマリページを、main.pyが前提とするHTML構造で返す。
+本体（MF_BASE_URL）とID基盤（MF_ID_BASE_URL）は別ホストとして扱うため、2つのポートで待ち受ける。
+
+実行方法:
+    rye run python src/parsemoneyforward/mf_stub_server.py --accounts 300 --latency 0.2
+    MF_BASE_URL=http://127.0.0.1:8800 MF_ID_BASE_URL=http://localhost:8801 \\
+        TOTP_SECRET=JBSWY3DPEHPK3PXP EMAIL=test@example.com PASSWORD=password \\
+        rye run python src/parsemoneyforward/main.py
+"""
+import argparse
+import datetime
+import html
+import random
+import secrets
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pyotp
+
+SESSION_COOKIE = "_moneybook_session"
+ID_SESSION_COOKIE = "_id_session"
+
+CATEGORIES = ["銀行", "カード", "証券", "電子マネー・プリペイド", "ポイント"]
+# 給料日の処理で参照する口座は必ず含める
+FIXED_ACCOUNTS = [("銀行", "三井住友銀行"), ("カード", "三井住友カード")]
+
+
+class StubState:
+    """スタブサーバーの設定と、セッション・口座の状態"""
+
+    def __init__(self, args):
+        self.args = args
+        self.base_url = f"http://{args.host}:{args.port}"
+        self.id_base_url = f"http://{args.id_host}:{args.id_port}"
+        self.totp = pyotp.TOTP(args.totp_secret)
+        self.lock = threading.Lock()
+        self.id_sessions = {}
+        self.sessions = set()
+        self.login_tokens = set()
+        self.accounts = self._generate_accounts(args.accounts)
+        self.stats = {"requests": 0, "errors": 0, "aggregations": 0}
+
+    def _generate_accounts(self, count):
+        rng = random.Random(self.args.seed)
+        accounts = []
+        for index in range(count):
+            if index < len(FIXED_ACCOUNTS):
+                category, name = FIXED_ACCOUNTS[index]
+            else:
+                category = CATEGORIES[index % len(CATEGORIES)]
+                name = f"テスト{category}{index:04d}"
+            number = rng.randint(1_000, 5_000_000)
+            if category == "カード":
+                number = -number
+            accounts.append({
+                "id": f"acc{index:04d}",
+                "category": category,
+                "name": name,
+                "number": number,
+                "balance": number * 2 if category == "カード" else None,
+                "updating_until": 0.0,
+                "updated_at": time.time(),
+            })
+        # トップページと同じくカテゴリごとに並べる
+        accounts.sort(key=lambda account: CATEGORIES.index(account["category"]))
+        return accounts
+
+
+def _page(title, body):
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<meta name='csrf-token' content='stub-csrf-token'><title>{html.escape(title)}</title>"
+        f"</head><body>{body}</body></html>"
+    )
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+    role = "main"
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            super().log_message(format, *args)
+
+    # ---- 共通処理 ----
+
+    def _cookies(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return {key: morsel.value for key, morsel in cookie.items()}
+
+    def _form(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        return {key: values[0] for key, values in parse_qs(body).items()}
+
+    def _send_html(self, body, status=200, cookies=None):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for cookie in cookies or []:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _redirect(self, location, cookies=None):
+        self.send_response(302)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        for cookie in cookies or []:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+
+    def _before_request(self):
+        """遅延とエラーの注入。エラーを返した場合はFalse"""
+        args = self.state.args
+        with self.state.lock:
+            self.state.stats["requests"] += 1
+        delay = args.latency + random.uniform(0, args.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if args.error_rate > 0 and random.random() < args.error_rate:
+            with self.state.lock:
+                self.state.stats["errors"] += 1
+            self._send_html(_page("Error", "<h1>500 Internal Server Error</h1>"), status=500)
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._before_request():
+            return
+        self._dispatch("GET")
+
+    def do_POST(self):
+        if not self._before_request():
+            return
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        path = urlparse(self.path).path
+        routes = ID_ROUTES if self.role == "id" else MAIN_ROUTES
+        handler = routes.get((method, path))
+        if handler is None:
+            for (route_method, prefix), prefix_handler in routes.items():
+                if (route_method == method and prefix != "/" and prefix.endswith("/")
+                        and path.startswith(prefix)):
+                    handler = prefix_handler
+                    break
+        if handler is None:
+            self._send_html(_page("Not Found", "<h1>404</h1>"), status=404)
+            return
+        handler(self)
+
+    # ---- ID基盤（id.moneyforward.com相当） ----
+
+    def _id_session(self):
+        token = self._cookies().get(ID_SESSION_COOKIE)
+        return token, self.state.id_sessions.get(token)
+
+    def id_sign_in(self):
+        token = secrets.token_hex(8)
+        self.state.id_sessions[token] = {"stage": "email"}
+        body = (
+            "<form method='post' action='/sign_in/email'>"
+            "<input type='email' name='email'>"
+            "<button id='submitto' type='submit'>ログインする</button></form>"
+        )
+        self._send_html(_page("ログイン", body), cookies=[f"{ID_SESSION_COOKIE}={token}; Path=/"])
+
+    def id_email(self):
+        token, session = self._id_session()
+        form = self._form()
+        if session is None or form.get("email") != self.state.args.email:
+            self._redirect("/sign_in")
+            return
+        session["stage"] = "password"
+        body = (
+            "<form method='post' action='/sign_in/password'>"
+            "<input type='password' name='password'>"
+            "<button id='submitto' type='submit'>ログインする</button></form>"
+        )
+        self._send_html(_page("パスワード", body))
+
+    def id_password(self):
+        token, session = self._id_session()
+        form = self._form()
+        if session is None or session["stage"] != "password" or form.get("password") != self.state.args.password:
+            self._redirect("/sign_in")
+            return
+        session["stage"] = "totp"
+        self._redirect("/two_factor_auth/totp")
+
+    def id_totp_page(self, error=False):
+        token, session = self._id_session()
+        if session is None or session["stage"] != "totp":
+            self._redirect("/sign_in")
+            return
+        message = "<p>コードが間違っています</p>" if error else ""
+        body = (
+            f"{message}<form method='post' action='/two_factor_auth/totp'>"
+            "<input type='text' inputmode='numeric' name='otp_attempt'>"
+            "<button type='submit'>認証する</button></form>"
+        )
+        self._send_html(_page("2段階認証", body))
+
+    def id_totp_submit(self):
+        token, session = self._id_session()
+        form = self._form()
+        if session is None or session["stage"] != "totp":
+            self._redirect("/sign_in")
+            return
+        if not self.state.totp.verify(form.get("otp_attempt", ""), valid_window=1):
+            self.id_totp_page(error=True)
+            return
+        session["stage"] = "done"
+        self._redirect("/account_selector")
+
+    def id_account_selector(self):
+        token, session = self._id_session()
+        if session is None or session["stage"] != "done":
+            self._redirect("/sign_in")
+            return
+        login_token = secrets.token_hex(8)
+        self.state.login_tokens.add(login_token)
+        body = (
+            "<h1>アカウント選択</h1>"
+            f"<a href='{self.state.base_url}/auth/callback?token={login_token}'>家計簿</a>"
+        )
+        self._send_html(_page("アカウント選択", body))
+
+    # ---- 本体（moneyforward.com相当） ----
+
+    def _logged_in(self):
+        return self._cookies().get(SESSION_COOKIE) in self.state.sessions
+
+    def main_sign_in(self):
+        self._redirect(f"{self.state.id_base_url}/sign_in")
+
+    def main_auth_callback(self):
+        query = parse_qs(urlparse(self.path).query)
+        login_token = query.get("token", [""])[0]
+        if login_token not in self.state.login_tokens:
+            self._redirect("/users/sign_in")
+            return
+        self.state.login_tokens.discard(login_token)
+        session = secrets.token_hex(16)
+        self.state.sessions.add(session)
+        self._redirect("/", cookies=[f"{SESSION_COOKIE}={session}; Path=/"])
+
+    def _require_login(self):
+        if self._logged_in():
+            return True
+        self._redirect("/users/sign_in")
+        return False
+
+    def _account_rows(self):
+        now = time.time()
+        rows = []
+        current_category = None
+        for account in self.state.accounts:
+            if account["updating_until"] and account["updating_until"] <= now:
+                account["updating_until"] = 0.0
+                account["updated_at"] = now
+            if account["category"] != current_category:
+                current_category = account["category"]
+                rows.append(f"<li class='heading-category-name'>{html.escape(current_category)}</li>")
+            balance = (
+                f"<li class='balance'>{account['balance']:,}円</li>"
+                if account["balance"] is not None else ""
+            )
+            status = (
+                "<span class='updating'>更新中</span>" if account["updating_until"]
+                else f"<a href='/aggregation_queue/{account['id']}' data-method='post'>更新</a>"
+            )
+            updated_at = time.strftime("%m/%d %H:%M", time.localtime(account["updated_at"]))
+            rows.append(
+                "<li class='account'>"
+                f"<a href='/accounts/show/{account['id']}'>{html.escape(account['name'])}</a>"
+                f"<ul class='amount'><li class='number'>{account['number']:,}円</li>{balance}</ul>"
+                f"<div class='date'>取得日時({updated_at})</div>{status}</li>"
+            )
+        return "".join(rows)
+
+    def main_top(self):
+        if not self._require_login():
+            return
+        body = (
+            "<section id='registered-accounts'><ul class='accounts'>"
+            f"{self._account_rows()}</ul></section>"
+        )
+        self._send_html(_page("トップ", body))
+
+    def main_accounts(self):
+        if not self._require_login():
+            return
+        body = f"<section id='registered-accounts'><ul>{self._account_rows()}</ul></section>"
+        self._send_html(_page("口座", body))
+
+    def main_account_detail(self):
+        if not self._require_login():
+            return
+        account_id = urlparse(self.path).path.rsplit("/", 1)[-1]
+        account = next((account for account in self.state.accounts if account["id"] == account_id), None)
+        if account is None:
+            self._send_html(_page("Not Found", "<h1>404</h1>"), status=404)
+            return
+
+        rows = []
+        if account["category"] == "証券":
+            # 口座の評価額を銘柄に振り分ける（口座ごとに固定の内容）
+            rng = random.Random(f"{self.state.args.seed}:{account_id}")
+            remaining = account["number"]
+            count = rng.randint(1, 6)
+            for index in range(count):
+                valuation = remaining if index == count - 1 else rng.randint(0, remaining)
+                remaining -= valuation
+                profit_loss = rng.randint(-valuation // 5, valuation // 3) if valuation else 0
+                rows.append(
+                    f"<tr><td>{1000 + rng.randint(0, 8999)}</td><td>テスト銘柄{index + 1}</td>"
+                    f"<td>{rng.randint(1, 50) * 100:,}</td><td>{valuation:,}円</td>"
+                    f"<td>{profit_loss:+,}円</td><td>{profit_loss / max(valuation, 1) * 100:+.2f}%</td></tr>"
+                )
+        body = (
+            f"<h1>{html.escape(account['name'])}</h1>"
+            "<table class='table table-eq'><tr><th>銘柄コード</th><th>銘柄名</th><th>保有数</th>"
+            "<th>評価額</th><th>評価損益</th><th>評価損益率</th></tr>"
+            f"{''.join(rows)}</table>"
+        )
+        self._send_html(_page(account["name"], body))
+
+    def main_aggregation_queue(self):
+        if not self._require_login():
+            return
+        account_id = urlparse(self.path).path.rsplit("/", 1)[-1]
+        for account in self.state.accounts:
+            if account["id"] == account_id:
+                account["updating_until"] = time.time() + self.state.args.aggregation_delay
+                with self.state.lock:
+                    self.state.stats["aggregations"] += 1
+                break
+        else:
+            self._send_html(_page("Not Found", "<h1>404</h1>"), status=404)
+            return
+        self._redirect("/")
+
+    def main_cf_summary(self):
+        if not self._require_login():
+            return
+        rng = random.Random(self.state.args.seed)
+        today = datetime.date.today()
+        # 今月を最後に直近6か月分を並べる
+        months = [(today.month - offset - 1) % 12 + 1 for offset in range(5, -1, -1)]
+        categories = ["食費", "日用品", "住宅", "水道・光熱費", "交際費"]
+        breakdown = [[-rng.randint(10_000, 60_000) for _ in months] for _ in categories]
+        income = [rng.randint(250_000, 400_000) for _ in months]
+        expense = [sum(column) for column in zip(*breakdown)]
+
+        def row(label, values):
+            return f"<tr><th>{label}</th>" + "".join(f"<td>{value:,}円</td>" for value in values) + "</tr>"
+
+        header = "<tr><th></th>" + "".join(f"<th>{month}月</th>" for month in months) + "</tr>"
+        body = (
+            f"<section id='monthly-total'><table><thead>{header}</thead><tbody>"
+            + row("収入合計", income)
+            + row("支出合計", expense)
+            + row("収支", [i + e for i, e in zip(income, expense)])
+            + "</tbody></table></section>"
+            + f"<section id='category-breakdown'><table><thead>{header}</thead><tbody>"
+            + "".join(row(category, values) for category, values in zip(categories, breakdown))
+            + "</tbody></table></section>"
+        )
+        self._send_html(_page("収支内訳", body))
+
+    def main_cf_csv(self):
+        if not self._require_login():
+            return
+        query = parse_qs(urlparse(self.path).query)
+        year, month = int(query["year"][0]), int(query["month"][0])
+        rng = random.Random(f"{self.state.args.seed}:{year}-{month}")
+        categories = [("食費", "食料品"), ("日用品", "ドラッグストア"), ("交際費", "飲み会"), ("趣味・娯楽", "本")]
+        lines = ["計算対象,日付,内容,金額（円）,保有金融機関,大項目,中項目,メモ,振替,ID"]
+        for index in range(self.state.args.transactions_per_month):
+            major, minor = rng.choice(categories)
+            day = rng.randint(1, 28)
+            lines.append(
+                f'1,{year:04d}/{month:02d}/{day:02d},"テスト店舗{index}",{-rng.randint(100, 20_000)},'
+                f'{self.state.accounts[0]["name"]},{major},{minor},,0,stub{year:04d}{month:02d}{index:05d}'
+            )
+        payload = ("\r\n".join(lines) + "\r\n").encode("cp932")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv; charset=Shift_JIS")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def main_stats(self):
+        stats = dict(self.state.stats, accounts=len(self.state.accounts))
+        self._send_html(_page("stats", "<pre>" + html.escape(repr(stats)) + "</pre>"))
+
+
+ID_ROUTES = {
+    ("GET", "/sign_in"): StubHandler.id_sign_in,
+    ("POST", "/sign_in/email"): StubHandler.id_email,
+    ("POST", "/sign_in/password"): StubHandler.id_password,
+    ("GET", "/two_factor_auth/totp"): StubHandler.id_totp_page,
+    ("POST", "/two_factor_auth/totp"): StubHandler.id_totp_submit,
+    ("GET", "/account_selector"): StubHandler.id_account_selector,
+}
+
+MAIN_ROUTES = {
+    ("GET", "/"): StubHandler.main_top,
+    ("GET", "/users/sign_in"): StubHandler.main_sign_in,
+    ("GET", "/auth/callback"): StubHandler.main_auth_callback,
+    ("GET", "/accounts"): StubHandler.main_accounts,
+    ("GET", "/accounts/show/"): StubHandler.main_account_detail,
+    ("GET", "/aggregation_queue/"): StubHandler.main_aggregation_queue,
+    ("POST", "/aggregation_queue/"): StubHandler.main_aggregation_queue,
+    ("GET", "/cf/summary"): StubHandler.main_cf_summary,
+    ("GET", "/cf/csv"): StubHandler.main_cf_csv,
+    ("GET", "/_stub/stats"): StubHandler.main_stats,
+}
+
+
+def build_servers(args):
+    state = StubState(args)
+    servers = []
+    for role, host, port in [("main", args.host, args.port), ("id", args.id_host, args.id_port)]:
+        handler = type(f"{role.capitalize()}StubHandler", (StubHandler,), {"state": state, "role": role})
+        servers.append(ThreadingHTTPServer((host, port), handler))
+    return state, servers
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="マネーフォワードのスタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1", help="本体のホスト")
+    parser.add_argument("--port", type=int, default=8800, help="本体のポート")
+    parser.add_argument("--id-host", default="localhost", help="ID基盤のホスト（本体と別のホスト名にする）")
+    parser.add_argument("--id-port", type=int, default=8801, help="ID基盤のポート")
+    parser.add_argument("--accounts", type=int, default=20, help="口座数")
+    parser.add_argument("--latency", type=float, default=0.0, help="各レスポンスの遅延（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="遅延に加える最大のゆらぎ（秒）")
+    parser.add_argument("--aggregation-delay", type=float, default=5.0, help="更新完了までの時間（秒）")
+    parser.add_argument("--transactions-per-month", type=int, default=200, help="CSVのエクスポートに含める明細の件数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500エラーを返す割合（0〜1）")
+    parser.add_argument("--email", default="test@example.com")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--totp-secret", default="JBSWY3DPEHPK3PXP")
+    parser.add_argument("--seed", type=int, default=0, help="口座の金額を生成する乱数のシード")
+    parser.add_argument("--verbose", action="store_true", help="アクセスログを表示する")
+    return parser.parse_args(argv)
+
+
+def serve(args):
+    state, servers = build_servers(args)
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers]
+    for thread in threads:
+        thread.start()
+    print(f"スタブサーバーを起動しました: MF_BASE_URL={state.base_url} MF_ID_BASE_URL={state.id_base_url}")
+    print(f"口座数: {args.accounts}, 遅延: {args.latency}秒, エラー率: {args.error_rate}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    serve(parse_args())
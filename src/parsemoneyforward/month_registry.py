@@ -0,0 +1,202 @@
+"""月 → 月次データベースのIDの索引
+
+給料日に作成する「N月度のお金」のデータベースを"YYYY-MM"で引けるようにする。
+索引はMONTH_REGISTRY_PATHのJSONに保存し、見つからない月があれば親ページ配下のデータベースを
+1回の検索（ページネーションあり）でまとめて取得して作り直す。
+保存したIDはMONTH_REGISTRY_TTLを過ぎたら、使う前にNotionで存在を確認する。
+
+実行方法:
+    rye run python src/parsemoneyforward/month_registry.py --rebuild  # 索引を作り直す
+    rye run python src/parsemoneyforward/month_registry.py --list     # 索引を表示する
+"""
+import argparse
+import datetime
+import os
+import re
+import time
+
+from payday import get_payday
+from state_files import atomic_write_json, read_json
+
+MONTH_REGISTRY_PATH = os.environ.get("MONTH_REGISTRY_PATH", "month-databases.json")
+MONTH_REGISTRY_TTL = float(os.environ.get("MONTH_REGISTRY_TTL", str(24 * 60 * 60)))
+
+MONTH_DATABASE_SUFFIX = "月度のお金"
+_TITLE_PATTERN = re.compile(r"^(\d{1,2})" + MONTH_DATABASE_SUFFIX + "$")
+
+
+def month_key(year, month):
+    return f"{year:04d}-{month:02d}"
+
+
+def cycle_month_key(today=None):
+    """指定日に使っている月次データベースの月を返す
+
+    給料日に翌月分のデータベースを作成するため、給料日以降は翌月になる。
+    """
+    today = today or datetime.date.today()
+    if today >= get_payday(today.year, today.month):
+        year, month = (today.year + 1, 1) if today.month == 12 else (today.year, today.month + 1)
+        return month_key(year, month)
+    return month_key(today.year, today.month)
+
+
+def title_month_key(title, created_time):
+    """タイトル（"11月度のお金"）と作成日時から月を求める
+
+    タイトルには年がないため、作成日時（前月の給料日）以降で最初にその月になる年とする。
+    """
+    match = _TITLE_PATTERN.match(title)
+    if not match:
+        return None
+    month = int(match.group(1))
+    if not 1 <= month <= 12:
+        return None
+    created = datetime.datetime.fromisoformat(created_time.replace("Z", "+00:00"))
+    year = created.year if month >= created.month else created.year + 1
+    return month_key(year, month)
+
+
+def _plain_title(database):
+    return "".join(t.get("plain_text", "") for t in database.get("title", []))
+
+
+def _same_id(a, b):
+    return (a or "").replace("-", "") == (b or "").replace("-", "")
+
+
+class MonthRegistry:
+    def __init__(self, notion_request, parent_page_id, path=None):
+        """
+        Args:
+            notion_request (callable): (method, path, body) → requests.Response
+            parent_page_id (str): 月次データベースを作成する親ページのID
+            path (str, optional): 索引のJSONファイルのパス
+        """
+        self.notion_request = notion_request
+        self.parent_page_id = parent_page_id
+        self.path = path or MONTH_REGISTRY_PATH
+        self.months = {}
+        self.load()
+
+    def load(self):
+        data = read_json(self.path, {})
+        # 別の親ページの索引は使わない
+        if _same_id(data.get("parent_page_id"), self.parent_page_id):
+            self.months = data.get("months", {})
+        else:
+            self.months = {}
+        return self
+
+    def save(self):
+        atomic_write_json(self.path, {"parent_page_id": self.parent_page_id, "months": self.months})
+
+    def register(self, key, database_id, title=None):
+        """月とデータベースのIDを登録して保存する"""
+        self.months[key] = {"id": database_id, "title": title, "validated_at": time.time()}
+        self.save()
+
+    def rebuild(self):
+        """親ページ配下の月次データベースを検索して索引を作り直す
+
+        Returns:
+            int: 登録した月の数
+        """
+        months = {}
+        body = {
+            "query": MONTH_DATABASE_SUFFIX,
+            "filter": {"property": "object", "value": "database"},
+            "page_size": 100,
+        }
+        now = time.time()
+        while True:
+            response = self.notion_request("POST", "/v1/search", body)
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f"データベースの検索中にエラーが発生しました。ステータスコード: {response.status_code}"
+                )
+            data = response.json()
+            for database in data.get("results", []):
+                parent_id = (database.get("parent") or {}).get("page_id")
+                if database.get("archived") or not _same_id(parent_id, self.parent_page_id):
+                    continue
+                title = _plain_title(database)
+                key = title_month_key(title, database["created_time"])
+                if key is None:
+                    continue
+                # 同じ月のデータベースが複数ある場合は新しいものを使う
+                current = months.get(key)
+                if current and current["created_time"] >= database["created_time"]:
+                    continue
+                months[key] = {
+                    "id": database["id"],
+                    "title": title,
+                    "created_time": database["created_time"],
+                    "validated_at": now,
+                }
+            if not data.get("has_more"):
+                break
+            body = {**body, "start_cursor": data["next_cursor"]}
+
+        self.months = months
+        self.save()
+        return len(months)
+
+    def _is_valid(self, entry):
+        response = self.notion_request("GET", f"/v1/databases/{entry['id']}", None)
+        return response.status_code == 200 and not response.json().get("archived")
+
+    def get(self, key):
+        """索引に登録されているIDを確認せずに返す"""
+        entry = self.months.get(key)
+        return entry["id"] if entry else None
+
+    def resolve(self, key):
+        """月のデータベースのIDを返す
+
+        索引にあればそれを使い（有効期限を過ぎていれば存在を確認する）、
+        なければ索引を作り直してから探す。
+
+        Returns:
+            str: データベースのID。見つからない場合はNone。
+        """
+        entry = self.months.get(key)
+        if entry is not None:
+            if time.time() - entry.get("validated_at", 0) < MONTH_REGISTRY_TTL:
+                return entry["id"]
+            if self._is_valid(entry):
+                entry["validated_at"] = time.time()
+                self.save()
+                return entry["id"]
+        self.rebuild()
+        return self.get(key)
+
+    def resolve_many(self, keys):
+        """複数の月のIDを返す（見つからない月があっても索引の作り直しは1回だけ）
+
+        Returns:
+            dict: 月 → データベースのID（見つからない月は含めない）
+        """
+        if any(key not in self.months for key in keys):
+            self.rebuild()
+        return {key: self.resolve(key) for key in keys if key in self.months}
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv(verbose=True)
+    import main as mf
+
+    parser = argparse.ArgumentParser(description="月次データベースの索引")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--rebuild", action="store_true", help="Notionを検索して索引を作り直す")
+    group.add_argument("--list", action="store_true", help="索引を表示する")
+    args = parser.parse_args()
+
+    page = mf.CreateMonthlyBalancePage(os.environ["NOTION_KEY"], os.environ["NOTION_PAGE_ID"])
+    registry = page.month_registry()
+    if args.rebuild:
+        print(f"{registry.rebuild()}か月分のデータベースを登録しました")
+    for key, entry in sorted(registry.months.items()):
+        print(f"{key}: {entry['id']} ({entry.get('title')})")
@@ -0,0 +1,142 @@
+"""直近の月次データベースから資産・負債の推移をまとめる
+
+月の索引で直近Nか月分のデータベースを探し、各データベースのページを並行して取得する。
+Notion APIへのリクエストは共有のレートリミッターで平均NOTION_RATE_LIMIT件/秒に抑える。
+「資産/負債」のマルチセレクトごとに金額を合計し、月ごとの推移の表をLINEに送るかファイルに書き出す。
+
+実行方法:
+    rye run python src/parsemoneyforward/notion_report.py [--months 12] [--line] [--output report.txt]
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from month_registry import cycle_month_key, month_key
+
+NOTION_RATE_LIMIT = float(os.environ.get("NOTION_RATE_LIMIT", "3"))
+NOTION_REPORT_MONTHS = int(os.environ.get("NOTION_REPORT_MONTHS", "12"))
+NOTION_REPORT_CONCURRENCY = int(os.environ.get("NOTION_REPORT_CONCURRENCY", "4"))
+
+# 表の列（「資産/負債」の選択肢）
+REPORT_CATEGORIES = ("資産", "負債", "貯金")
+
+
+class RateLimiter:
+    """トークンバケットで複数のスレッドのリクエストを平均rate件/秒に抑える"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得する（なければ補充されるまで待つ）"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def previous_month_keys(latest_key, count):
+    """latest_key（"YYYY-MM"）までの直近countか月を古い順に返す"""
+    year, month = (int(part) for part in latest_key.split("-"))
+    keys = []
+    for _ in range(count):
+        keys.append(month_key(year, month))
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return keys[::-1]
+
+
+def summarize_pages(pages):
+    """月次データベースのページを「資産/負債」ごとに合計する
+
+    Returns:
+        dict: 選択肢 → 合計、"残高" → すべてのページの合計（月初の残高と同じ計算）
+    """
+    totals = {category: 0 for category in REPORT_CATEGORIES}
+    balance = 0
+    for page in pages:
+        if page.get("archived"):
+            continue
+        properties = page["properties"]
+        amount = properties["金額"].get("number")
+        if amount is None:
+            continue
+        balance += amount
+        for item in properties["資産/負債"]["multi_select"]:
+            if item["name"] in totals:
+                totals[item["name"]] += amount
+    totals["残高"] = balance
+    return totals
+
+
+def fetch_month_totals(monthly_balance_page, months=None, max_workers=None):
+    """直近の月次データベースを並行して取得し、月ごとの合計を返す
+
+    Args:
+        monthly_balance_page (CreateMonthlyBalancePage): Notion APIの呼び出しに使う
+        months (int, optional): 月数
+        max_workers (int, optional): 同時に取得するデータベースの数
+
+    Returns:
+        dict: 月（"YYYY-MM"、古い順） → 合計。データベースが見つからない月は含めない。
+    """
+    keys = previous_month_keys(cycle_month_key(), months or NOTION_REPORT_MONTHS)
+    database_ids = monthly_balance_page.month_registry().resolve_many(keys)
+
+    with ThreadPoolExecutor(max_workers=max_workers or NOTION_REPORT_CONCURRENCY) as executor:
+        futures = {
+            key: executor.submit(monthly_balance_page.query_database_pages, database_ids[key])
+            for key in keys if database_ids.get(key)
+        }
+        return {key: summarize_pages(future.result()) for key, future in futures.items()}
+
+
+def format_trend_table(month_totals):
+    """月ごとの合計を推移の表（"|"区切りの文字列）にする"""
+    columns = REPORT_CATEGORIES + ("残高",)
+    lines = ["月 | " + " | ".join(columns) + " | 前月比"]
+    previous = None
+    for key, totals in month_totals.items():
+        change = "" if previous is None else f"{totals['残高'] - previous:+,}"
+        lines.append(f"{key} | " + " | ".join(f"{totals[column]:,}" for column in columns) + f" | {change}")
+        previous = totals["残高"]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv(verbose=True)
+    import main as mf
+
+    parser = argparse.ArgumentParser(description="月次データベースの資産・負債の推移")
+    parser.add_argument("--months", type=int, default=NOTION_REPORT_MONTHS, help="月数")
+    parser.add_argument("--line", action="store_true", help="LINEに送る")
+    parser.add_argument("--output", help="表を書き出すファイル")
+    args = parser.parse_args()
+
+    page = mf.CreateMonthlyBalancePage(
+        os.environ["NOTION_KEY"], os.environ["NOTION_PAGE_ID"],
+        rate_limiter=RateLimiter(NOTION_RATE_LIMIT),
+    )
+    started = time.perf_counter()
+    table = format_trend_table(fetch_month_totals(page, args.months))
+    print(f"{table}\n（{time.perf_counter() - started:.1f}秒）")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(table + "\n")
+    if args.line:
+        mf.send_line_message(f"[資産・負債の推移]\n{table}")
+        if mf.outbox.is_enabled():
+            mf.outbox.spawn_worker()
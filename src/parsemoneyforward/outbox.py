@@ -0,0 +1,361 @@
+"""通知とNotionへの書き込みをSQLiteのアウトボックスに積み、別プロセスで配送する
+
+スクレイピング処理は送信内容を積んだ時点で終了し、外部APIの遅延や障害の影響を受けない。
+配送は冪等キー付きで再送し、上限回数を超えたものはデッドレターとして残す。
+実行の最後に起動するワーカー（--drain）は、再送待ちがなくなるまで（最長OUTBOX_WORKER_LIFETIME秒）
+待って再送してから終了する。
+
+実行方法:
+    rye run python src/parsemoneyforward/outbox.py --drain      # 再送待ちがなくなるまで配送して終了
+    rye run python src/parsemoneyforward/outbox.py --loop       # 常駐して配送を続ける
+    rye run python src/parsemoneyforward/outbox.py --dead       # デッドレターを表示
+    rye run python src/parsemoneyforward/outbox.py --retry-dead # デッドレターを再配送の対象に戻す
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+import uuid
+
+import requests
+
+from line_delivery import LineDeliveryError, LineMessenger
+from state_files import file_lock
+
+OUTBOX_DB_PATH = os.environ.get("OUTBOX_DB_PATH", "outbox.db")
+OUTBOX_LOG_PATH = os.environ.get("OUTBOX_LOG_PATH", "outbox-worker.log")
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF = float(os.environ.get("OUTBOX_BACKOFF", "30"))
+# 実行の最後に起動するワーカーが再送を待つ最長時間（秒）
+OUTBOX_WORKER_LIFETIME = float(os.environ.get("OUTBOX_WORKER_LIFETIME", "3600"))
+# 配送中のまま止まったワーカーの処理を引き継ぐまでの時間（秒）
+OUTBOX_LEASE_SECONDS = 300
+
+NOTION_API_URL = "https://api.notion.com"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    locked_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+
+class PermanentDeliveryError(Exception):
+    """再送しても成功しない配送エラー（認証エラーや不正なリクエストなど）"""
+
+
+def is_enabled():
+    """アウトボックス経由で配送するかどうか（OUTBOX_ENABLED=1のときだけ。デフォルトは従来どおり即時送信）
+
+    Notionのページは「データベース + ページ名」の冪等キーで配送済みを記録するため、
+    配送後にNotionでページを削除しても同じ月のうちは作り直さない。
+    """
+    return os.environ.get("OUTBOX_ENABLED", "0") == "1"
+
+
+def connect(db_path=None):
+    conn = sqlite3.connect(db_path or OUTBOX_DB_PATH, timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def make_idempotency_key(kind, payload):
+    """送信内容から冪等キーを生成する"""
+    source = kind + json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def enqueue(kind, payload, idempotency_key=None, db_path=None):
+    """送信内容をアウトボックスに積む。同じ冪等キーのものは積まない
+
+    Args:
+        kind (str): 配送の種類（"line" または "notion"）
+        payload (dict): 配送内容
+        idempotency_key (str, optional): 冪等キー。省略時は内容から生成する。
+        db_path (str, optional): DBファイルのパス
+
+    Returns:
+        bool: 新しく積んだ場合はTrue
+    """
+    if kind not in DELIVERERS:
+        raise ValueError(f"未対応の配送の種類です: {kind}")
+
+    key = idempotency_key or make_idempotency_key(kind, payload)
+    now = time.time()
+    conn = connect(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO outbox (kind, payload, idempotency_key, next_attempt_at, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), key, now, now),
+            )
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
+
+def enqueue_line_message(texts, token_env="LINE_ACCESS_PARSE_MONEY_FORWORD_TOKEN",
+                         recipients_env="USER_ID", idempotency_key=None):
+    """LINEへの送信を積む（トークンはDBに保存せず、配送時に環境変数から読む）
+
+    同じ内容の通知でも実行ごとに送るため、冪等キーを省略した場合は毎回新しいキーを使う。
+    """
+    return enqueue(
+        "line",
+        {"token_env": token_env, "recipients_env": recipients_env, "texts": texts},
+        idempotency_key or f"line:{uuid.uuid4()}",
+    )
+
+
+def enqueue_notion_request(method, path, body, idempotency_key=None):
+    """Notion APIへのリクエストを積む"""
+    return enqueue("notion", {"method": method, "path": path, "body": body}, idempotency_key)
+
+
+def deliver_line(payload, idempotency_key):
+    recipients = [
+        user_id.strip()
+        for user_id in os.environ[payload["recipients_env"]].split(",")
+        if user_id.strip()
+    ]
+    # 再送はアウトボックス側で行う
+    messenger = LineMessenger(os.environ[payload["token_env"]], max_retries=0)
+    try:
+        messenger.send(recipients, payload["texts"], retry_key=idempotency_key)
+    except LineDeliveryError as e:
+        if e.status_code is not None and 400 <= e.status_code < 500 and e.status_code != 429:
+            raise PermanentDeliveryError(str(e))
+        raise
+
+
+def deliver_notion(payload, idempotency_key):
+    headers = {
+        "Authorization": f"Bearer {os.environ['NOTION_KEY']}",
+        "Content-Type": "application/json",
+        "Notion-Version": "2022-06-28",
+    }
+    response = requests.request(
+        payload["method"],
+        NOTION_API_URL + payload["path"],
+        headers=headers,
+        data=json.dumps(payload["body"]),
+        timeout=30,
+    )
+    if response.status_code == 200:
+        return
+    message = f"Notion APIのステータスコード: {response.status_code}\n{response.text}"
+    if response.status_code == 429 or response.status_code >= 500:
+        raise RuntimeError(message)
+    raise PermanentDeliveryError(message)
+
+
+DELIVERERS = {
+    "line": deliver_line,
+    "notion": deliver_notion,
+}
+
+
+def _claim_due(conn, limit):
+    """配送可能なものを取得し、他のワーカーが扱わないようにロックする"""
+    now = time.time()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            "SELECT id, kind, payload, idempotency_key, attempts FROM outbox"
+            " WHERE status = 'pending' AND next_attempt_at <= ?"
+            " AND (locked_until IS NULL OR locked_until <= ?)"
+            " ORDER BY id LIMIT ?",
+            (now, now, limit),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE outbox SET locked_until = ? WHERE id = ?",
+            [(now + OUTBOX_LEASE_SECONDS, row[0]) for row in rows],
+        )
+    return rows
+
+
+def deliver_pending(db_path=None, batch_size=20, max_attempts=None):
+    """配送可能なものをすべて配送する
+
+    Returns:
+        dict: 配送結果の件数（sent / retry / dead）
+    """
+    max_attempts = max_attempts or OUTBOX_MAX_ATTEMPTS
+    counts = {"sent": 0, "retry": 0, "dead": 0}
+    conn = connect(db_path)
+    conn.isolation_level = None
+    try:
+        while True:
+            rows = _claim_due(conn, batch_size)
+            if not rows:
+                return counts
+
+            for row_id, kind, payload, idempotency_key, attempts in rows:
+                attempts += 1
+                try:
+                    DELIVERERS[kind](json.loads(payload), idempotency_key)
+                except Exception as e:
+                    permanent = isinstance(e, PermanentDeliveryError)
+                    if permanent or attempts >= max_attempts:
+                        status, next_attempt_at = "dead", time.time()
+                        counts["dead"] += 1
+                        print(f"配送を断念しました (id={row_id}, kind={kind}): {e}")
+                    else:
+                        status = "pending"
+                        next_attempt_at = time.time() + OUTBOX_BACKOFF * (2 ** (attempts - 1))
+                        counts["retry"] += 1
+                        print(f"配送に失敗しました。再送を予定します (id={row_id}, kind={kind}): {e}")
+                    conn.execute(
+                        "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?,"
+                        " locked_until = NULL, last_error = ? WHERE id = ?",
+                        (status, attempts, next_attempt_at, str(e), row_id),
+                    )
+                    continue
+
+                conn.execute(
+                    "UPDATE outbox SET status = 'sent', attempts = ?, sent_at = ?,"
+                    " locked_until = NULL, last_error = NULL WHERE id = ?",
+                    (attempts, time.time(), row_id),
+                )
+                counts["sent"] += 1
+    finally:
+        conn.close()
+
+
+def next_attempt_at(db_path=None):
+    """再送待ちのもののうち、最も早い配送予定時刻（なければNone）"""
+    conn = connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def drain(db_path=None, lifetime=None, poll_interval=10):
+    """配送可能なものを配送し、再送待ちがなくなるまで待って再送する
+
+    再送を待つワーカーは1つだけにする。既に待っているワーカーがあれば、配送可能なものを
+    配送した時点で終了する（後から積まれたものもpoll_interval秒以内に配送される）。
+
+    Args:
+        db_path (str, optional): DBファイルのパス
+        lifetime (float, optional): 再送を待つ最長時間（秒）
+        poll_interval (float): 新しく積まれたものを確認する間隔（秒）
+
+    Returns:
+        dict: 配送結果の件数（sent / retry / dead）
+    """
+    lifetime = OUTBOX_WORKER_LIFETIME if lifetime is None else lifetime
+    deadline = time.monotonic() + lifetime
+    totals = deliver_pending(db_path)
+    try:
+        with file_lock(f"{db_path or OUTBOX_DB_PATH}.worker.lock", timeout=0):
+            while True:
+                earliest = next_attempt_at(db_path)
+                if earliest is None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print("再送待ちが残っていますが、待機の上限に達したため終了します")
+                    break
+                time.sleep(max(0.0, min(earliest - time.time(), poll_interval, remaining)))
+                for status, count in deliver_pending(db_path).items():
+                    totals[status] += count
+    except TimeoutError:
+        print("別のワーカーが再送を待っているため終了します")
+    return totals
+
+
+def run_worker(poll_interval=10, db_path=None):
+    """常駐して配送を続ける"""
+    print("アウトボックスの配送ワーカーを起動しました")
+    while True:
+        counts = deliver_pending(db_path)
+        if any(counts.values()):
+            print(f"配送結果: {counts}")
+        time.sleep(poll_interval)
+
+
+def spawn_worker():
+    """配送ワーカーを別プロセスで起動し、終了を待たずに戻る"""
+    with open(OUTBOX_LOG_PATH, "a") as log_file:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--drain"],
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    print(f"アウトボックスの配送ワーカーを起動しました（ログ: {OUTBOX_LOG_PATH}）")
+
+
+def list_dead(db_path=None):
+    conn = connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT id, kind, attempts, last_error, created_at FROM outbox"
+            " WHERE status = 'dead' ORDER BY id"
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def retry_dead(db_path=None):
+    """デッドレターを再配送の対象に戻す
+
+    Returns:
+        int: 戻した件数
+    """
+    conn = connect(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ?"
+                " WHERE status = 'dead'",
+                (time.time(),),
+            )
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv(verbose=True)
+
+    parser = argparse.ArgumentParser(description="アウトボックスの配送ワーカー")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--drain", action="store_true", help="再送待ちがなくなるまで配送して終了する")
+    group.add_argument("--loop", action="store_true", help="常駐して配送を続ける")
+    group.add_argument("--dead", action="store_true", help="デッドレターを表示する")
+    group.add_argument("--retry-dead", action="store_true", help="デッドレターを再配送の対象に戻す")
+    args = parser.parse_args()
+
+    if args.drain:
+        print(f"配送結果: {drain()}")
+    elif args.loop:
+        run_worker()
+    elif args.dead:
+        for row in list_dead():
+            print(row)
+    else:
+        print(f"{retry_dead()}件を再配送の対象に戻しました")
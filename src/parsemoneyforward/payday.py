@@ -0,0 +1,64 @@
+import datetime
+
+import jpholiday
+
+PAYDAY_OF_MONTH = 25
+
+
+def get_payday(year, month):
+    """
+    指定した年月の給料日を返します。
+
+    給料日は通常毎月25日ですが、次の条件に従います:
+    1. 25日が土曜日の場合は24日が給料日となる。
+    2. 25日が土日祝日の場合は、25日以前で最も近い平日が給料日となる。
+
+    Args:
+        year (int): 年
+        month (int): 月
+
+    Returns:
+        datetime.date: 給料日
+    """
+    payday = datetime.date(year, month, PAYDAY_OF_MONTH)
+
+    # 25日が土日または祝日であれば、直近の平日を取得
+    while payday.weekday() >= 5 or jpholiday.is_holiday(payday):
+        payday -= datetime.timedelta(days=1)
+
+    return payday
+
+
+def paydays_between(start, end):
+    """期間内（前後の給料日を含む）の給料日を昇順で返す
+
+    Args:
+        start (datetime.date): 期間の開始日
+        end (datetime.date): 期間の終了日
+
+    Returns:
+        list of datetime.date: startの直前の給料日からendの直後の給料日まで
+    """
+    year, month = start.year, start.month - 1
+    if month == 0:
+        year, month = year - 1, 12
+
+    paydays = []
+    while True:
+        payday = get_payday(year, month)
+        paydays.append(payday)
+        if payday > end:
+            break
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return paydays
+
+
+def next_payday(today=None):
+    """今日より後の最初の給料日を返す"""
+    today = today or datetime.date.today()
+    payday = get_payday(today.year, today.month)
+    if payday > today:
+        return payday
+    year, month = (today.year + 1, 1) if today.month == 12 else (today.year, today.month + 1)
+    return get_payday(year, month)
@@ -0,0 +1,456 @@
+"""実行の記録と再生でmain()をネットワークなしに再現する
+
+record: 実際の実行でドライバーが読み込んだページと、Notion/LINEとのHTTP通信をカセットに保存する。
+replay: カセットだけを使ってmain()を最後まで実行し、処理ごとの時間を表示する。
+
+ブラウザ操作の再生はページの取得とHTMLの解析のみに対応するため、
+記録は有効なクッキーがある状態（クッキーでログインできる状態）で行うこと。
+月の索引や分類ルール、各キャッシュなど実行が読み込む状態ファイルは記録開始時点の内容をカセットに保存し、
+再生時は一時ディレクトリに復元して使う（記録した環境の状態ファイルは変更しない）。
+
+実行方法:
+    rye run python src/parsemoneyforward/replay.py record cassettes/2024-10-25
+    rye run python src/parsemoneyforward/replay.py replay cassettes/2024-10-25 [--payday | --no-payday]
+"""
+import argparse
+import base64
+import json
+import os
+import shutil
+import tempfile
+import time
+import types
+
+import requests
+from bs4 import BeautifulSoup
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from selenium.webdriver.common.by import By
+
+import account_rules
+import cf_summary
+import freshness
+import history
+import holdings
+import main as mf
+import month_registry
+
+MONTH_PAGE_ID_FILE = "month-page-id.json"
+
+# 実行が読み込む状態ファイル（モジュール, パスの定数名, カセット内のファイル名）
+STATE_FILES = [
+    (month_registry, "MONTH_REGISTRY_PATH", "month-databases.json"),
+    (account_rules, "ACCOUNT_RULES_PATH", "account-rules.json"),
+    (cf_summary, "SUMMARY_CACHE_PATH", "summary-cache.json"),
+    (freshness, "REFRESH_STATE_PATH", "refresh-state.json"),
+    (holdings, "HOLDINGS_CACHE_PATH", "holdings-cache.json"),
+    (history, "HISTORY_DB_PATH", "history.db"),
+]
+
+# 処理時間を計測する関数（main.py内の名前）
+PHASES = [
+    "ensure_logged_in",
+    "click_reloads_selenium",
+    "get_all_amount",
+    "get_current_month_expense",
+    "calculate_balance",
+    "send_line_message",
+]
+
+
+class Cassette:
+    """記録したページとHTTP通信を保存するディレクトリ"""
+
+    def __init__(self, path):
+        self.path = path
+        self.pages_dir = os.path.join(path, "pages")
+        self.http_dir = os.path.join(path, "http")
+        self.state_dir = os.path.join(path, "state")
+        self.meta_path = os.path.join(path, "meta.json")
+        self.events = []
+        self.exchanges = []
+        self.meta = {}
+
+    def create(self):
+        os.makedirs(self.pages_dir, exist_ok=True)
+        os.makedirs(self.http_dir, exist_ok=True)
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def save_state(self):
+        """状態ファイルの現在の内容を保存する（存在しないファイルは保存しない）"""
+        sources = [(getattr(module, name), filename) for module, name, filename in STATE_FILES]
+        for source, filename in sources + [(MONTH_PAGE_ID_FILE, MONTH_PAGE_ID_FILE)]:
+            if os.path.exists(source):
+                shutil.copy(source, os.path.join(self.state_dir, filename))
+
+    def restore_state(self, workdir):
+        """保存した状態ファイルをworkdirに復元し、各モジュールのパスをworkdir内のファイルに向ける"""
+        for module, name, filename in STATE_FILES:
+            path = os.path.join(workdir, filename)
+            setattr(module, name, path)
+            self._restore_file(filename, path)
+        # month-page-id.jsonは作業ディレクトリからの相対パスで読み込まれる
+        if not self._restore_file(MONTH_PAGE_ID_FILE, os.path.join(workdir, MONTH_PAGE_ID_FILE)):
+            with open(os.path.join(workdir, MONTH_PAGE_ID_FILE), "w") as f:
+                json.dump({"page_id": ""}, f)
+
+        # 記録時に確認済みだった月の索引は、再生した日付で有効期限が切れていても確認済みとして扱う
+        # （確認のための通信は記録されていない）
+        registry_path = month_registry.MONTH_REGISTRY_PATH
+        if os.path.exists(registry_path):
+            with open(registry_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for entry in data.get("months", {}).values():
+                entry["validated_at"] = time.time()
+            with open(registry_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+
+    def _restore_file(self, filename, path):
+        # 以前のカセットはmonth-page-id.jsonをカセットの直下に保存している
+        for directory in [self.state_dir, self.path]:
+            source = os.path.join(directory, filename)
+            if os.path.exists(source):
+                shutil.copy(source, path)
+                return True
+        return False
+
+    def add_page(self, current_url, html):
+        filename = f"{len(self.events):04d}.html"
+        with open(os.path.join(self.pages_dir, filename), "w", encoding="utf-8") as f:
+            f.write(html or "")
+        self.events.append({"type": "page", "current_url": current_url, "file": filename})
+
+    def add_navigation(self, url, current_url):
+        self.events.append({"type": "get", "url": url, "current_url": current_url})
+
+    def add_exchange(self, method, url, status_code, reason, headers, content):
+        filename = f"{len(self.exchanges):04d}.json"
+        exchange = {
+            "method": method.upper(),
+            "url": url,
+            "status_code": status_code,
+            "reason": reason,
+            "headers": {"Content-Type": headers.get("Content-Type", "")},
+            "content": base64.b64encode(content or b"").decode("ascii"),
+        }
+        with open(os.path.join(self.http_dir, filename), "w", encoding="utf-8") as f:
+            json.dump(exchange, f, ensure_ascii=False, indent=2)
+        self.exchanges.append(exchange)
+
+    def save(self):
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({**self.meta, "events": self.events}, f, ensure_ascii=False, indent=2)
+
+    def load(self):
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.events = data.pop("events")
+        self.meta = data
+        self.exchanges = []
+        for filename in sorted(os.listdir(self.http_dir)):
+            with open(os.path.join(self.http_dir, filename), "r", encoding="utf-8") as f:
+                self.exchanges.append(json.load(f))
+
+    def read_page(self, filename):
+        with open(os.path.join(self.pages_dir, filename), "r", encoding="utf-8") as f:
+            return f.read()
+
+
+class RecordingDriver:
+    """実際のドライバーを包み、遷移と読み込んだページを記録する"""
+
+    def __init__(self, driver, cassette):
+        self._driver = driver
+        self._cassette = cassette
+
+    def get(self, url):
+        self._driver.get(url)
+        self._cassette.add_navigation(url, self._driver.current_url)
+
+    def refresh(self):
+        self._driver.refresh()
+        current_url = self._driver.current_url
+        self._cassette.add_navigation(current_url, current_url)
+
+    @property
+    def page_source(self):
+        html = self._driver.page_source
+        self._cassette.add_page(self._driver.current_url, html)
+        return html
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+
+class ReplayElement:
+    def __init__(self, tag):
+        self._tag = tag
+        self.tag_name = tag.name
+        self.text = tag.get_text()
+
+    def get_attribute(self, name):
+        value = self._tag.get(name)
+        return " ".join(value) if isinstance(value, list) else value
+
+    get_dom_attribute = get_attribute
+
+    def is_displayed(self):
+        return True
+
+    def is_enabled(self):
+        return True
+
+    def click(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def send_keys(self, *values):
+        pass
+
+
+class ReplayDriver:
+    """カセットの内容を返すドライバー
+
+    遷移先ごとに記録した順番でURLとHTMLを返す。ID・クラス名・タグ名による要素の検索に対応し、
+    XPATHなどそれ以外の検索は要素が存在しないものとして扱う。
+    """
+
+    def __init__(self, cassette):
+        self._cassette = cassette
+        self._navigations = {}
+        self._pages = {}
+        for event in cassette.events:
+            if event["type"] == "get":
+                self._navigations.setdefault(event["url"], []).append(event["current_url"])
+            else:
+                self._pages.setdefault(event["current_url"], []).append(event["file"])
+        self.current_url = "about:blank"
+        self._page_file = None
+        self.window_handles = ["replay"]
+        self.title = ""
+
+    @staticmethod
+    def _next(queue, default=None):
+        if not queue:
+            return default
+        # 最後の1件は繰り返し返す
+        return queue.pop(0) if len(queue) > 1 else queue[0]
+
+    def get(self, url):
+        self.current_url = self._next(self._navigations.get(url), url)
+        # 遷移ごとに、その遷移先で記録された次のHTMLに切り替える
+        self._page_file = self._next(self._pages.get(self.current_url))
+
+    def refresh(self):
+        self.get(self.current_url)
+
+    @property
+    def page_source(self):
+        if self._page_file is None:
+            return "<html><body></body></html>"
+        return self._cassette.read_page(self._page_file)
+
+    def _soup(self):
+        return BeautifulSoup(self.page_source, "html.parser")
+
+    def find_elements(self, by=By.ID, value=None):
+        soup = self._soup()
+        if by == By.ID:
+            tags = soup.find_all(id=value)
+        elif by == By.CLASS_NAME:
+            tags = soup.find_all(class_=value)
+        elif by == By.TAG_NAME:
+            tags = soup.find_all(value)
+        else:
+            tags = []
+        return [ReplayElement(tag) for tag in tags]
+
+    def find_element(self, by=By.ID, value=None):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"replay: {by}={value}")
+        return elements[0]
+
+    def execute_script(self, script, *args):
+        if "document.readyState" in script:
+            return "complete"
+        return None
+
+    def save_screenshot(self, path):
+        return False
+
+    def get_cookies(self):
+        return []
+
+    def delete_all_cookies(self):
+        pass
+
+    def add_cookie(self, cookie):
+        pass
+
+    def quit(self):
+        pass
+
+
+class ReplayWait:
+    """WebDriverWaitの代わりに条件を1回だけ評価する（再生結果は待っても変わらない）"""
+
+    def __init__(self, driver, timeout=None, *args, **kwargs):
+        self._driver = driver
+
+    def until(self, method, message=""):
+        try:
+            value = method(self._driver)
+        except NoSuchElementException:
+            value = None
+        if not value:
+            raise TimeoutException(message or "replay: condition not met")
+        return value
+
+
+def _build_response(exchange):
+    response = requests.Response()
+    response.status_code = exchange["status_code"]
+    response.reason = exchange["reason"]
+    response.url = exchange["url"]
+    response.headers.update(exchange["headers"])
+    response._content = base64.b64decode(exchange["content"])
+    response.encoding = "utf-8"
+    return response
+
+
+def patch_http(cassette, mode):
+    """requestsの通信を記録、または記録した応答で置き換える"""
+    original_request = requests.Session.request
+    replay_queues = {}
+    if mode == "replay":
+        for exchange in cassette.exchanges:
+            key = (exchange["method"], exchange["url"])
+            replay_queues.setdefault(key, []).append(exchange)
+
+    def recording_request(session, method, url, *args, **kwargs):
+        response = original_request(session, method, url, *args, **kwargs)
+        cassette.add_exchange(
+            method, url, response.status_code, response.reason,
+            response.headers, response.content,
+        )
+        return response
+
+    def replaying_request(session, method, url, *args, **kwargs):
+        queue = replay_queues.get((method.upper(), url))
+        if not queue:
+            raise requests.exceptions.ConnectionError(
+                f"replay: 記録されていない通信です ({method} {url})"
+            )
+        return _build_response(queue.pop(0) if len(queue) > 1 else queue[0])
+
+    requests.Session.request = recording_request if mode == "record" else replaying_request
+
+
+def patch_phase_timers(timings):
+    """main.pyの各処理を計測用の関数で包む"""
+
+    def timed(name, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.append((name, time.perf_counter() - start))
+        return wrapper
+
+    for name in PHASES:
+        setattr(mf, name, timed(name, getattr(mf, name)))
+    mf.CreateMonthlyBalancePage.main = timed(
+        "CreateMonthlyBalancePage.main", mf.CreateMonthlyBalancePage.main
+    )
+
+
+def record(cassette_path):
+    # LINE/Notionとの通信を実行中に記録するため、アウトボックスを使わず即時に送信する
+    os.environ["OUTBOX_ENABLED"] = "0"
+    cassette = Cassette(cassette_path)
+    cassette.create()
+    cassette.save_state()
+
+    original_create_webdriver = mf.create_webdriver
+    mf.create_webdriver = lambda: RecordingDriver(original_create_webdriver(), cassette)
+
+    original_is_payday = mf.CreateMonthlyBalancePage.is_payday
+
+    def recording_is_payday(self):
+        cassette.meta["is_payday"] = original_is_payday(self)
+        return cassette.meta["is_payday"]
+
+    mf.CreateMonthlyBalancePage.is_payday = recording_is_payday
+    patch_http(cassette, "record")
+
+    timings = []
+    patch_phase_timers(timings)
+    try:
+        mf.main()
+    finally:
+        cassette.meta["recorded_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        cassette.save()
+    return timings
+
+
+def replay(cassette_path, payday=None):
+    os.environ["OUTBOX_ENABLED"] = "0"
+    cassette = Cassette(cassette_path)
+    cassette.load()
+
+    # 認証情報がなくても実行できるようにダミー値を設定する
+    for name in ["EMAIL", "PASSWORD", "NOTION_KEY", "NOTION_PAGE_ID",
+                 "LINE_ACCESS_PARSE_MONEY_FORWORD_TOKEN", "USER_ID"]:
+        os.environ.setdefault(name, "replay")
+
+    # 月初の残高ページのIDや月の索引、履歴DBなどの状態ファイルは一時ディレクトリで扱う
+    workdir = tempfile.mkdtemp(prefix="mf_replay_")
+    cassette.restore_state(workdir)
+    os.chdir(workdir)
+
+    is_payday = cassette.meta.get("is_payday", False) if payday is None else payday
+    mf.CreateMonthlyBalancePage.is_payday = lambda self: is_payday
+
+    mf.create_webdriver = lambda: ReplayDriver(cassette)
+    mf.load_cookies = lambda file_path: []
+    mf.save_cookies = lambda driver, file_path: None
+    mf.WebDriverWait = ReplayWait
+    # 再生時の所要時間は実際の待ち時間と無関係なので、待機時間の記録には残さない
+    mf.latency.model = mf.latency.LatencyModel(os.path.join(workdir, "latency-model.json"))
+    # 再生した実行をメトリクスの累計に含めない
+    mf.metrics.METRICS_TEXTFILE = None
+    mf.time = types.SimpleNamespace(**{**vars(time), "sleep": lambda seconds: None})
+    patch_http(cassette, "replay")
+
+    timings = []
+    patch_phase_timers(timings)
+    start = time.perf_counter()
+    mf.main()
+    timings.append(("main", time.perf_counter() - start))
+    return timings
+
+
+def print_timings(timings):
+    print("\n処理時間:")
+    for name, seconds in timings:
+        print(f"  {name}: {seconds * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("cassette")
+    payday_group = parser.add_mutually_exclusive_group()
+    payday_group.add_argument("--payday", dest="payday", action="store_true", default=None,
+                              help="給料日として再生する")
+    payday_group.add_argument("--no-payday", dest="payday", action="store_false",
+                              help="給料日ではない日として再生する")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        print_timings(record(args.cassette))
+    else:
+        print_timings(replay(args.cassette, args.payday))
@@ -0,0 +1,81 @@
+"""実行をまたいで保持する状態ファイルの読み書き
+
+書き込みは同じディレクトリの一時ファイルに書いてから置き換えるため、
+途中で中断しても壊れたファイルが残らない。
+同時に実行された複数のプロセスの間では、ロックファイル（flock）で処理を1つずつにする。
+"""
+import fcntl
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+def atomic_write_bytes(path, data):
+    """ファイルをアトミックに書き込む"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path, data, indent=4):
+    """JSONファイルをアトミックに書き込む"""
+    atomic_write_bytes(path, json.dumps(data, ensure_ascii=False, indent=indent).encode("utf-8"))
+
+
+@contextmanager
+def file_lock(path, timeout=None, poll_interval=0.5):
+    """ロックファイルで他のプロセスと排他する
+
+    Args:
+        path (str): ロックファイルのパス
+        timeout (float, optional): ロックを待つ最大時間（秒）。Noneなら無制限に待つ。
+        poll_interval (float): ロックを確認する間隔（秒）
+
+    Yields:
+        bool: 他のプロセスの処理を待った場合はTrue
+
+    Raises:
+        TimeoutError: timeout以内にロックを取得できなかった場合
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    waited = False
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if not waited:
+                    print(f"他のプロセスの処理を待っています（{path}）")
+                waited = True
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"ロックを取得できませんでした: {path}")
+                time.sleep(poll_interval)
+        yield waited
+    finally:
+        # ロックはファイルを閉じると解除される
+        os.close(fd)
+
+
+def read_json(path, default=None):
+    """JSONファイルを読み込む（ファイルがない、または壊れている場合はdefault）"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
@@ -0,0 +1,110 @@
+"""依存関係のある処理を並行に実行する小さなタスクグラフ"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class TaskGraph:
+    """依存関係を満たしたタスクから順に並行実行する
+
+    同じresourceを指定したタスク（例: 1つしかないブラウザを操作するタスク）は同時に実行しない。
+    各タスクの関数には、依存先タスクの戻り値がdepsの順に位置引数で渡される。
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._resource_locks = {}
+        # 実行中のタスク名 → 開始時刻（time.monotonic）
+        self._running = {}
+        self._running_lock = threading.Lock()
+        self.durations = {}
+
+    def add(self, name, func, deps=(), resource=None):
+        """タスクを追加する
+
+        Args:
+            name (str): タスク名
+            func (callable): 実行する関数
+            deps (tuple of str): 依存先のタスク名（先に追加されている必要がある）
+            resource (str, optional): 排他的に使用するリソース名
+        """
+        for dep in deps:
+            if dep not in self._tasks:
+                raise ValueError(f"未登録のタスクに依存しています: {name} -> {dep}")
+        self._tasks[name] = (func, tuple(deps), resource)
+        if resource is not None:
+            self._resource_locks.setdefault(resource, threading.Lock())
+
+    def _run_task(self, name, args):
+        func, _, resource = self._tasks[name]
+        lock = self._resource_locks.get(resource)
+        if lock is not None:
+            lock.acquire()
+        with self._running_lock:
+            self._running[name] = time.monotonic()
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.durations[name] = time.perf_counter() - start
+            with self._running_lock:
+                self._running.pop(name, None)
+            if lock is not None:
+                lock.release()
+
+    def running_tasks(self):
+        """実行中（リソースの待ちを除く）のタスク名"""
+        with self._running_lock:
+            return tuple(self._running)
+
+    def running_since(self):
+        """実行中のタスク名 → 開始時刻（time.monotonic）"""
+        with self._running_lock:
+            return dict(self._running)
+
+    def run(self, max_workers=4):
+        """すべてのタスクを実行する
+
+        いずれかのタスクが失敗した場合は新しいタスクを開始せず、実行中のタスクの終了を待ってから
+        最初に発生した例外を送出する。待っている間に呼び出し元のスレッドで例外（打ち切りの
+        WatchdogTimeoutなど）が発生した場合は、実行中のタスクの終了を待たずに送出する。
+
+        Returns:
+            dict: タスク名 → 戻り値
+        """
+        results = {}
+        pending = dict(self._tasks)
+        running = {}
+        error = None
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while pending or running:
+                if error is None:
+                    for name, (_, deps, _) in list(pending.items()):
+                        if all(dep in results for dep in deps):
+                            args = [results[dep] for dep in deps]
+                            running[executor.submit(self._run_task, name, args)] = name
+                            del pending[name]
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        if error is None:
+                            error = e
+        except BaseException:
+            # 応答しないタスクがあっても呼び出し元でエラーを通知できるよう、終了を待たない
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+
+        if error is not None:
+            raise error
+
+        return results
@@ -0,0 +1,205 @@
+"""入出金明細をCSVのエクスポートで月ごとに取得し、履歴DBに保存する
+
+ログイン中のクッキーを引き継いだrequests.Sessionで月ごとのCSV（Shift_JIS）を1ファイルずつ取得する。
+レスポンスは読みながら文字コードを変換して1行ずつ解析し、TRANSACTIONS_BATCH_SIZE行ごとにDBへ書き込むため、
+ファイル全体をメモリに載せない。
+CSVのダウンロードはマネーフォワードのプレミアムプランの機能のため、TRANSACTIONS_MONTHSを指定した場合だけ行う。
+
+実行方法:
+    rye run python src/parsemoneyforward/transactions.py [取得する月数]
+"""
+import csv
+import datetime
+import io
+import os
+
+import history
+from month_registry import month_key
+
+# 取得する月数（今月を含む）。0なら取得しない
+TRANSACTIONS_MONTHS = int(os.environ.get("TRANSACTIONS_MONTHS", "0"))
+TRANSACTIONS_BATCH_SIZE = int(os.environ.get("TRANSACTIONS_BATCH_SIZE", "500"))
+TRANSACTIONS_ENCODING = "cp932"
+
+# CSVの見出し → 列名
+CSV_COLUMNS = {
+    "ID": "id",
+    "計算対象": "is_target",
+    "日付": "date",
+    "内容": "content",
+    "金額（円）": "amount",
+    "保有金融機関": "institution",
+    "大項目": "major_category",
+    "中項目": "minor_category",
+    "メモ": "memo",
+    "振替": "is_transfer",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    household TEXT NOT NULL,
+    id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    content TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    institution TEXT NOT NULL,
+    major_category TEXT NOT NULL,
+    minor_category TEXT NOT NULL,
+    memo TEXT NOT NULL,
+    is_target INTEGER NOT NULL,
+    is_transfer INTEGER NOT NULL,
+    PRIMARY KEY (household, id)
+);
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions (household, date);
+"""
+_INSERT = "INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+class CsvExportError(Exception):
+    """CSVを取得できなかった場合の例外"""
+
+
+def csv_url(base_url, year, month):
+    """月ごとのCSVのURL"""
+    return f"{base_url}/cf/csv?from={year:04d}/{month:02d}/01&month={month}&year={year}"
+
+
+def recent_months(count, today=None):
+    """今月を含む直近countか月の(年, 月)を古い順に返す"""
+    today = today or datetime.date.today()
+    months = []
+    year, month = today.year, today.month
+    for _ in range(count):
+        months.append((year, month))
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return months[::-1]
+
+
+def _flag(value):
+    return 1 if value.strip() == "1" else 0
+
+
+def iter_transactions(lines):
+    """CSVの行を1件ずつ辞書に変換する
+
+    Args:
+        lines (iterable of str): 文字コードを変換したCSVの行
+
+    Yields:
+        dict: 列名 → 値（金額は整数、日付はISO形式）
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [CSV_COLUMNS.get(name.strip().lstrip("\ufeff")) for name in header]
+    if "id" not in columns or "amount" not in columns:
+        raise CsvExportError(f"CSVの見出しが想定と異なります: {header}")
+
+    for row in reader:
+        if not row:
+            continue
+        values = {column: value for column, value in zip(columns, row) if column}
+        yield {
+            "id": values["id"],
+            "date": datetime.datetime.strptime(values["date"], "%Y/%m/%d").date().isoformat(),
+            "content": values.get("content", ""),
+            "amount": int(values["amount"].replace(",", "")),
+            "institution": values.get("institution", ""),
+            "major_category": values.get("major_category", ""),
+            "minor_category": values.get("minor_category", ""),
+            "memo": values.get("memo", ""),
+            "is_target": _flag(values.get("is_target", "1")),
+            "is_transfer": _flag(values.get("is_transfer", "0")),
+        }
+
+
+def store_transactions(transactions, household=None, db_path=None, batch_size=None):
+    """明細をバッチごとに履歴DBへ書き込む（同じIDは上書き）
+
+    Returns:
+        int: 書き込んだ件数
+    """
+    household = household or history.HOUSEHOLD
+    batch_size = batch_size or TRANSACTIONS_BATCH_SIZE
+    conn = history.connect(db_path)
+    conn.executescript(SCHEMA)
+    count = 0
+    try:
+        with conn:
+            batch = []
+            for transaction in transactions:
+                batch.append((
+                    household, transaction["id"], transaction["date"], transaction["content"],
+                    transaction["amount"], transaction["institution"], transaction["major_category"],
+                    transaction["minor_category"], transaction["memo"], transaction["is_target"],
+                    transaction["is_transfer"],
+                ))
+                if len(batch) >= batch_size:
+                    conn.executemany(_INSERT, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                conn.executemany(_INSERT, batch)
+                count += len(batch)
+    finally:
+        conn.close()
+    return count
+
+
+def download_month(session, base_url, year, month, household=None, db_path=None):
+    """1か月分のCSVを読みながら履歴DBに保存する
+
+    Returns:
+        int: 保存した件数
+
+    Raises:
+        CsvExportError: CSV以外（ログイン画面やプランの案内など）が返された場合
+    """
+    url = csv_url(base_url, year, month)
+    with session.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        content_type = response.headers.get("Content-Type", "")
+        if "html" in content_type:
+            raise CsvExportError(
+                f"CSVではなくHTMLが返されました（{response.url}）。"
+                "ログインが切れているか、プレミアムプランでない可能性があります。"
+            )
+        response.raw.decode_content = True
+        # 読み終えた時点でurllib3が閉じると、TextIOWrapperが最後の行を読めなくなる
+        response.raw.auto_close = False
+        lines = io.TextIOWrapper(response.raw, encoding=TRANSACTIONS_ENCODING, errors="replace", newline="")
+        return store_transactions(iter_transactions(lines), household, db_path)
+
+
+def download_transactions(session, base_url, months=None, household=None, db_path=None):
+    """直近の月のCSVを順に取得して保存する
+
+    Returns:
+        dict: "YYYY-MM" → 保存した件数
+    """
+    months = TRANSACTIONS_MONTHS if months is None else months
+    counts = {}
+    for year, month in recent_months(months):
+        counts[month_key(year, month)] = download_month(session, base_url, year, month, household, db_path)
+    return counts
+
+
+if __name__ == "__main__":
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv(verbose=True)
+    import main as mf
+
+    months = int(sys.argv[1]) if len(sys.argv) > 1 else max(TRANSACTIONS_MONTHS, 1)
+    mf.driver = mf.create_webdriver()
+    try:
+        mf.ensure_logged_in(os.environ["EMAIL"], os.environ["PASSWORD"])
+        session = mf.build_authenticated_session(mf.driver)
+    finally:
+        mf.driver.quit()
+        mf.stop_chrome_service()
+    for key, count in download_transactions(session, mf.MF_BASE_URL, months).items():
+        print(f"{key}: {count}件")
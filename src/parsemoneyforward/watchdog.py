@@ -0,0 +1,198 @@
+"""処理ごとと実行全体の制限時間を監視し、超えた場合は実行を打ち切る
+
+監視用のスレッドが処理（タスクグラフのタスクなど）の経過時間を確認し、制限時間を超えたら
+1. 応答しないブラウザを終了させるためのコールバック（chromedriverのプロセスツリーの強制終了）を呼び、
+2. メインスレッドにシグナルを送ってWatchdogTimeoutを発生させる。
+それでもWATCHDOG_GRACE秒以内に実行が終わらなければ、on_exit（メインスレッドが送れなかった
+エラーの通知など）を呼んでから、次の定期実行と重ならないようプロセスを終了する。
+"""
+import _thread
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# 実行全体の制限時間（秒）。0なら制限しない
+WATCHDOG_RUN_BUDGET = float(os.environ.get("WATCHDOG_RUN_BUDGET", "1200"))
+# 処理名=制限時間（秒）
+WATCHDOG_PHASE_BUDGETS = os.environ.get(
+    "WATCHDOG_PHASE_BUDGETS",
+    "login=720,reload=180,all_amount=120,expense=120,session=60,holdings=180,monthly_balance=180",
+)
+# WATCHDOG_PHASE_BUDGETSにない処理の制限時間（秒）。0なら制限しない
+WATCHDOG_DEFAULT_PHASE_BUDGET = float(os.environ.get("WATCHDOG_DEFAULT_PHASE_BUDGET", "300"))
+# 打ち切りを通知してからプロセスを終了するまでの猶予（秒）
+WATCHDOG_GRACE = float(os.environ.get("WATCHDOG_GRACE", "60"))
+WATCHDOG_INTERVAL = 1.0
+
+# 猶予を過ぎても終わらない場合の終了コード（timeoutコマンドと同じ）
+EXIT_CODE = 124
+
+
+class WatchdogTimeout(Exception):
+    """制限時間を超えた場合にメインスレッドで発生する例外"""
+
+
+def parse_budgets(spec=None):
+    """制限時間の設定を解析する
+
+    Returns:
+        dict: 処理名 → 制限時間（秒）
+    """
+    budgets = {}
+    for item in (WATCHDOG_PHASE_BUDGETS if spec is None else spec).split(","):
+        if "=" not in item:
+            continue
+        name, seconds = item.split("=", 1)
+        budgets[name.strip()] = float(seconds)
+    return budgets
+
+
+class Watchdog:
+    def __init__(self, on_abort=None, run_budget=None, phase_budgets=None, default_phase_budget=None,
+                 grace=None, on_exit=None):
+        """
+        Args:
+            on_abort (callable, optional): 打ち切る際に呼ぶ関数（応答しないブラウザの終了など）
+            run_budget (float, optional): 実行全体の制限時間（秒）
+            phase_budgets (dict, optional): 処理名 → 制限時間（秒）
+            default_phase_budget (float, optional): phase_budgetsにない処理の制限時間（秒）
+            grace (float, optional): 打ち切りを通知してからプロセスを終了するまでの猶予（秒）
+            on_exit (callable, optional): 猶予を過ぎてプロセスを終了する前に呼ぶ関数
+        """
+        self.on_abort = on_abort
+        self.on_exit = on_exit
+        self.run_budget = WATCHDOG_RUN_BUDGET if run_budget is None else run_budget
+        self.phase_budgets = parse_budgets() if phase_budgets is None else phase_budgets
+        self.default_phase_budget = (
+            WATCHDOG_DEFAULT_PHASE_BUDGET if default_phase_budget is None else default_phase_budget
+        )
+        self.grace = WATCHDOG_GRACE if grace is None else grace
+        # 制限時間を超えた処理の情報（超えていなければNone）
+        self.overrun = None
+        # Falseにすると、打ち切る際にメインスレッドへ例外を送らない（後片付けの途中など）
+        self.interruptible = True
+        self._sources = []
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_at = None
+        self._previous_handler = None
+
+    def budget_for(self, phase):
+        return self.phase_budgets.get(phase, self.default_phase_budget)
+
+    def watch(self, running_since):
+        """処理の経過時間の取得元を追加する
+
+        Args:
+            running_since (callable): 実行中の処理名 → 開始時刻（time.monotonic）を返す関数
+        """
+        self._sources.append(running_since)
+
+    @contextmanager
+    def phase(self, name):
+        """タスクグラフの外の処理を監視する"""
+        with self._lock:
+            self._phases[name] = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._phases.pop(name, None)
+
+    def start(self):
+        self._started_at = time.monotonic()
+        if threading.current_thread() is threading.main_thread():
+            self._previous_handler = signal.signal(signal.SIGUSR1, self._raise_timeout)
+        self._thread = threading.Thread(target=self._run, name="watchdog", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._previous_handler is not None:
+            signal.signal(signal.SIGUSR1, self._previous_handler)
+            self._previous_handler = None
+
+    def _raise_timeout(self, signum, frame):
+        if self.interruptible and self.overrun is not None:
+            raise WatchdogTimeout(self.report())
+
+    def running_phases(self):
+        with self._lock:
+            phases = dict(self._phases)
+        for source in self._sources:
+            phases.update(source())
+        return phases
+
+    def check(self, now=None):
+        """制限時間を超えた処理を返す
+
+        Returns:
+            dict: phase, elapsed, budget, running（その時点で実行中の処理）。超えていなければNone。
+        """
+        now = time.monotonic() if now is None else now
+        phases = self.running_phases()
+        running = sorted(phases)
+        for name, started_at in phases.items():
+            budget = self.budget_for(name)
+            if budget > 0 and now - started_at > budget:
+                return {"phase": name, "elapsed": now - started_at, "budget": budget, "running": running}
+        if self.run_budget > 0 and now - self._started_at > self.run_budget:
+            return {"phase": "run", "elapsed": now - self._started_at, "budget": self.run_budget, "running": running}
+        return None
+
+    def report(self):
+        if self.overrun is None:
+            return ""
+        overrun = self.overrun
+        target = "実行全体" if overrun["phase"] == "run" else f"処理 '{overrun['phase']}'"
+        running = ", ".join(overrun["running"]) or "なし"
+        return (
+            f"{target}が制限時間（{overrun['budget']:.0f}秒）を超えたため打ち切りました"
+            f"（経過 {overrun['elapsed']:.0f}秒、実行中の処理: {running}）"
+        )
+
+    def _run(self):
+        while not self._stop.wait(WATCHDOG_INTERVAL):
+            overrun = self.check()
+            if overrun is not None:
+                self._abort(overrun)
+                return
+
+    def _abort(self, overrun):
+        self.overrun = overrun
+        print(f"ウォッチドッグ: {self.report()}")
+        if self.on_abort is not None:
+            try:
+                self.on_abort(overrun)
+            except Exception as e:
+                print(f"ウォッチドッグ: 打ち切りの処理に失敗しました: {e}")
+
+        if self.interruptible:
+            if self._previous_handler is not None:
+                signal.pthread_kill(threading.main_thread().ident, signal.SIGUSR1)
+            else:
+                _thread.interrupt_main()
+
+        if not self._stop.wait(self.grace):
+            print(f"ウォッチドッグ: {self.grace:.0f}秒以内に終了しなかったため、プロセスを終了します")
+            if self.on_exit is not None:
+                try:
+                    self.on_exit(overrun)
+                except Exception as e:
+                    print(f"ウォッチドッグ: 終了前の処理に失敗しました: {e}")
+            self.exit()
+
+    def exit(self):
+        """応答しないスレッドの終了を待たずにプロセスを終了する"""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(EXIT_CODE)
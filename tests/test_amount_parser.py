@@ -0,0 +1,52 @@
+"""amount_parser.parse_amountの性質をhypothesisで確認する"""
+from hypothesis import given
+from hypothesis import strategies as st
+
+from amount_parser import parse_amount, parse_amounts
+
+MINUS_SIGNS = ["-", "−", "－", "▲", "△"]
+_FULL_WIDTH = str.maketrans({**{str(i): chr(ord("０") + i) for i in range(10)}, ",": "，"})
+
+
+@st.composite
+def amount_texts(draw):
+    """整数と、それをマネーフォワードの画面のように表記した文字列"""
+    value = draw(st.integers(min_value=-(10**15), max_value=10**15))
+    digits = f"{abs(value):,}" if draw(st.booleans()) else str(abs(value))
+    if draw(st.booleans()):
+        digits = digits.translate(_FULL_WIDTH)
+    sign = draw(st.sampled_from(MINUS_SIGNS)) if value < 0 else ""
+    yen = draw(st.sampled_from(["", "¥", "￥"]))
+    number = draw(st.sampled_from([sign + yen + digits, yen + sign + digits]))
+    suffix = draw(st.sampled_from(["", "円"]))
+    space = draw(st.sampled_from(["", " ", "\n    ", "　"]))
+    return value, f"{space}{number}{suffix}{space}"
+
+
+@given(amount_texts())
+def test_parse_amount_round_trip(case):
+    value, text = case
+    assert parse_amount(text) == value
+
+
+@given(st.text(alphabet=st.characters(blacklist_categories=("Nd",))))
+def test_parse_amount_without_digits_returns_default(text):
+    assert parse_amount(text, default=None) is None
+
+
+def test_parse_amount_takes_first_amount():
+    assert parse_amount("▲１，２３４円（前月比 +5,000円）") == -1234
+
+
+@given(st.lists(amount_texts()))
+def test_parse_amounts_matches_parse_amount(cases):
+    texts = [text for _, text in cases]
+    assert parse_amounts(texts) == [value for value, _ in cases]
+
+
+def test_parse_amounts_uses_default_for_missing_amounts():
+    assert parse_amounts(["", None, "取得日時", "▲１円"], default=None) == [None, None, None, -1]
+
+
+def test_parse_amounts_handles_separator_in_text():
+    assert parse_amounts(["１円\x002円", "△３円"]) == [1, -3]
@@ -0,0 +1,16 @@
+"""analytics.rolling_meanの確認"""
+import numpy as np
+import pytest
+
+from analytics import rolling_mean
+
+
+def test_rolling_mean_skips_nan():
+    result = rolling_mean([1.0, np.nan, 3.0, 5.0], 2)
+    np.testing.assert_allclose(result, [1.0, 1.0, 3.0, 4.0])
+
+
+@pytest.mark.parametrize("window", [0, -1])
+def test_rolling_mean_rejects_non_positive_window(window):
+    with pytest.raises(ValueError):
+        rolling_mean([1.0, 2.0], window)
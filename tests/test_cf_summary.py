@@ -0,0 +1,38 @@
+import datetime
+
+from cf_summary import MonthSummary, SummaryCache
+
+
+def summaries(expense_by_month):
+    return {key: MonthSummary(key, expense=expense) for key, expense in expense_by_month.items()}
+
+
+def test_current_month_is_not_frozen_even_when_not_latest(tmp_path):
+    cache = SummaryCache(str(tmp_path / "summary.json"))
+    today = datetime.date(2024, 10, 5)
+    # 来月の列が表示されていても、今月はまだ締まっていない
+    cache.update(summaries({"2024-09": 100, "2024-10": 10, "2024-11": 0}), today=today)
+    current = cache.update(summaries({"2024-09": 999, "2024-10": 20, "2024-11": 0}), today=today)
+
+    assert current.expense == 20
+
+    assert cache.months["2024-09"].expense == 100
+    assert cache.months["2024-10"].expense == 20
+    assert set(cache.closed) == {"2024-09"}
+
+    # 月が変わったら、締まった後の値を一度だけ記録する
+    cache.update(summaries({"2024-10": 30, "2024-11": 5}), today=datetime.date(2024, 11, 1))
+    cache.update(summaries({"2024-10": 999, "2024-11": 6}), today=datetime.date(2024, 11, 2))
+    assert cache.months["2024-10"].expense == 30
+    assert set(cache.closed) == {"2024-09", "2024-10"}
+
+
+def test_closed_months_survive_save_and_legacy_list_is_dropped(tmp_path):
+    cache = SummaryCache(str(tmp_path / "summary.json"))
+    cache.update(summaries({"2024-09": 100, "2024-10": 10}), today=datetime.date(2024, 10, 5))
+    cache.save()
+    assert SummaryCache(cache.path).load().closed == {"2024-09": "2024-10-05"}
+
+    with open(cache.path, "w", encoding="utf-8") as f:
+        f.write('{"closed": ["2024-10"], "months": {}}')
+    assert SummaryCache(cache.path).load().closed == {}
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from holdings import Holding, HoldingsCache, fetch_holdings
+
+URL = "https://moneyforward.com/accounts/show/abc"
+TABLE = """
+<table>
+  <tr><th>銘柄コード</th><th>銘柄名</th><th>保有数</th><th>評価額</th></tr>
+  <tr><td>1234</td><td>テスト株式</td><td>100</td><td>123,456円</td></tr>
+</table>
+"""
+LOGIN_URL = "https://id.moneyforward.com/sign_in"
+
+
+class FakeResponse:
+    def __init__(self, url, text):
+        self.url = url
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, url=URL, text=TABLE):
+        self.response = FakeResponse(url, text)
+        self.requested = []
+
+    def get(self, url, timeout=None):
+        self.requested.append(url)
+        return self.response
+
+
+def test_skips_fetch_while_updated_at_is_unchanged(tmp_path):
+    cache = HoldingsCache(str(tmp_path / "cache.json"))
+    updated_at = {URL: datetime(2024, 10, 18, 9, 30)}
+    expected = {URL: [Holding("1234", "テスト株式", 100, 123456, None)]}
+
+    session = FakeSession()
+    assert fetch_holdings(session, [URL], cache=cache, updated_at=updated_at) == expected
+    assert session.requested == [URL]
+
+    session = FakeSession()
+    cache = HoldingsCache(cache.path).load()
+    assert fetch_holdings(session, [URL], cache=cache, updated_at=updated_at) == expected
+    assert session.requested == []
+
+    fetch_holdings(session, [URL], cache=cache, updated_at={URL: datetime(2024, 10, 18, 10, 0)})
+    assert session.requested == [URL]
+
+
+def test_does_not_cache_login_page_or_page_without_table(tmp_path):
+    cache = HoldingsCache(str(tmp_path / "cache.json"))
+    updated_at = {URL: datetime(2024, 10, 18, 9, 30)}
+
+    assert fetch_holdings(FakeSession(url=LOGIN_URL), [URL], cache=cache, updated_at=updated_at) == {}
+    assert fetch_holdings(FakeSession(text="<p>メンテナンス中</p>"), [URL], cache=cache,
+                          updated_at=updated_at) == {URL: []}
+    assert HoldingsCache(cache.path).load().entries == {}
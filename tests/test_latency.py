@@ -0,0 +1,6 @@
+import latency
+
+
+def test_backoff_doubles_with_consecutive_failures_up_to_maximum():
+    assert [latency.backoff(failures, 5, maximum=30) for failures in range(1, 6)] == [5, 10, 20, 30, 30]
+
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+import requests
+
+import account_rules
+import cf_summary
+import freshness
+import history
+import holdings
+import month_registry
+import replay
+from accounts import AccountBook
+from month_registry import cycle_month_key
+
+mf = replay.mf
+
+RULES = {
+    "accounts": [
+        {"category": "銀行", "institution": "テスト銀行", "role": "asset", "payday": "bank"},
+        {"category": "カード", "institution": "テストカード", "role": "liability", "payday": "card"},
+    ],
+    "entries": [],
+}
+
+
+@pytest.fixture
+def restore_globals(monkeypatch, tmp_path):
+    """replay()が書き換える属性・環境変数・作業ディレクトリをテストの終了時に元に戻す"""
+    for name in replay.PHASES + ["main", "create_webdriver", "load_cookies", "save_cookies",
+                                 "WebDriverWait", "time"]:
+        monkeypatch.setattr(mf, name, getattr(mf, name))
+    for name in ["is_payday", "main"]:
+        monkeypatch.setattr(mf.CreateMonthlyBalancePage, name, getattr(mf.CreateMonthlyBalancePage, name))
+    monkeypatch.setattr(mf.latency, "model", mf.latency.model)
+    monkeypatch.setattr(mf.metrics, "METRICS_TEXTFILE", mf.metrics.METRICS_TEXTFILE)
+    monkeypatch.setattr(requests.Session, "request", requests.Session.request)
+    for module, name, _ in replay.STATE_FILES:
+        monkeypatch.setattr(module, name, getattr(module, name))
+    for name in ["OUTBOX_ENABLED", "EMAIL", "PASSWORD", "NOTION_KEY", "NOTION_PAGE_ID",
+                 "LINE_ACCESS_PARSE_MONEY_FORWORD_TOKEN", "USER_ID"]:
+        monkeypatch.setenv(name, "replay")
+    monkeypatch.chdir(tmp_path)
+
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def record_cassette(tmp_path, monkeypatch):
+    """記録時点の状態ファイルとNotionとの通信を持つカセットを作る"""
+    live = tmp_path / "live"
+    live.mkdir()
+    for module, name, filename in replay.STATE_FILES:
+        monkeypatch.setattr(module, name, str(live / filename))
+    # 記録の翌日以降に再生しても、索引の確認のための通信は発生しない
+    write_json(month_registry.MONTH_REGISTRY_PATH, {
+        "parent_page_id": "parent",
+        "months": {cycle_month_key(): {"id": "db-1", "title": "月次", "validated_at": 0}},
+    })
+    write_json(account_rules.ACCOUNT_RULES_PATH, RULES)
+
+    cassette = replay.Cassette(str(tmp_path / "cassette"))
+    cassette.create()
+    cassette.save_state()
+    notion = "https://api.notion.com"
+    cassette.add_exchange("POST", f"{notion}/v1/databases/db-1/query", 200, "OK",
+                          {"Content-Type": "application/json"},
+                          json.dumps({"results": [], "has_more": False}).encode())
+    cassette.add_exchange("POST", f"{notion}/v1/pages", 200, "OK",
+                          {"Content-Type": "application/json"},
+                          json.dumps({"id": "page-1"}).encode())
+    cassette.meta["is_payday"] = False
+    cassette.save()
+    return cassette.path
+
+
+def test_replay_payday_uses_recorded_state(tmp_path, monkeypatch, restore_globals):
+    cassette_path = record_cassette(tmp_path, monkeypatch)
+    results = {}
+
+    def run_monthly_balance():
+        all_amount = AccountBook()
+        all_amount.add("銀行", "テスト銀行", 300000, 0)
+        all_amount.add("カード", "テストカード", 50000, 80000)
+        page = mf.CreateMonthlyBalancePage("replay", "parent")
+        results["payday"] = page.is_payday()
+        # 月の索引が復元されていなければ記録されていない検索（POST /v1/search）で失敗する
+        results["balance"] = page.main(all_amount)
+
+    monkeypatch.setattr(mf, "main", run_monthly_balance)
+    replay.replay(cassette_path, payday=True)
+
+    assert results == {"payday": True, "balance": 300000 + 50000 + 30000}
+    # 状態ファイルは一時ディレクトリのものを使い、記録した環境のファイルは変更しない
+    for module, name, filename in replay.STATE_FILES:
+        assert not getattr(module, name).startswith(str(tmp_path / "live"))
+    with open(tmp_path / "live" / "month-databases.json", encoding="utf-8") as f:
+        assert f.read().count('"validated_at": 0') == 1